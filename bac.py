@@ -13,12 +13,27 @@ Uporaba:
 verzija = "v1.0.7"
 
 import argparse
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
 import json
 import os
+import re
+import select
 import shutil
+import signal
+import socket
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import tkinter as tk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from types import SimpleNamespace
 from tkinter import filedialog, messagebox, ttk
@@ -38,6 +53,366 @@ def normaliziraj_pot_argumenta(vrednost):
     return pot
 
 
+# Podmape, v katerih izdaje pogosto hranijo podnapise
+PODNAPISNE_MAPE = {"subs", "sub", "subtitles", "podnapisi"}
+
+# Končnice videov, ki si lahko lastijo podnapise v istem imeniku
+KONCNICE_VIDEA = {
+    ".mkv",
+    ".mp4",
+    ".avi",
+    ".mov",
+    ".wmv",
+    ".flv",
+    ".webm",
+    ".m4v",
+    ".mpeg",
+    ".mpg",
+    ".m2ts",
+    ".ts",
+}
+
+# Jezikovne oznake v imenih datotek in njihova prioriteta (nižja je boljša)
+JEZIKI_V_IMENIH = {
+    "slv": "slv",
+    "slo": "slv",
+    "sl": "slv",
+    "slovenian": "slv",
+    "slovenscina": "slv",
+    "hrv": "hrv",
+    "hr": "hrv",
+    "croatian": "hrv",
+    "srp": "srp",
+    "sr": "srp",
+    "serbian": "srp",
+    "bos": "bos",
+    "bs": "bos",
+    "bosnian": "bos",
+    "eng": "eng",
+    "en": "eng",
+    "english": "eng",
+    "deu": "deu",
+    "ger": "deu",
+    "de": "deu",
+    "german": "deu",
+    "ita": "ita",
+    "it": "ita",
+    "italian": "ita",
+    "fra": "fra",
+    "fre": "fra",
+    "fr": "fra",
+    "french": "fra",
+    "spa": "spa",
+    "es": "spa",
+    "spanish": "spa",
+}
+PRIORITETA_JEZIKOV_PODNAPISOV = {"slv": 0, "hrv": 1, "srp": 2, "bos": 3}
+
+# Pripona izhodov, ki jih zapiše obdelava -q (Film_bac.mkv, Film_bac_2.mkv)
+PRIPONA_IZHODA = re.compile(r"_bac(_\d+)?$")
+
+
+def izlusci_oznake(ime):
+    """Iz imena datoteke izlušči oznake za ujemanje videa in podnapisov.
+
+    Vrne slovar z naslovom, epizodo (SxxEyy), letom, skupino izdaje in jezikom.
+    """
+    stem = Path(ime).stem
+    besede = [b for b in re.split(r"[ ._\-\[\]()]+", stem) if b]
+
+    # Jezik je običajno ena od zadnjih besed (Film.slv.srt, 2_Slovenian.srt)
+    jezik = None
+    while besede and (
+        besede[-1].lower() in JEZIKI_V_IMENIH
+        or besede[-1].lower() in ("forced", "sdh", "cc")
+    ):
+        beseda = besede.pop().lower()
+        if jezik is None and beseda in JEZIKI_V_IMENIH:
+            jezik = JEZIKI_V_IMENIH[beseda]
+
+    epizoda = None
+    naslov_besede = []
+    leto = None
+    for i, beseda in enumerate(besede):
+        ujemanje = re.fullmatch(r"[Ss](\d{1,2})[Ee](\d{1,3})(?:-?[Ee]\d{1,3})*", beseda)
+        if not ujemanje:
+            ujemanje = re.fullmatch(r"(\d{1,2})x(\d{2,3})", beseda)
+        if ujemanje:
+            epizoda = f"S{int(ujemanje.group(1)):02d}E{int(ujemanje.group(2)):02d}"
+            break
+        if re.fullmatch(r"(19[3-9]\d|20\d\d)", beseda) and i > 0:
+            leto = beseda
+            break
+        if re.fullmatch(r"\d{3,4}[pPiI]|[0-9]+[kK]", beseda):
+            break
+        naslov_besede.append(beseda.lower())
+
+    if leto is None:
+        ujemanje = re.search(r"(?<!\d)(19[3-9]\d|20\d\d)(?!\d)", stem)
+        if ujemanje and ujemanje.start() > 0:
+            leto = ujemanje.group(1)
+
+    naslov = "".join(naslov_besede)
+    if naslov.isdigit() and len(naslov) <= 2:
+        # Imena kot "2_Slovenian.srt" nimajo naslova, samo zaporedno številko
+        naslov = ""
+
+    skupina = None
+    brez_jezika = re.sub(
+        r"([._ ](" + "|".join(sorted(JEZIKI_V_IMENIH, key=len, reverse=True)) + r"))+$",
+        "",
+        stem,
+        flags=re.IGNORECASE,
+    )
+    ujemanje = re.search(r"-([A-Za-z0-9]+)$", brez_jezika)
+    if ujemanje and (epizoda or leto):
+        skupina = ujemanje.group(1).lower()
+
+    return {
+        "naslov": naslov,
+        "epizoda": epizoda,
+        "leto": leto,
+        "skupina": skupina,
+        "jezik": jezik,
+    }
+
+
+class IndeksPodnapisov:
+    """Indeks podnapisov v imeniku in njegovih podmapah s podnapisi (Subs/ ...).
+
+    Imenik se pregleda enkrat, nato se posamezni video ujema z vsemi podnapisi
+    v indeksu brez ponovnega branja imenika. Indeks hrani tudi videe imenika
+    (brez izhodov _bac), da se ve, ali podnapis ustreza več videom.
+    """
+
+    def __init__(self, mapa, koncnice=(".srt",)):
+        self.mapa = mapa
+        self.vnosi = []
+        self.videi = []
+
+        try:
+            vnosi_mape = sorted(os.scandir(mapa), key=lambda v: v.name)
+        except OSError:
+            vnosi_mape = []
+
+        for vnos in vnosi_mape:
+            if vnos.is_file() and Path(vnos.name).suffix.lower() in koncnice:
+                self._dodaj(vnos.path, "")
+            elif (
+                vnos.is_file()
+                and Path(vnos.name).suffix.lower() in KONCNICE_VIDEA
+                and not PRIPONA_IZHODA.search(Path(vnos.name).stem)
+                and not ZACASNA_DATOTEKA.search(vnos.name)
+            ):
+                self.videi.append(vnos.path)
+            elif vnos.is_dir() and vnos.name.lower() in PODNAPISNE_MAPE:
+                for root, dirs, files in os.walk(vnos.path):
+                    dirs.sort()
+                    for datoteka in sorted(files):
+                        if Path(datoteka).suffix.lower() in koncnice:
+                            self._dodaj(
+                                os.path.join(root, datoteka),
+                                os.path.relpath(root, mapa),
+                            )
+
+    def _dodaj(self, pot, podmapa):
+        self.vnosi.append(
+            {
+                "pot": pot,
+                "stem": Path(pot).stem,
+                "podmapa": podmapa,
+                "oznake": izlusci_oznake(pot),
+            }
+        )
+
+    def _ocena(self, video_stem, video_oznake, vnos):
+        """Vrne oceno ujemanja podnapisa z videom ali None, če se ne ujemata."""
+        stem = vnos["stem"]
+        if not vnos["podmapa"]:
+            if stem == video_stem:
+                return 100
+            if stem.startswith(video_stem + ".") or stem.startswith(video_stem + "_"):
+                return 90
+
+        deli_podmape = Path(vnos["podmapa"]).parts
+        if len(deli_podmape) >= 2 and deli_podmape[-1] == video_stem:
+            # Subs/<ime videa>/2_Slovenian.srt
+            return 80
+
+        if PRIPONA_IZHODA.search(video_stem):
+            # Izhod _bac ima oznake izvora - podnapisi izvora so že v njem
+            return None
+
+        oznake = vnos["oznake"]
+        if (
+            oznake["naslov"]
+            and video_oznake["naslov"]
+            and oznake["naslov"] != video_oznake["naslov"]
+        ):
+            return None
+        if oznake["leto"] and video_oznake["leto"] and oznake["leto"] != video_oznake["leto"]:
+            return None
+
+        if oznake["epizoda"] or video_oznake["epizoda"]:
+            if oznake["epizoda"] != video_oznake["epizoda"]:
+                return None
+            ocena = 60
+        elif oznake["naslov"] and video_oznake["naslov"]:
+            ocena = 40
+        elif len(deli_podmape) == 1 and not oznake["naslov"] and len(self.videi) <= 1:
+            # Subs/2_Slovenian.srt ob eni sami izdaji filma
+            ocena = 20
+        else:
+            return None
+
+        if oznake["leto"] and oznake["leto"] == video_oznake["leto"]:
+            ocena += 10
+        if oznake["skupina"] and oznake["skupina"] == video_oznake["skupina"]:
+            ocena += 5
+        return ocena
+
+    def ujemanja(self, video_pot):
+        """Vrne seznam (ocena, prioriteta jezika, pot) za podnapise, ki ustrezajo videu."""
+        video_stem = Path(video_pot).stem
+        video_oznake = izlusci_oznake(video_pot)
+
+        rezultat = []
+        for vnos in self.vnosi:
+            ocena = self._ocena(video_stem, video_oznake, vnos)
+            if ocena is None or not os.path.exists(vnos["pot"]):
+                continue
+            jezik = vnos["oznake"]["jezik"]
+            prioriteta = PRIORITETA_JEZIKOV_PODNAPISOV.get(jezik, 5 if jezik is None else 9)
+            rezultat.append((ocena, prioriteta, vnos["pot"]))
+
+        rezultat.sort(key=lambda r: (-r[0], r[1], r[2]))
+        return rezultat
+
+    def poisci(self, video_pot, ujemanja=None):
+        """Vrne (najboljši podnapis ali None, seznam enakovrednih dvoumnih poti).
+
+        ujemanja so lahko že izračunana ujemanja(video_pot).
+        """
+        if ujemanja is None:
+            ujemanja = self.ujemanja(video_pot)
+        if not ujemanja:
+            return None, []
+
+        najboljsi = ujemanja[0]
+        enakovredni = [
+            pot for ocena, prioriteta, pot in ujemanja if (ocena, prioriteta) == najboljsi[:2]
+        ]
+        return najboljsi[2], enakovredni if len(enakovredni) > 1 else []
+
+    def drugi_videi(self, srt_pot, video_pot):
+        """Vrne ostale videe imenika, ki bi jim srt_pot lahko pripadal."""
+        return [
+            pot
+            for pot in self.videi
+            if os.path.abspath(pot) != os.path.abspath(video_pot)
+            and any(p == srt_pot for _, _, p in self.ujemanja(pot))
+        ]
+
+
+def jezik_podnapisov(srt_pot):
+    """Jezik SRT iz imena datoteke - brez oznake se privzame slovenščina."""
+    return izlusci_oznake(srt_pot)["jezik"] or "slv"
+
+
+# Kodeki besedilnih podnapisov, ki jih ffmpeg lahko izpiše kot SRT
+BESEDILNI_PODNAPISI = {"subrip", "srt", "ass", "ssa", "mov_text", "webvtt", "text"}
+
+
+def preberi_podnapise(pot):
+    """Prebere SRT kot besedilo - UTF-8 (z BOM ali brez), sicer cp1250."""
+    with open(pot, "rb") as f:
+        podatki = f.read()
+    try:
+        return podatki.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return podatki.decode("cp1250", errors="replace")
+
+
+def zgostitev_podnapisov(besedilo):
+    """Zgoščena vrednost besedila replik SRT, neodvisna od zapisa datoteke.
+
+    Zaporedne številke, časi, oznake oblikovanja (<i>, {\\an8}), konci vrstic
+    in presledki se ne upoštevajo, zato se zunanji SRT ujema s sledjo, ki jo
+    ffmpeg izpiše iz MKV.
+    """
+    replike = []
+    for vrstica in besedilo.replace("\r", "").split("\n"):
+        vrstica = vrstica.strip()
+        if not vrstica or vrstica.isdigit() or "-->" in vrstica:
+            continue
+        vrstica = " ".join(re.sub(r"<[^>]*>|\{[^}]*\}", "", vrstica).split())
+        if vrstica:
+            replike.append(vrstica)
+    return hashlib.sha1("\n".join(replike).encode("utf-8")).hexdigest()
+
+
+def zgostitve_vgrajenih_podnapisov(
+    ffmpeg, pot, sledi, zacasna_mapa=None, omejevalnik=None
+):
+    """Z enim prehodom ffmpeg izpiše besedilne podnapisne sledi v SRT.
+
+    Vrne zgoščene vrednosti (zgostitev_podnapisov) vseh izpisanih sledi.
+    """
+    indeksi = [
+        sled.get("index")
+        for sled in sledi
+        if sled.get("codec_type") == "subtitle"
+        and sled.get("codec_name", "").lower() in BESEDILNI_PODNAPISI
+    ]
+    if not indeksi:
+        return []
+
+    mapa = tempfile.mkdtemp(prefix="bac-podnapisi-", dir=zacasna_mapa)
+    try:
+        if "flatpak run" in ffmpeg:
+            ukaz = ffmpeg.split() + ["-v", "error", "-nostdin", "-y", "-i", pot]
+        else:
+            ukaz = [ffmpeg, "-v", "error", "-nostdin", "-y", "-i", pot]
+        for indeks in indeksi:
+            ukaz.extend(["-map", f"0:{indeks}", "-c:s", "subrip"])
+            ukaz.append(os.path.join(mapa, f"{indeks}.srt"))
+        zazeni_orodje(ukaz, omejevalnik)
+        return [
+            zgostitev_podnapisov(preberi_podnapise(os.path.join(mapa, f"{i}.srt")))
+            for i in indeksi
+        ]
+    finally:
+        shutil.rmtree(mapa, ignore_errors=True)
+
+
+def opis_sledi(sled, vir=0):
+    """Opis sledi ffprobe za primerjavo razporeditev.
+
+    Izvor (vir, indeks) loči sled iz vhodne datoteke od enake sledi iz
+    dodane datoteke; vir je indeks vhoda ali pot dodane datoteke.
+    """
+    oznake = sled.get("tags", {})
+    return {
+        "vrsta": sled.get("codec_type"),
+        "kodek": (sled.get("codec_name") or "").lower(),
+        "profil": sled.get("profile"),
+        "jezik": (oznake.get("language") or "und").lower(),
+        "privzeta": bool(sled.get("disposition", {}).get("default")),
+        "naslov": oznake.get("title", ""),
+        "kanali": sled.get("channels"),
+        "izvor": (vir, sled.get("index")),
+    }
+
+
+def razporeditev_sledi(sledi, vir=0):
+    """Razporeditev video, zvočnih in podnapisnih sledi v vrstnem redu."""
+    return [
+        opis_sledi(sled, vir)
+        for sled in sledi
+        if sled.get("codec_type") in ("video", "audio", "subtitle")
+    ]
+
+
 class BaMKV:
     def __init__(self, root, prisiljena_tema=None, zacetne_datoteke=None):
         self.root = root
@@ -47,6 +422,7 @@ class BaMKV:
 
         self.mkv_pot = None
         self.stevilke_sledi = []
+        self.sledi_mkv = []  # Rezultat zadnjega ffprobe za odprto MKV
         self.prisiljena_tema = prisiljena_tema
         self.zacetne_datoteke = zacetne_datoteke or []
         self._drag_drop_nastavljen = False
@@ -866,6 +1242,19 @@ class BaMKV:
 
         najdene = []
 
+        # Podnapise poišči prek indeksa (epizoda, leto, skupina, jezik, Subs/)
+        indeks = IndeksPodnapisov(mapa, koncnice_sub)
+        ujemanja = indeks.ujemanja(pot)
+        for _, _, dat_pot in ujemanja:
+            najdene.append(
+                {
+                    "vrsta": "Podnapisi",
+                    "pot": dat_pot,
+                    "ime": os.path.relpath(dat_pot, mapa),
+                }
+            )
+        _, dvoumni = indeks.poisci(pot, ujemanja)
+
         for datoteka in os.listdir(mapa):
             dat_pot = os.path.join(mapa, datoteka)
             if not os.path.isfile(dat_pot) or dat_pot == pot:
@@ -879,11 +1268,7 @@ class BaMKV:
                 or dat_stem.startswith(osnovni_ime + ".")
                 or dat_stem.startswith(osnovni_ime + "_")
             ):
-                if dat_suffix in koncnice_sub:
-                    najdene.append(
-                        {"vrsta": "Podnapisi", "pot": dat_pot, "ime": datoteka}
-                    )
-                elif dat_suffix in koncnice_audio:
+                if dat_suffix in koncnice_audio:
                     najdene.append({"vrsta": "Zvok", "pot": dat_pot, "ime": datoteka})
 
         # Dodaj video
@@ -904,9 +1289,10 @@ class BaMKV:
             )
 
         stevilo_sub = sum(1 for d in najdene if d["vrsta"] == "Podnapisi")
-        self.status.config(
-            text=f"Najdenih {len(najdene)} povezanih datotek ({stevilo_sub} podnapisov)"
-        )
+        sporocilo = f"Najdenih {len(najdene)} povezanih datotek ({stevilo_sub} podnapisov)"
+        if dvoumni:
+            sporocilo += f" - dvoumno ujemanje {len(dvoumni)} podnapisov, preverite izbiro"
+        self.status.config(text=sporocilo)
 
     def _drop_vhodne(self, dogodek):
         """Obdelaj povlečene datoteke v seznam vhodnih datotek."""
@@ -1122,11 +1508,11 @@ class BaMKV:
                         if "ffmpeg" in app.lower():
                             return f"flatpak run --command={ime} {app}"
 
-                # MKVToolNix flatpak
-                if ime == "mkvmerge":
+                # MKVToolNix flatpak (mkvmerge, mkvpropedit ...)
+                if ime.startswith("mkv"):
                     for app in aplikacije:
                         if "mkvtoolnix" in app.lower():
-                            return f"flatpak run --command=mkvmerge {app}"
+                            return f"flatpak run --command={ime} {app}"
         except (subprocess.TimeoutExpired, FileNotFoundError):
             pass
 
@@ -1150,6 +1536,7 @@ class BaMKV:
         self.ffmpeg = self._poisci_orodje("ffmpeg")
         self.ffprobe = self._poisci_orodje("ffprobe")
         self.mkvmerge = self._poisci_orodje("mkvmerge")
+        self.mkvpropedit = self._poisci_orodje("mkvpropedit")
 
         manjkajoca = []
         if not self.ffmpeg:
@@ -1174,6 +1561,7 @@ class BaMKV:
             print(f"  ffmpeg: {self.ffmpeg}")
             print(f"  ffprobe: {self.ffprobe}")
             print(f"  mkvmerge: {self.mkvmerge}")
+            print(f"  mkvpropedit: {self.mkvpropedit}")
 
     def _ustvari_vmesnik(self):
         """Ustvari glavni vmesnik."""
@@ -1365,6 +1753,20 @@ class BaMKV:
             okvir_gumbi, text="Počisti vse", command=self._pocisti_operacije
         ).pack(side="left", padx=2)
 
+        # Kodirniki zvoka so večinoma enonitni - vsaka sled v svojem procesu
+        self.vzporedni_zvok = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            okvir_gumbi,
+            text="Zvočne sledi pretvori vzporedno",
+            variable=self.vzporedni_zvok,
+        ).pack(side="left", padx=(10, 2))
+
+        # Skupna z zavihkom pretvorbe - video se kodira vzporedno po kosih
+        self.video_po_kosih = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            okvir_gumbi, text="Video kodiraj po kosih", variable=self.video_po_kosih
+        ).pack(side="left", padx=2)
+
         gumb_izvedi = ttk.Button(
             okvir_gumbi, text="▶ Izvedi vse", command=self._izvedi_operacije
         )
@@ -1578,8 +1980,395 @@ class BaMKV:
             "Dodaj zvok", f"{Path(pot).name} ({jezik})", {"pot": pot, "jezik": jezik}
         )
 
+    def _nacrtuj_operacije(self):
+        """Sestavi načrt z najmanj prehodi čez datoteko za čakajoče operacije.
+
+        Načini: "glava" (samo mkvpropedit), "mkvmerge" (en prehod brez
+        pretvorb), "ffmpeg" (en prehod s pretvorbo, izbiro sledi in
+        metapodatki hkrati) ali "vzporedno" (vsaka zvočna sled v svojem
+        procesu ffmpeg, nato en prehod z mkvmerge). Dodane podnapise tudi v
+        načinu "ffmpeg" doda mkvmerge (kodne tabele SRT, VobSub), zato je
+        takrat prehodov dva. Vsebuje tudi oceno prebranih in zapisanih bajtov.
+        """
+        nacrt = {
+            "odstrani": set(),
+            "jeziki": {},
+            "naslovi": {},
+            "privzete": {"video": None, "audio": None, "subtitle": None},
+            "zvok": {},
+            "video": {},
+            "dodatne": [],
+            "zamenjaj_podnapise": False,
+        }
+
+        for op in self.cakalne_operacije:
+            tip = op["tip"]
+            podatki = op["podatki"]
+
+            if tip == "Odstrani sled":
+                nacrt["odstrani"].add(str(podatki["stevilka"]))
+            elif tip == "Spremeni jezik":
+                nacrt["jeziki"][str(podatki["stevilka"])] = podatki["jezik"]
+            elif tip == "Spremeni naslov":
+                nacrt["naslovi"][str(podatki["stevilka"])] = podatki["naslov"]
+            elif tip == "Nastavi privzeto":
+                vrsta = podatki["vrsta"].lower()
+                if vrsta == "zvok":
+                    vrsta = "audio"
+                elif vrsta == "podnapisi":
+                    vrsta = "subtitle"
+                nacrt["privzete"][vrsta] = str(podatki["stevilka"])
+            elif tip == "Pretvori zvok":
+                nacrt["zvok"][str(podatki["stevilka"])] = podatki["kodek"]
+            elif tip == "Pretvori video":
+                nacrt["video"][str(podatki["stevilka"])] = podatki["kodek"]
+            elif tip == "Dodaj podnapise":
+                nacrt["dodatne"].append({"vrsta": "subtitle", **podatki})
+                if podatki.get("zamenjaj"):
+                    nacrt["zamenjaj_podnapise"] = True
+            elif tip == "Dodaj zvok":
+                nacrt["dodatne"].append({"vrsta": "audio", **podatki})
+
+        # Odstranjene sledi se ne pretvarjajo
+        for stevilka in nacrt["odstrani"]:
+            nacrt["zvok"].pop(stevilka, None)
+            nacrt["video"].pop(stevilka, None)
+
+        if len(nacrt["zvok"]) > 1 and not nacrt["video"] and self.vzporedni_zvok.get():
+            nacrt["nacin"] = "vzporedno"
+        elif nacrt["zvok"] or nacrt["video"]:
+            nacrt["nacin"] = "ffmpeg"
+        elif self.mkvpropedit and all(
+            op["tip"] in ("Spremeni jezik", "Spremeni naslov", "Nastavi privzeto")
+            for op in self.cakalne_operacije
+        ):
+            nacrt["nacin"] = "glava"
+        else:
+            nacrt["nacin"] = "mkvmerge"
+
+        # Ocena V/I za prehod čez celotno datoteko; mkvmerge v oznakah
+        # NUMBER_OF_BYTES zapiše velikost posamezne sledi
+        def bajti_sledi(sled):
+            for kljuc, vrednost in sled.get("tags", {}).items():
+                if kljuc.upper().startswith("NUMBER_OF_BYTES"):
+                    try:
+                        return int(vrednost)
+                    except ValueError:
+                        return 0
+            return 0
+
+        velikosti_dodatnih = {
+            dat["pot"]: os.path.getsize(dat["pot"])
+            for dat in nacrt["dodatne"]
+            if os.path.exists(dat["pot"])
+        }
+        branje = os.path.getsize(self.mkv_pot) + sum(velikosti_dodatnih.values())
+        izpuscene = sum(
+            bajti_sledi(sled)
+            for sled in self.sledi_mkv
+            if str(sled.get("index")) in nacrt["odstrani"]
+            or (nacrt["zamenjaj_podnapise"] and sled.get("codec_type") == "subtitle")
+        )
+        # Pretvorjen zvok namesto izvornih bajtov zapiše oceno po bitni
+        # hitrosti (FLAC in video približno toliko kot izvor)
+        trajanje = oceni_trajanje(self.sledi_mkv)
+        pretvorjeni = 0
+        for sled in self.sledi_mkv:
+            kodek = nacrt["zvok"].get(str(sled.get("index")))
+            if not kodek:
+                continue
+            if kodek == "flac":
+                pretvorjeni += bajti_sledi(sled)
+                continue
+            ocena = int((oceni_trajanje([sled]) or trajanje) * 192000 / 8)
+            izpuscene += bajti_sledi(sled) - ocena
+            pretvorjeni += ocena
+        pisanje = max(branje - izpuscene, 0)
+        if nacrt["nacin"] == "vzporedno":
+            # Vsak proces ffmpeg prebere celotno datoteko, mkvmerge pa
+            # prebere še izvor in vse zapisane .mka
+            branje += len(nacrt["zvok"]) * os.path.getsize(self.mkv_pot)
+            branje += pretvorjeni
+            pisanje += pretvorjeni
+        if nacrt["nacin"] == "ffmpeg" and any(
+            dat["vrsta"] == "subtitle" for dat in nacrt["dodatne"]
+        ):
+            # Vmesno datoteko ffmpeg mkvmerge prebere še enkrat
+            vmesna = pisanje - sum(
+                velikosti_dodatnih.get(dat["pot"], 0)
+                for dat in nacrt["dodatne"]
+                if dat["vrsta"] == "subtitle"
+            )
+            branje += vmesna
+            pisanje += vmesna
+        nacrt["branje"] = branje
+        nacrt["pisanje"] = pisanje
+        return nacrt
+
+    def _nacrtovana_razporeditev(self, nacrt):
+        """Razporeditev sledi, ki bi jo imel izhod načrta."""
+        razporeditev = []
+        for sled in self.sledi_mkv:
+            opis = opis_sledi(sled)
+            stevilka = str(sled.get("index"))
+            if opis["vrsta"] not in ("video", "audio", "subtitle"):
+                continue
+            if stevilka in nacrt["odstrani"] or (
+                opis["vrsta"] == "subtitle" and nacrt["zamenjaj_podnapise"]
+            ):
+                continue
+            if stevilka in nacrt["zvok"]:
+                opis["kodek"] = nacrt["zvok"][stevilka]
+            if stevilka in nacrt["video"]:
+                opis["kodek"] = nacrt["video"][stevilka]
+            if stevilka in nacrt["jeziki"]:
+                opis["jezik"] = nacrt["jeziki"][stevilka].lower()
+            if stevilka in nacrt["naslovi"]:
+                opis["naslov"] = nacrt["naslovi"][stevilka]
+            privzeta = nacrt["privzete"].get(opis["vrsta"])
+            if privzeta:
+                opis["privzeta"] = stevilka == privzeta
+            razporeditev.append(opis)
+
+        # Dodane datoteke so vedno nove sledi
+        for dat in nacrt["dodatne"]:
+            razporeditev.append({"vrsta": dat["vrsta"], "izvor": (dat["pot"], 0)})
+        return razporeditev
+
+    def _opisi_nacrt(self, nacrt):
+        """Vrne besedilo z izbranim načinom in oceno V/I za prikaz uporabniku."""
+
+        def velikost(bajti):
+            for enota in ("B", "KB", "MB"):
+                if bajti < 1024:
+                    return f"{bajti:.0f} {enota}"
+                bajti /= 1024
+            return f"{bajti:.1f} GB"
+
+        opisi = {
+            "glava": "urejanje glave z mkvpropedit (na mestu, brez kopiranja)",
+            "mkvmerge": "en prehod z mkvmerge",
+            "ffmpeg": "en prehod z ffmpeg (pretvorba, izbira sledi in metapodatki)",
+            "ffmpeg+podnapisi": "prehod z ffmpeg (pretvorba, izbira sledi in "
+            "metapodatki), nato dodani podnapisi z mkvmerge",
+            "vzporedno": f"vzporedna pretvorba {len(nacrt['zvok'])} zvočnih sledi "
+            "(ffmpeg), nato en prehod z mkvmerge",
+        }
+        nacin = nacrt["nacin"]
+        if nacin == "ffmpeg" and self._dodani_podnapisi(nacrt):
+            nacin = "ffmpeg+podnapisi"
+        return (
+            f"Načrt: {opisi[nacin]}\n"
+            f"Operacij: {len(self.cakalne_operacije)}\n\n"
+            f"Branje: ~{velikost(nacrt['branje'])}\n"
+            f"Pisanje: ~{velikost(nacrt['pisanje'])}"
+        )
+
+    def _ukaz_mkvmerge_nacrta(self, nacrt, ciljna_pot, pretvorjene=None):
+        """Sestavi mkvmerge ukaz za načrt brez pretvorb.
+
+        pretvorjene je {številka sledi: .mka} z že pretvorjenimi zvočnimi
+        sledmi, ki nadomestijo izvorne na istem mestu v vrstnem redu.
+        """
+        pretvorjene = pretvorjene or {}
+        if "flatpak run" in self.mkvmerge:
+            ukaz = self.mkvmerge.split() + ["-o", ciljna_pot]
+        else:
+            ukaz = [self.mkvmerge, "-o", ciljna_pot]
+
+        # Sledi za odstranitev (pretvorjene se vzamejo iz .mka)
+        odstrani = nacrt["odstrani"] | set(pretvorjene)
+        if odstrani:
+            ohranjene = {"video": [], "audio": [], "subtitle": []}
+            for s in self.sledi_mkv:
+                vrsta = s.get("codec_type")
+                if vrsta in ohranjene and str(s["index"]) not in odstrani:
+                    ohranjene[vrsta].append(str(s["index"]))
+
+            for vrsta, izbor, brez in (
+                ("video", "-d", "-D"),
+                ("audio", "-a", "-A"),
+                ("subtitle", "-s", "-S"),
+            ):
+                if ohranjene[vrsta]:
+                    ukaz.extend([izbor, ",".join(ohranjene[vrsta])])
+                else:
+                    ukaz.extend([brez])
+
+        # Spremembe jezika
+        for stevilka, jezik in nacrt["jeziki"].items():
+            ukaz.extend(["--language", f"{stevilka}:{jezik}"])
+
+        # Spremembe naslova
+        for stevilka, naslov in nacrt["naslovi"].items():
+            ukaz.extend(["--track-name", f"{stevilka}:{naslov}"])
+
+        # Privzete sledi
+        for vrsta, stevilka in nacrt["privzete"].items():
+            if stevilka:
+                ukaz.extend(["--default-track", f"{stevilka}:yes"])
+
+        if nacrt["zamenjaj_podnapise"]:
+            ukaz.extend(["--no-subtitles"])
+        ukaz.append(self.mkv_pot)
+
+        if pretvorjene:
+            # Pretvorjena sled ostane na mestu izvorne
+            vrstni_red = []
+            datoteke = {s: i for i, s in enumerate(pretvorjene, 1)}
+            for s in self.sledi_mkv:
+                stevilka = str(s.get("index"))
+                if stevilka in datoteke:
+                    vrstni_red.append(f"{datoteke[stevilka]}:0")
+                elif stevilka not in odstrani and not (
+                    s.get("codec_type") == "subtitle" and nacrt["zamenjaj_podnapise"]
+                ):
+                    vrstni_red.append(f"0:{stevilka}")
+            ukaz.extend(["--track-order", ",".join(vrstni_red)])
+
+        for stevilka, zvok_pot in pretvorjene.items():
+            if stevilka in nacrt["jeziki"]:
+                ukaz.extend(["--language", f"0:{nacrt['jeziki'][stevilka]}"])
+            if stevilka in nacrt["naslovi"]:
+                ukaz.extend(["--track-name", f"0:{nacrt['naslovi'][stevilka]}"])
+            if nacrt["privzete"]["audio"] == stevilka:
+                ukaz.extend(["--default-track", "0:yes"])
+            ukaz.append(zvok_pot)
+
+        ukaz.extend(self._argumenti_dodatnih(nacrt["dodatne"]))
+        return ukaz
+
+    @staticmethod
+    def _dodani_podnapisi(nacrt):
+        return [dat for dat in nacrt["dodatne"] if dat["vrsta"] == "subtitle"]
+
+    @staticmethod
+    def _argumenti_dodatnih(dodatne):
+        """Argumenti mkvmerge za dodane datoteke (jezik, privzeta sled)."""
+        argumenti = []
+        for dat in dodatne:
+            if dat.get("jezik"):
+                argumenti.extend(["--language", f"0:{dat['jezik']}"])
+            if dat.get("privzet"):
+                argumenti.extend(["--default-track", "0:yes"])
+            argumenti.append(dat["pot"])
+        return argumenti
+
+    def _ukaz_dodaj_podnapise(self, vhod, ciljna_pot, podnapisi):
+        """mkvmerge ukaz, ki izhodu ffmpeg doda podnapise iz datotek."""
+        if "flatpak run" in self.mkvmerge:
+            ukaz = self.mkvmerge.split() + ["-o", ciljna_pot, vhod]
+        else:
+            ukaz = [self.mkvmerge, "-o", ciljna_pot, vhod]
+        return ukaz + self._argumenti_dodatnih(podnapisi)
+
+    def _ukaz_ffmpeg_nacrta(self, nacrt, ciljna_pot, kodirani=None):
+        """Sestavi ffmpeg ukaz, ki v enem prehodu pretvori sledi in uveljavi
+        izbiro sledi, metapodatke, privzete sledi ter dodane zvočne datoteke.
+
+        Dodanih podnapisov ukaz ne vsebuje - te doda _ukaz_dodaj_podnapise.
+        kodirani je {številka sledi: pot} z videom, ki je že kodiran po kosih
+        in se samo kopira namesto izvorne sledi."""
+        kodirani = kodirani or {}
+        dodatne = [dat for dat in nacrt["dodatne"] if dat["vrsta"] != "subtitle"]
+        if "flatpak run" in self.ffmpeg:
+            ukaz = self.ffmpeg.split() + ["-i", self.mkv_pot]
+        else:
+            ukaz = [self.ffmpeg, "-i", self.mkv_pot]
+
+        # Vsi -i argumenti morajo biti pred opcijami za izhod
+        for dat in dodatne:
+            ukaz.extend(["-i", dat["pot"]])
+        vhodi_kodiranih = {}
+        for vhod, (stevilka, pot) in enumerate(kodirani.items(), 1):
+            vhodi_kodiranih[stevilka] = len(dodatne) + vhod
+            ukaz.extend(["-i", pot])
+        ukaz.extend(["-y", "-c", "copy"])
+
+        kodeki_zvoka = {"aac": "aac", "ac3": "ac3", "mp3": "libmp3lame"}
+
+        # Specifikatorji izhoda se nanašajo na indeks izhodne sledi, ki se
+        # zaradi odstranjenih sledi lahko razlikuje od vhodnega
+        izhod = 0
+        for sled in self.sledi_mkv:
+            stevilka = str(sled.get("index"))
+            vrsta = sled.get("codec_type")
+            if stevilka in nacrt["odstrani"]:
+                continue
+            if vrsta == "subtitle" and nacrt["zamenjaj_podnapise"]:
+                continue
+
+            if stevilka in kodirani:
+                ukaz.extend(["-map", f"{vhodi_kodiranih[stevilka]}:0"])
+                # Jezik in naslov sledi ostaneta iz izvorne datoteke
+                ukaz.extend([f"-map_metadata:s:{izhod}", f"0:s:{stevilka}"])
+            else:
+                ukaz.extend(["-map", f"0:{stevilka}"])
+            if stevilka in nacrt["zvok"]:
+                kodek = nacrt["zvok"][stevilka]
+                ukaz.extend([f"-c:{izhod}", kodeki_zvoka.get(kodek, "ac3")])
+                if kodek != "flac":
+                    ukaz.extend([f"-b:{izhod}", "192k"])
+            if stevilka in nacrt["video"] and stevilka not in kodirani:
+                kodek = KODIRNIKI_VIDEA.get(nacrt["video"][stevilka], "libx264")
+                ukaz.extend([f"-c:{izhod}", kodek, f"-crf:{izhod}", "23"])
+            if stevilka in nacrt["jeziki"]:
+                ukaz.extend(
+                    [f"-metadata:s:{izhod}", f"language={nacrt['jeziki'][stevilka]}"]
+                )
+            if stevilka in nacrt["naslovi"]:
+                ukaz.extend(
+                    [f"-metadata:s:{izhod}", f"title={nacrt['naslovi'][stevilka]}"]
+                )
+            if nacrt["privzete"].get(vrsta) == stevilka:
+                ukaz.extend([f"-disposition:{izhod}", "default"])
+            izhod += 1
+
+        for vhod, dat in enumerate(dodatne, 1):
+            ukaz.extend(["-map", f"{vhod}:0"])
+            if dat.get("jezik"):
+                ukaz.extend([f"-metadata:s:{izhod}", f"language={dat['jezik']}"])
+            if dat.get("privzet"):
+                ukaz.extend([f"-disposition:{izhod}", "default"])
+            izhod += 1
+
+        ukaz.append(ciljna_pot)
+        return ukaz
+
+    def _pretvori_zvok_vzporedno(self, nacrt, ciljna_pot):
+        """Vsako zvočno sled načrta pretvori v svoj .mka v ločenem procesu.
+
+        Vrne {številka sledi: .mka} v vrstnem redu sledi. Ob napaki počaka
+        na ostale procese, počisti vse začasne datoteke in napako sproži.
+        """
+        pretvorjene = {
+            stevilka: f"{ciljna_pot[:-4]}_{stevilka}_temp_audio.mka"
+            for stevilka in sorted(nacrt["zvok"], key=int)
+        }
+        ukazi = [
+            ukaz_samo_zvok(
+                self.ffmpeg,
+                self.mkv_pot,
+                zvok_pot,
+                [f"0:{stevilka}"],
+                KODIRNIKI_ZVOKA.get(nacrt["zvok"][stevilka], "ac3"),
+            )
+            for stevilka, zvok_pot in pretvorjene.items()
+        ]
+        try:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as izvajalec:
+                opravila = [izvajalec.submit(zazeni_orodje, ukaz) for ukaz in ukazi]
+                for opravilo in opravila:
+                    opravilo.result()
+        except (subprocess.CalledProcessError, OSError):
+            for zvok_pot in pretvorjene.values():
+                if os.path.exists(zvok_pot):
+                    os.remove(zvok_pot)
+            raise
+        return pretvorjene
+
     def _izvedi_operacije(self):
-        """Izvede vse čakajoče operacije."""
+        """Izvede vse čakajoče operacije po načrtu z najmanj prehodi."""
         if not self.mkv_pot:
             messagebox.showwarning("Opozorilo", "Najprej odprite MKV datoteko.")
             return
@@ -1602,6 +2391,37 @@ class BaMKV:
             )
             return
 
+        nacrt = self._nacrtuj_operacije()
+
+        if self._nacrtovana_razporeditev(nacrt) == razporeditev_sledi(self.sledi_mkv):
+            # Sledi, kodeki, jeziki in zastavice so že takšni, kot jih zahtevajo
+            # operacije - ponoven zapis datoteke ne bi ničesar spremenil
+            self._pocisti_operacije()
+            messagebox.showinfo(
+                "Ni sprememb",
+                "Datoteka že ustreza vsem čakajočim operacijam.\n\n"
+                "Ničesar ni treba zapisati.",
+            )
+            return
+
+        if nacrt["nacin"] == "glava":
+            # Jezik, naslov in privzeta sled so samo polja v glavi - mkvpropedit
+            # jih zapiše na mestu, brez ponovnega zapisa celotne datoteke
+            nacrt["nacin"] = "mkvmerge"
+            odgovor = messagebox.askyesnocancel(
+                "Urejanje na mestu",
+                "Operacije spreminjajo samo glavo datoteke.\n\n"
+                "Jih zapišem neposredno v odprto datoteko (brez kopiranja)?\n\n"
+                "Ne = shrani kot novo datoteko:\n" + self._opisi_nacrt(nacrt),
+            )
+            if odgovor is None:
+                return
+            if odgovor:
+                self._uredi_glavo()
+                return
+        elif not messagebox.askokcancel("Načrt obdelave", self._opisi_nacrt(nacrt)):
+            return
+
         # Ciljna datoteka
         osnovni_dir = os.path.dirname(self.mkv_pot)
         osnovni_ime = Path(self.mkv_pot).stem
@@ -1618,170 +2438,179 @@ class BaMKV:
         if not ciljna_pot.endswith(".mkv"):
             ciljna_pot += ".mkv"
 
-        self._nastavi_zasedeno("Izvajam operacije...")
+        if os.path.abspath(ciljna_pot) == os.path.abspath(self.mkv_pot):
+            messagebox.showerror("Napaka", "Ciljna datoteka ne sme biti enaka izvorni.")
+            return
 
+        pretvorjene = {}
+        kodiranja = []
+        podnapisi = self._dodani_podnapisi(nacrt)
+        cilj_ffmpeg = ciljna_pot
+        if nacrt["nacin"] == "ffmpeg" and podnapisi:
+            # Dodane podnapise nato iz vmesne datoteke doda mkvmerge
+            cilj_ffmpeg = ciljna_pot[:-4] + "_temp_tracks.mkv"
         try:
-            # Zberi podatke za mkvmerge
-            sledi_za_odstranitev = set()
-            spremembe_jezika = {}
-            spremembe_naslova = {}
-            privzete_sledi = {"video": None, "audio": None, "subtitle": None}
-            pretvorbe_zvoka = {}
-            pretvorbe_videa = {}
-            dodatne_datoteke = []
-
-            for op in self.cakalne_operacije:
-                tip = op["tip"]
-                podatki = op["podatki"]
-
-                if tip == "Odstrani sled":
-                    sledi_za_odstranitev.add(str(podatki["stevilka"]))
-                elif tip == "Spremeni jezik":
-                    spremembe_jezika[str(podatki["stevilka"])] = podatki["jezik"]
-                elif tip == "Spremeni naslov":
-                    spremembe_naslova[str(podatki["stevilka"])] = podatki["naslov"]
-                elif tip == "Nastavi privzeto":
-                    vrsta = podatki["vrsta"].lower()
-                    if vrsta == "zvok":
-                        vrsta = "audio"
-                    elif vrsta == "podnapisi":
-                        vrsta = "subtitle"
-                    privzete_sledi[vrsta] = str(podatki["stevilka"])
-                elif tip == "Pretvori zvok":
-                    pretvorbe_zvoka[str(podatki["stevilka"])] = podatki["kodek"]
-                elif tip == "Pretvori video":
-                    pretvorbe_videa[str(podatki["stevilka"])] = podatki["kodek"]
-                elif tip == "Dodaj podnapise":
-                    dodatne_datoteke.append({"vrsta": "subtitle", **podatki})
-                elif tip == "Dodaj zvok":
-                    dodatne_datoteke.append({"vrsta": "audio", **podatki})
-
-            zamenjaj_vse_podnapise = any(
-                op["tip"] == "Dodaj podnapise" and op["podatki"].get("zamenjaj")
-                for op in self.cakalne_operacije
-            )
-
-            # Če je potrebna pretvorba zvoka, najprej uporabi ffmpeg
-            vhodna_datoteka = self.mkv_pot
-            zacasna_pot = None
-
-            if (pretvorbe_zvoka or pretvorbe_videa) and self.ffmpeg:
-                self._nastavi_zasedeno("Pretvarjam izbrane sledi...")
-                zacasna_pot = ciljna_pot.replace(".mkv", "_temp_tracks.mkv")
-
-                if "flatpak run" in self.ffmpeg:
-                    ukaz_ff = self.ffmpeg.split() + ["-i", self.mkv_pot, "-y"]
-                else:
-                    ukaz_ff = [self.ffmpeg, "-i", self.mkv_pot, "-y"]
-
-                # Kopiraj vse sledi, pretvori le označene
-                ukaz_ff.extend(["-map", "0", "-c", "copy"])
-
-                for stevilka, kodek in pretvorbe_zvoka.items():
-                    kodeki_map = {"aac": "aac", "ac3": "ac3", "mp3": "libmp3lame"}
-                    ukaz_ff.extend([f"-c:{stevilka}", kodeki_map.get(kodek, "ac3")])
-                    if kodek != "flac":
-                        ukaz_ff.extend([f"-b:{stevilka}", "192k"])
-
-                kodeki_videa = {
-                    "h264": "libx264",
-                    "hevc": "libx265",
-                    "vp9": "libvpx-vp9",
-                }
-                for stevilka, kodek in pretvorbe_videa.items():
-                    ukaz_ff.extend(
-                        [f"-c:{stevilka}", kodeki_videa.get(kodek, "libx264"), "-crf", "23"]
+            po_kosih = self.video_po_kosih.get() and nacrt["video"]
+            if nacrt["nacin"] == "ffmpeg" and po_kosih:
+                kodirani = {}
+                for stevilka, kodek in nacrt["video"].items():
+                    self._nastavi_zasedeno(f"Kodiram sled {stevilka} po kosih...")
+                    # Vsaka video sled ima svojo delovno mapo ob cilju
+                    cilj = ciljna_pot
+                    if len(nacrt["video"]) > 1:
+                        cilj = f"{ciljna_pot[:-4]}_{stevilka}.mkv"
+                    kodiranje = KosovnoKodiranje(
+                        self.ffmpeg,
+                        self.mkv_pot,
+                        cilj,
+                        ["-c:v", KODIRNIKI_VIDEA.get(kodek, "libx264"), "-crf", "23"],
+                        preslikava=f"0:{stevilka}",
+                        ffprobe=self.ffprobe,
                     )
-
-                ukaz_ff.append(zacasna_pot)
-                subprocess.run(ukaz_ff, check=True, capture_output=True)
-                vhodna_datoteka = zacasna_pot
-
-            self._nastavi_zasedeno("Združujem s pomočjo mkvmerge...")
-
-            # Pripravi mkvmerge ukaz
-            if "flatpak run" in self.mkvmerge:
-                ukaz = self.mkvmerge.split() + ["-o", ciljna_pot]
+                    if not self._pripravi_kodiranje(kodiranje):
+                        self._nastavi_prosto("Preklicano.")
+                        return
+                    kodiranja.append(kodiranje)
+                    kodirani[stevilka] = kodiranje.kodiraj()
+                self._nastavi_zasedeno("Združujem v enem prehodu...")
+                ukaz = self._ukaz_ffmpeg_nacrta(nacrt, cilj_ffmpeg, kodirani)
+            elif nacrt["nacin"] == "ffmpeg":
+                self._nastavi_zasedeno("Pretvarjam in združujem v enem prehodu...")
+                ukaz = self._ukaz_ffmpeg_nacrta(nacrt, cilj_ffmpeg)
+            elif nacrt["nacin"] == "vzporedno":
+                self._nastavi_zasedeno(
+                    f"Vzporedno pretvarjam {len(nacrt['zvok'])} zvočnih sledi..."
+                )
+                pretvorjene = self._pretvori_zvok_vzporedno(nacrt, ciljna_pot)
+                self._nastavi_zasedeno("Združujem s pomočjo mkvmerge...")
+                ukaz = self._ukaz_mkvmerge_nacrta(nacrt, ciljna_pot, pretvorjene)
             else:
-                ukaz = [self.mkvmerge, "-o", ciljna_pot]
+                self._nastavi_zasedeno("Združujem s pomočjo mkvmerge...")
+                ukaz = self._ukaz_mkvmerge_nacrta(nacrt, ciljna_pot)
+
+            zazeni_orodje(ukaz)
+            if cilj_ffmpeg != ciljna_pot:
+                self._nastavi_zasedeno("Dodajam podnapise s pomočjo mkvmerge...")
+                zazeni_orodje(
+                    self._ukaz_dodaj_podnapise(cilj_ffmpeg, ciljna_pot, podnapisi)
+                )
+            for kodiranje in kodiranja:
+                kodiranje.pocisti()
 
-            # Sledi za odstranitev
-            if sledi_za_odstranitev:
-                vse_sledi = self._pridobi_informacije()
-                video_sledi = [
-                    str(s["index"])
-                    for s in vse_sledi
-                    if s.get("codec_type") == "video"
-                    and str(s["index"]) not in sledi_za_odstranitev
-                ]
-                audio_sledi = [
-                    str(s["index"])
-                    for s in vse_sledi
-                    if s.get("codec_type") == "audio"
-                    and str(s["index"]) not in sledi_za_odstranitev
-                ]
-                sub_sledi = [
-                    str(s["index"])
-                    for s in vse_sledi
-                    if s.get("codec_type") == "subtitle"
-                    and str(s["index"]) not in sledi_za_odstranitev
-                ]
+            self._pocisti_operacije()
+            self._nastavi_prosto("Operacije uspešno izvedene.")
+            messagebox.showinfo(
+                "Uspeh",
+                f"Vse operacije uspešno izvedene!\n\nShranjeno v:\n{ciljna_pot}",
+            )
 
-                if video_sledi:
-                    ukaz.extend(["-d", ",".join(video_sledi)])
-                else:
-                    ukaz.extend(["-D"])
-                if audio_sledi:
-                    ukaz.extend(["-a", ",".join(audio_sledi)])
-                else:
-                    ukaz.extend(["-A"])
-                if sub_sledi:
-                    ukaz.extend(["-s", ",".join(sub_sledi)])
-                else:
-                    ukaz.extend(["-S"])
+        except subprocess.CalledProcessError as e:
+            napaka = e.stderr.decode(errors="replace") if e.stderr else str(e)
+            self._nastavi_prosto("Napaka pri izvajanju.")
+            messagebox.showerror(
+                "Napaka",
+                f"Napaka pri izvajanju operacij:\n{napaka}"
+                + self._opis_nadaljevanja(kodiranja),
+            )
+        except (IzgubljeneSlicice, DrugacneNastavitve, OSError, KeyError) as e:
+            # Napake delovne mape kosov (npr. ob nadaljevanju kodiranja)
+            self._nastavi_prosto("Napaka pri izvajanju.")
+            messagebox.showerror(
+                "Napaka",
+                f"Napaka pri izvajanju operacij:\n{e}"
+                + self._opis_nadaljevanja(kodiranja),
+            )
+        finally:
+            for pot in list(pretvorjene.values()) + [cilj_ffmpeg]:
+                if pot != ciljna_pot and os.path.exists(pot):
+                    os.remove(pot)
 
-            # Spremembe jezika
-            for stevilka, jezik in spremembe_jezika.items():
-                ukaz.extend(["--language", f"{stevilka}:{jezik}"])
+    def _pripravi_kodiranje(self, kodiranje):
+        """Pripravi delovno mapo kodiranja po kosih - vrne False ob preklicu.
 
-            # Spremembe naslova
-            for stevilka, naslov in spremembe_naslova.items():
-                ukaz.extend(["--track-name", f"{stevilka}:{naslov}"])
+        Prekinjeno kodiranje z enakimi nastavitvami se nadaljuje, mapo z
+        drugačnimi nastavitvami ali iz drugega vira pa zavrže šele uporabnik.
+        """
+        try:
+            kodirani, vseh = kodiranje.pripravi()
+        except DrugacneNastavitve as e:
+            if not messagebox.askyesno(
+                "Drugačne nastavitve",
+                f"Delovna mapa prekinjenega kodiranja\n{kodiranje.mapa}\n\n"
+                "je nastala z drugimi nastavitvami kodirnika ali iz drugega "
+                f"vira (kodiranih kosov: {e.koncanih}).\n\n"
+                "Jo zavržem in začnem znova?",
+            ):
+                return False
+            kodiranje.pocisti()
+            kodirani, vseh = kodiranje.pripravi()
+        if kodirani:
+            self._nastavi_zasedeno(
+                f"Nadaljujem kodiranje ({kodirani} od {vseh} kosov že kodiranih)..."
+            )
+        return True
 
-            # Privzete sledi
-            for vrsta, stevilka in privzete_sledi.items():
-                if stevilka:
-                    ukaz.extend(["--default-track", f"{stevilka}:yes"])
+    def _opis_nadaljevanja(self, kodiranja):
+        """Besedilo o ohranjenih kosih za sporočilo o napaki."""
+        mape = [k.mapa for k in kodiranja if os.path.isdir(k.mapa)]
+        if not mape:
+            return ""
+        return (
+            "\n\nKodirani kosi so ohranjeni v:\n"
+            + "\n".join(mape)
+            + "\n\nPonovni zagon z enakimi nastavitvami nadaljuje kodiranje."
+        )
 
-            if zamenjaj_vse_podnapise:
-                ukaz.extend(["--no-subtitles"])
-            ukaz.append(vhodna_datoteka)
+    def _uredi_glavo(self):
+        """Z mkvpropedit na mestu zapiše jezik, naslov in privzete sledi."""
+        self._nastavi_zasedeno("Urejam glavo datoteke...")
 
-            # Dodatne datoteke
-            for dat in dodatne_datoteke:
-                if dat.get("jezik"):
-                    ukaz.extend(["--language", f"0:{dat['jezik']}"])
-                if dat.get("privzet"):
-                    ukaz.extend(["--default-track", "0:yes"])
-                ukaz.append(dat["pot"])
+        try:
+            vrste = {str(s["index"]): s.get("codec_type") for s in self.sledi_mkv}
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            if "flatpak run" in self.mkvpropedit:
+                ukaz = self.mkvpropedit.split() + [self.mkv_pot]
+            else:
+                ukaz = [self.mkvpropedit, self.mkv_pot]
 
-            # Počisti začasne datoteke
-            if zacasna_pot and os.path.exists(zacasna_pot):
-                os.remove(zacasna_pot)
+            # mkvpropedit šteje sledi od 1, ffprobe od 0
+            for op in self.cakalne_operacije:
+                podatki = op["podatki"]
+                stevilka = str(podatki["stevilka"])
+                izbor = ["--edit", f"track:{int(stevilka) + 1}"]
+
+                if op["tip"] == "Spremeni jezik":
+                    ukaz.extend(izbor + ["--set", f"language={podatki['jezik']}"])
+                elif op["tip"] == "Spremeni naslov":
+                    if podatki["naslov"]:
+                        ukaz.extend(izbor + ["--set", f"name={podatki['naslov']}"])
+                    else:
+                        ukaz.extend(izbor + ["--delete", "name"])
+                elif op["tip"] == "Nastavi privzeto":
+                    # Ostale sledi iste vrste niso več privzete
+                    for druga, vrsta in vrste.items():
+                        if druga != stevilka and vrsta == vrste.get(stevilka):
+                            ukaz.extend(
+                                ["--edit", f"track:{int(druga) + 1}"]
+                                + ["--set", "flag-default=0"]
+                            )
+                    ukaz.extend(izbor + ["--set", "flag-default=1"])
+
+            # Trdo povezane kopije se ne smejo spremeniti skupaj z odprto
+            razdruzi_povezavo(self.mkv_pot)
+            zazeni_orodje(ukaz)
 
             self._pocisti_operacije()
-            self._nastavi_prosto("Operacije uspešno izvedene.")
+            self._osvezi_sledi()
+            self._nastavi_prosto("Glava datoteke posodobljena.")
             messagebox.showinfo(
-                "Uspeh",
-                f"Vse operacije uspešno izvedene!\n\nShranjeno v:\n{ciljna_pot}",
+                "Uspeh", f"Spremembe zapisane na mestu v:\n{self.mkv_pot}"
             )
-
-        except subprocess.CalledProcessError as e:
-            napaka = e.stderr.decode() if e.stderr else str(e)
-            self._nastavi_prosto("Napaka pri izvajanju.")
-            messagebox.showerror("Napaka", f"Napaka pri izvajanju operacij:\n{napaka}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            napaka = getattr(e, "stderr", None)
+            napaka = napaka.decode(errors="replace") if napaka else str(e)
+            self._nastavi_prosto("Napaka pri urejanju glave.")
+            messagebox.showerror("Napaka", f"Napaka pri urejanju glave:\n{napaka}")
 
     def _ustvari_podnapisi(self, okvir):
         """Ustvari zavihek za dodajanje podnapisov."""
@@ -1900,6 +2729,12 @@ class BaMKV:
         self.video_crf.set("23 (srednja)")
         self.video_crf.grid(row=1, column=1, sticky="w", padx=10, pady=5)
 
+        ttk.Checkbutton(
+            okvir_video,
+            text="Kodiraj po kosih vzporedno (na vseh jedrih)",
+            variable=self.video_po_kosih,
+        ).grid(row=2, column=0, columnspan=2, sticky="w", pady=5)
+
         ttk.Button(okvir, text="Pretvori in shrani", command=self._pretvori).pack(
             pady=20
         )
@@ -2154,13 +2989,13 @@ class BaMKV:
 
                 ukaz.append(pot)
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            zazeni_orodje(ukaz)
             self._nastavi_prosto("MKV ustvarjen.")
             messagebox.showinfo(
                 "Uspeh", f"MKV uspešno ustvarjen!\n\nShranjeno v:\n{ciljna_pot}"
             )
         except subprocess.CalledProcessError as e:
-            napaka = e.stderr.decode() if e.stderr else str(e)
+            napaka = e.stderr.decode(errors="replace") if e.stderr else str(e)
             self._nastavi_prosto("Napaka pri ustvarjanju.")
             messagebox.showerror("Napaka", f"Napaka pri ustvarjanju MKV:\n{napaka}")
 
@@ -2492,77 +3327,7 @@ class BaMKV:
 
         self.vnos_hitro_video.delete(0, tk.END)
         self.vnos_hitro_video.insert(0, pot)
-
-        # Počisti prejšnje
-        for vrstica in self.drevo_hitro.get_children():
-            self.drevo_hitro.delete(vrstica)
-        self.hitro_datoteke.clear()
-        self.hitro_izbrane.clear()
-
-        # Poišči povezane datoteke
-        mapa = os.path.dirname(pot)
-        osnovni_ime = Path(pot).stem
-
-        # Končnice podnapisov
-        koncnice_sub = [".srt", ".ass", ".ssa", ".sub", ".vtt", ".txt"]
-        # Končnice zvoka
-        koncnice_audio = [
-            ".mp3",
-            ".aac",
-            ".ac3",
-            ".flac",
-            ".ogg",
-            ".wav",
-            ".m4a",
-            ".opus",
-            ".dts",
-        ]
-
-        najdene = []
-
-        # Poišči datoteke z istim osnovnim imenom
-        for datoteka in os.listdir(mapa):
-            dat_pot = os.path.join(mapa, datoteka)
-            if not os.path.isfile(dat_pot) or dat_pot == pot:
-                continue
-
-            dat_stem = Path(datoteka).stem
-            dat_suffix = Path(datoteka).suffix.lower()
-
-            # Preveri ali se ime ujema (tudi z dodatki kot .sl, .en, itd.)
-            if (
-                dat_stem == osnovni_ime
-                or dat_stem.startswith(osnovni_ime + ".")
-                or dat_stem.startswith(osnovni_ime + "_")
-            ):
-                if dat_suffix in koncnice_sub:
-                    najdene.append(
-                        {"vrsta": "Podnapisi", "pot": dat_pot, "ime": datoteka}
-                    )
-                elif dat_suffix in koncnice_audio:
-                    najdene.append({"vrsta": "Zvok", "pot": dat_pot, "ime": datoteka})
-
-        # Dodaj video
-        self.hitro_datoteke.append(
-            {"vrsta": "Video", "pot": pot, "ime": Path(pot).name}
-        )
-        self.hitro_izbrane.add("0")
-        self.drevo_hitro.insert(
-            "", "end", iid="0", values=("☑", "Video", Path(pot).name)
-        )
-
-        # Dodaj najdene
-        for i, dat in enumerate(najdene, start=1):
-            self.hitro_datoteke.append(dat)
-            self.hitro_izbrane.add(str(i))
-            self.drevo_hitro.insert(
-                "", "end", iid=str(i), values=("☑", dat["vrsta"], dat["ime"])
-            )
-
-        stevilo_sub = sum(1 for d in najdene if d["vrsta"] == "Podnapisi")
-        self.status.config(
-            text=f"Najdenih {len(najdene)} povezanih datotek ({stevilo_sub} podnapisov)"
-        )
+        self._poisci_povezane_hitro(pot)
 
     def _preklopi_hitro_izbiro(self, dogodek):
         """Preklopi izbiro datoteke."""
@@ -2583,8 +3348,15 @@ class BaMKV:
 
     def _pridobi_audio_podatke(self, pot):
         """Pridobi audio kodek in indeks prvega audio streama - vrne (kodek, indeks)."""
+        for sled in self._pridobi_sledi(pot):
+            if sled.get("codec_type") == "audio":
+                return sled.get("codec_name"), sled.get("index")
+        return None, None
+
+    def _pridobi_sledi(self, pot):
+        """Pridobi seznam sledi (ffprobe streams) poljubne video datoteke."""
         if not self.ffprobe:
-            return None, None
+            return []
 
         try:
             if "flatpak run" in self.ffprobe:
@@ -2601,13 +3373,34 @@ class BaMKV:
                 ]
 
             rezultat = subprocess.run(ukaz, capture_output=True, text=True, check=True)
-            podatki = json.loads(rezultat.stdout)
-            for sled in podatki.get("streams", []):
-                if sled.get("codec_type") == "audio":
-                    return sled.get("codec_name"), sled.get("index")
-            return None, None
+            return json.loads(rezultat.stdout).get("streams", [])
         except Exception:
-            return None, None
+            return []
+
+    def _hitra_pretvorba_brez_sprememb(self, video_pot, izbrane):
+        """Ali bi hitra pretvorba MKV samo prepisala z enakimi sledmi."""
+        if Path(video_pot).suffix.lower() != ".mkv" or len(izbrane) > 1:
+            # Zamenjava vsebnika ali dodane datoteke vedno spremenijo izhod
+            return False
+
+        sledi = self._pridobi_sledi(video_pot)
+        if not sledi:
+            return False
+        trenutna = razporeditev_sledi(sledi)
+        prvi_audio = next(
+            (o["izvor"][1] for o in trenutna if o["vrsta"] == "audio"), None
+        )
+        nacrtovana = []
+        for opis in trenutna:
+            if opis["vrsta"] == "subtitle" and self.hitro_izpusti_podnapise.get():
+                continue
+            if opis["vrsta"] == "audio":
+                if self.hitro_aac.get() and opis["kodek"] != "ac3":
+                    opis = {**opis, "kodek": "ac3"}
+                elif self.hitro_samo_prvi_zvok.get() and opis["izvor"][1] != prvi_audio:
+                    continue
+            nacrtovana.append(opis)
+        return nacrtovana == trenutna
 
     def _izvedi_hitro_pretvorbo(self):
         """Izvede hitro pretvorbo v MKV."""
@@ -2639,6 +3432,14 @@ class BaMKV:
         osnovni_dir = os.path.dirname(video_pot)
         osnovni_ime = Path(video_pot).stem
 
+        if self._hitra_pretvorba_brez_sprememb(video_pot, izbrane):
+            messagebox.showinfo(
+                "Ni sprememb",
+                f"{Path(video_pot).name} je že MKV z enakimi sledmi, kot bi jih "
+                "imel rezultat.\n\nNičesar ni treba zapisati.",
+            )
+            return
+
         ciljna_pot = self._shrani_dialog_datoteka(
             naslov="Shrani MKV kot",
             zacetna_mapa=osnovni_dir,
@@ -2671,7 +3472,22 @@ class BaMKV:
             )
 
             # Če je potrebna pretvorba audio, uporabi ffmpeg najprej
-            if potrebna_pretvorba_audio and self.ffmpeg:
+            zvok_pot = None
+            if potrebna_pretvorba_audio and self.ffmpeg and self.hitro_kopiraj.get():
+                self._nastavi_zasedeno("Pretvarjam zvok v AC3...")
+
+                # Video se samo kopira, zato ffmpeg pretvori le zvok, video pa
+                # mkvmerge vzame neposredno iz izvorne datoteke
+                zvok_pot = ciljna_pot.replace(".mkv", "_temp_audio.mka")
+                if self.hitro_samo_prvi_zvok.get() and prvi_audio_id is not None:
+                    preslikave = [f"0:{prvi_audio_id}"]
+                else:
+                    preslikave = ["0:a"]
+                zazeni_orodje(
+                    ukaz_samo_zvok(self.ffmpeg, video_pot, zvok_pot, preslikave)
+                )
+
+            elif potrebna_pretvorba_audio and self.ffmpeg:
                 self._nastavi_zasedeno("Pretvarjam zvok v AC3...")
 
                 # Začasna datoteka za pretvorjen video
@@ -2682,16 +3498,12 @@ class BaMKV:
                 else:
                     ukaz_ff = [self.ffmpeg, "-i", video_pot, "-y"]
 
-                # Kopiraj video, pretvori audio
-                if self.hitro_kopiraj.get():
-                    ukaz_ff.extend(["-c:v", "copy"])
-                else:
-                    ukaz_ff.extend(["-c:v", "libx264", "-crf", "23"])
-
+                # Ponovno kodiraj video, pretvori audio
+                ukaz_ff.extend(["-c:v", "libx264", "-crf", "23"])
                 ukaz_ff.extend(["-c:a", "ac3", "-b:a", "192k"])
                 ukaz_ff.append(zacasna_pot)
 
-                subprocess.run(ukaz_ff, check=True, capture_output=True)
+                zazeni_orodje(ukaz_ff)
 
                 # Posodobi pot videa
                 for dat in izbrane:
@@ -2713,6 +3525,10 @@ class BaMKV:
                 if dat["vrsta"] == "Video":
                     if self.hitro_izpusti_podnapise.get():
                         ukaz.extend(["--no-subtitles"])
+                    if zvok_pot:
+                        # Zvok pride iz pretvorjene .mka datoteke
+                        ukaz.extend(["--no-audio", dat["pot"], zvok_pot])
+                        continue
                     if (
                         self.hitro_samo_prvi_zvok.get()
                         and not potrebna_pretvorba_audio
@@ -2727,19 +3543,24 @@ class BaMKV:
 
                 ukaz.append(dat["pot"])
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            zazeni_orodje(ukaz)
 
             # Počisti začasne datoteke
             for dat in izbrane:
                 if dat.get("zacasna") and os.path.exists(dat["pot"]):
                     os.remove(dat["pot"])
+            if zvok_pot and os.path.exists(zvok_pot):
+                os.remove(zvok_pot)
 
             self._nastavi_prosto("Pretvorba končana.")
             messagebox.showinfo(
                 "Uspeh", f"MKV uspešno ustvarjen!\n\nShranjeno v:\n{ciljna_pot}"
             )
         except subprocess.CalledProcessError as e:
-            napaka = e.stderr.decode() if e.stderr else str(e)
+            napaka = e.stderr.decode(errors="replace") if e.stderr else str(e)
+            zvok_pot = ciljna_pot.replace(".mkv", "_temp_audio.mka")
+            if os.path.exists(zvok_pot):
+                os.remove(zvok_pot)
             self._nastavi_prosto("Napaka pri pretvorbi.")
             messagebox.showerror("Napaka", f"Napaka pri pretvorbi:\n{napaka}")
 
@@ -2803,7 +3624,7 @@ class BaMKV:
             self.drevo_sledi.delete(vrstica)
 
         self.stevilke_sledi = []
-        sledi = self._pridobi_informacije()
+        sledi = self.sledi_mkv = self._pridobi_informacije()
 
         prevod_vrste = {"video": "Video", "audio": "Zvok", "subtitle": "Podnapisi"}
 
@@ -2932,15 +3753,16 @@ class BaMKV:
 
             ukaz.append(pot_podnapis)
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            zazeni_orodje(ukaz)
             self._nastavi_prosto("Podnapisi dodani.")
             messagebox.showinfo(
                 "Uspeh", f"Podnapisi uspešno dodani!\n\nShranjeno v:\n{ciljna_pot}"
             )
         except subprocess.CalledProcessError as e:
             self._nastavi_prosto("Napaka pri dodajanju.")
+            napaka = e.stderr.decode(errors="replace")
             messagebox.showerror(
-                "Napaka", f"Napaka pri dodajanju podnapisov:\n{e.stderr.decode()}"
+                "Napaka", f"Napaka pri dodajanju podnapisov:\n{napaka}"
             )
 
     def _pretvori(self):
@@ -2953,6 +3775,10 @@ class BaMKV:
             messagebox.showerror("Napaka", "ffmpeg ni nameščen.")
             return
 
+        if self.video_po_kosih.get() and not self.mkvmerge:
+            messagebox.showerror("Napaka", "Kodiranje po kosih potrebuje mkvmerge.")
+            return
+
         # Ciljna datoteka
         osnovni_dir = os.path.dirname(self.mkv_pot)
         osnovni_ime = Path(self.mkv_pot).stem
@@ -2968,32 +3794,41 @@ class BaMKV:
 
         self._nastavi_zasedeno("Pretvarjam...")
 
+        kodiranje = None
+        izbira = self._izbira_pretvorbe()
         try:
             if "flatpak run" in self.ffmpeg:
                 ukaz = self.ffmpeg.split() + ["-i", self.mkv_pot, "-y"]
             else:
                 ukaz = [self.ffmpeg, "-i", self.mkv_pot, "-y"]
+            # Izbira sledi je izrecna, da jo kodiranje po kosih ponovi
+            for stevilka in izbira.values():
+                if stevilka is not None:
+                    ukaz.extend(["-map", f"0:{stevilka}"])
 
             # Video kodek
             video_izbira = self.video_format.get()
+            video_argumenti = []
             if "kopija" in video_izbira:
-                ukaz.extend(["-c:v", "copy"])
+                video_argumenti.extend(["-c:v", "copy"])
             else:
                 if "h264" in video_izbira:
-                    ukaz.extend(["-c:v", "libx264"])
+                    video_argumenti.extend(["-c:v", "libx264"])
                 elif "h265" in video_izbira or "hevc" in video_izbira:
-                    ukaz.extend(["-c:v", "libx265"])
+                    video_argumenti.extend(["-c:v", "libx265"])
                 elif "vp9" in video_izbira:
-                    ukaz.extend(["-c:v", "libvpx-vp9"])
+                    video_argumenti.extend(["-c:v", "libvpx-vp9"])
                 elif "av1" in video_izbira:
-                    ukaz.extend(["-c:v", "libaom-av1"])
+                    video_argumenti.extend(["-c:v", "libaom-av1"])
 
                 # CRF
                 crf = self.video_crf.get().split(" ")[0]
-                ukaz.extend(["-crf", crf])
+                video_argumenti.extend(["-crf", crf])
+            ukaz.extend(video_argumenti)
 
             # Audio kodek
             avdio_izbira = self.avdio_format.get()
+            kodek_zvoka = "copy"
             if "kopija" in avdio_izbira:
                 ukaz.extend(["-c:a", "copy"])
             else:
@@ -3005,15 +3840,34 @@ class BaMKV:
                     "flac": "flac",
                     "vorbis": "libvorbis",
                 }
-                ukaz.extend(["-c:a", kodeki.get(avdio_izbira, "ac3")])
+                kodek_zvoka = kodeki.get(avdio_izbira, "ac3")
+                ukaz.extend(["-c:a", kodek_zvoka])
                 ukaz.extend(["-b:a", self.avdio_bitrate.get()])
 
+            if self.video_po_kosih.get() and "kopija" not in video_izbira:
+                kodiranje = KosovnoKodiranje(
+                    self.ffmpeg,
+                    self.mkv_pot,
+                    ciljna_pot,
+                    video_argumenti,
+                    preslikava=f"0:{izbira['video'] or 'v:0'}",
+                    ffprobe=self.ffprobe,
+                )
+                if not self._pretvori_po_kosih(kodiranje, kodek_zvoka, izbira):
+                    self._nastavi_prosto("Preklicano.")
+                    return
+                self._nastavi_prosto("Pretvorba končana.")
+                messagebox.showinfo(
+                    "Uspeh", f"Pretvorba uspešna!\n\nShranjeno v:\n{ciljna_pot}"
+                )
+                return
+
             # Kopiraj podnapise
             ukaz.extend(["-c:s", "copy"])
 
             ukaz.append(ciljna_pot)
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            zazeni_orodje(ukaz)
             self._nastavi_prosto("Pretvorba končana.")
             messagebox.showinfo(
                 "Uspeh", f"Pretvorba uspešna!\n\nShranjeno v:\n{ciljna_pot}"
@@ -3021,8 +3875,95 @@ class BaMKV:
         except subprocess.CalledProcessError as e:
             self._nastavi_prosto("Napaka pri pretvorbi.")
             messagebox.showerror(
-                "Napaka", f"Napaka pri pretvorbi:\n{e.stderr.decode()}"
+                "Napaka",
+                f"Napaka pri pretvorbi:\n{e.stderr.decode(errors='replace')}"
+                + self._opis_nadaljevanja([kodiranje] if kodiranje else []),
+            )
+        except (IzgubljeneSlicice, DrugacneNastavitve, OSError, KeyError) as e:
+            # Napake delovne mape kosov (npr. ob nadaljevanju kodiranja)
+            self._nastavi_prosto("Napaka pri pretvorbi.")
+            messagebox.showerror(
+                "Napaka",
+                f"Napaka pri pretvorbi:\n{e}"
+                + self._opis_nadaljevanja([kodiranje] if kodiranje else []),
+            )
+
+    def _pretvori_po_kosih(self, kodiranje, kodek_zvoka, izbira):
+        """Pretvorba iz _pretvori s kodiranjem videa po kosih.
+
+        Zvok se pretvarja hkrati s kosi, mkvmerge pa kodiran video na koncu
+        združi z zvokom in podnapisi iz izbire _izbira_pretvorbe, tako da ima
+        izhod iste sledi kot pretvorba brez kosov. Vrne False ob preklicu.
+        """
+        self._nastavi_zasedeno("Kodiram video po kosih...")
+        if not self._pripravi_kodiranje(kodiranje):
+            return False
+
+        zvok_pot = None
+        dodatna = []
+        if kodek_zvoka != "copy" and izbira["audio"] is not None:
+            zvok_pot = os.path.join(kodiranje.mapa, "zvok.mka")
+            dodatna.append(
+                ukaz_samo_zvok(
+                    self.ffmpeg,
+                    self.mkv_pot,
+                    zvok_pot,
+                    [f"0:{izbira['audio']}"],
+                    kodek_zvoka,
+                    self.avdio_bitrate.get(),
+                )
             )
+        video_pot = kodiranje.kodiraj(dodatna_opravila=dodatna)
+
+        self._nastavi_zasedeno("Združujem s pomočjo mkvmerge...")
+        if "flatpak run" in self.mkvmerge:
+            ukaz = self.mkvmerge.split() + ["-o", kodiranje.cilj]
+        else:
+            ukaz = [self.mkvmerge, "-o", kodiranje.cilj]
+        ukaz.extend([video_pot, "--no-video", "--no-attachments"])
+        if zvok_pot or izbira["audio"] is None:
+            ukaz.append("--no-audio")
+        else:
+            ukaz.extend(["--audio-tracks", izbira["audio"]])
+        if izbira["subtitle"] is None:
+            ukaz.append("--no-subtitles")
+        else:
+            ukaz.extend(["--subtitle-tracks", izbira["subtitle"]])
+        ukaz.append(self.mkv_pot)
+        if zvok_pot:
+            ukaz.append(zvok_pot)
+        zazeni_orodje(ukaz)
+        # Delovna mapa ostane, dokler kodiranje ni uspešno končano
+        kodiranje.pocisti()
+        return True
+
+    def _izbira_pretvorbe(self):
+        """Sledi, ki bi jih ffmpeg brez -map izbral za pretvorbo.
+
+        Po ena video sled (največja ločljivost) in zvočna sled (največ
+        kanalov), privzeta sled ima prednost; podnapisi so prvi. Vrne
+        {vrsta: številka sledi ali None}.
+        """
+        izbira = {"video": None, "audio": None, "subtitle": None}
+        najboljse = {}
+        for sled in self.sledi_mkv:
+            vrsta = sled.get("codec_type")
+            disposition = sled.get("disposition", {})
+            if vrsta not in izbira or disposition.get("attached_pic"):
+                continue
+            privzeta = disposition.get("default", 0)
+            if vrsta == "video":
+                slikovnih_tock = (sled.get("width") or 0) * (sled.get("height") or 0)
+                ocena = (privzeta, slikovnih_tock)
+            elif vrsta == "audio":
+                ocena = (privzeta, sled.get("channels") or 0)
+            else:
+                ocena = (0, 0)
+            # Ob enaki oceni ostane prva sled
+            if vrsta not in najboljse or ocena > najboljse[vrsta]:
+                najboljse[vrsta] = ocena
+                izbira[vrsta] = str(sled["index"])
+        return izbira
 
     def _odstrani_sledi(self):
         """Odstrani označene sledi."""
@@ -3074,252 +4015,2411 @@ class BaMKV:
 
             ukaz.extend(["-c", "copy", ciljna_pot])
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            zazeni_orodje(ukaz)
             self._nastavi_prosto("Sledi odstranjene.")
             messagebox.showinfo(
                 "Uspeh", f"Sledi uspešno odstranjene!\n\nShranjeno v:\n{ciljna_pot}"
             )
         except subprocess.CalledProcessError as e:
             self._nastavi_prosto("Napaka pri odstranjevanju.")
-            messagebox.showerror(
-                "Napaka", f"Napaka pri odstranjevanju:\n{e.stderr.decode()}"
-            )
+            napaka = e.stderr.decode(errors="replace")
+            messagebox.showerror("Napaka", f"Napaka pri odstranjevanju:\n{napaka}")
+
+
+# Začasne datoteke, ki jih med obdelavo ustvari baC
+ZACASNA_DATOTEKA = re.compile(r"_temp(_bac|_audio|_tracks)?\.mk[av]$", re.IGNORECASE)
+
+
+def ukaz_samo_zvok(
+    ffmpeg,
+    vhod,
+    izhod,
+    preslikave,
+    kodek="ac3",
+    bitna_hitrost="192k",
+    kanali=None,
+    filter_toka=None,
+):
+    """Sestavi ffmpeg ukaz, ki v .mka pretvori samo izbrane zvočne sledi.
+
+    Video in podnapise nato mkvmerge vzame neposredno iz izvorne datoteke,
+    zato se video prebere in zapiše le enkrat. kanali omeji število izhodnih
+    kanalov (downmix). S kodekom "copy" in filter_toka (npr. dca_core) se
+    zvok ne dekodira, filter bitnega toka le izlušči jedro.
+    """
+    if "flatpak run" in ffmpeg:
+        ukaz = ffmpeg.split() + ["-i", vhod, "-y"]
+    else:
+        ukaz = [ffmpeg, "-i", vhod, "-y"]
+    for preslikava in preslikave:
+        ukaz.extend(["-map", preslikava])
+    ukaz.extend(["-vn", "-sn", "-dn", "-c:a", kodek])
+    if kodek != "copy":
+        ukaz.extend(["-b:a", bitna_hitrost])
+    if kanali:
+        ukaz.extend(["-ac", str(kanali)])
+    if filter_toka:
+        ukaz.extend(["-bsf:a", filter_toka])
+    ukaz.append(izhod)
+    return ukaz
+
+
+def ukaz_vec_zvokov(ffmpeg, vhod, izhod, nacrti):
+    """Sestavi ffmpeg ukaz, ki v en .mka pretvori več zvočnih sledi hkrati.
+
+    nacrti je seznam parov (preslikava, načrt zvoka iz PravilaZvoka). Vsaka
+    izhodna sled dobi svoj kodirnik, bitno hitrost, kanale in filter, vhod
+    pa se prebere le enkrat ne glede na število pretvorjenih sledi.
+    """
+    if "flatpak run" in ffmpeg:
+        ukaz = ffmpeg.split() + ["-i", vhod, "-y"]
+    else:
+        ukaz = [ffmpeg, "-i", vhod, "-y"]
+    for i, (preslikava, zvok) in enumerate(nacrti):
+        ukaz.extend(["-map", preslikava, f"-c:a:{i}", zvok["kodirnik"]])
+        if zvok["kodirnik"] != "copy":
+            ukaz.extend([f"-b:a:{i}", zvok["bitna_hitrost"]])
+        if zvok["kanali"]:
+            ukaz.extend([f"-ac:a:{i}", str(zvok["kanali"])])
+        if zvok["filter"]:
+            ukaz.extend([f"-bsf:a:{i}", zvok["filter"]])
+    ukaz.extend(["-vn", "-sn", "-dn", izhod])
+    return ukaz
+
+
+def sledi_mkvmerge(mkvmerge, pot):
+    """Sledi po mkvmerge -J - z id-ji, ki jih mkvmerge uporablja pri izbiri."""
+    if "flatpak run" in mkvmerge:
+        ukaz = mkvmerge.split() + ["-J", pot]
+    else:
+        ukaz = [mkvmerge, "-J", pot]
+    rezultat = subprocess.run(ukaz, capture_output=True, text=True, check=True)
+    return json.loads(rezultat.stdout).get("tracks", [])
 
 
-def hitro_pretvorba_cli(izbrisi_izvorne=False):
-    """CLI način za hitro pretvorbo vseh video datotek v trenutnem imeniku."""
+def jedra_truehd(sledi):
+    """Vrne {id TrueHD sledi: AC3 sled} za Blu-ray tokove iz mkvmerge -J.
 
-    # Poišči orodja
-    def poisci_orodje(ime):
-        pot = shutil.which(ime)
-        if pot:
-            return pot
-        try:
-            rezultat = subprocess.run(
-                ["flatpak", "list", "--app", "--columns=application"],
-                capture_output=True,
-                text=True,
-                timeout=5,
+    V Blu-ray toku (.m2ts) TrueHD nosi združljivo AC3 jedro v istem toku;
+    mkvmerge ga pokaže kot ločeno sled in ju poveže z multiplexed_tracks.
+    """
+    po_id = {sled.get("id"): sled for sled in sledi}
+    jedra = {}
+    for sled in sledi:
+        if sled.get("type") != "audio" or "truehd" not in sled.get("codec", "").lower():
+            continue
+        for drugi in sled.get("properties", {}).get("multiplexed_tracks", []):
+            jedro = po_id.get(drugi, {})
+            if drugi != sled.get("id") and jedro.get("codec", "").upper() in (
+                "AC-3",
+                "E-AC-3",
+            ):
+                jedra[sled.get("id")] = jedro
+    return jedra
+
+
+# Kodirniki ffmpeg za ciljne kodeke zvoka
+KODIRNIKI_ZVOKA = {
+    "ac3": "ac3",
+    "eac3": "eac3",
+    "aac": "aac",
+    "mp3": "libmp3lame",
+    "opus": "libopus",
+    "flac": "flac",
+}
+
+
+# Kodirniki ffmpeg za ciljne kodeke videa
+KODIRNIKI_VIDEA = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "vp9": "libvpx-vp9",
+    "av1": "libaom-av1",
+}
+
+
+def bitov_na_sekundo(bitna_hitrost):
+    """Pretvori bitno hitrost ffmpeg (npr. "192k", "1.5M") v bite na sekundo."""
+    vrednost = str(bitna_hitrost).strip().lower()
+    mnozitelj = {"k": 1000, "m": 1000000}.get(vrednost[-1:], 1)
+    if mnozitelj > 1:
+        vrednost = vrednost[:-1]
+    return int(float(vrednost) * mnozitelj)
+
+
+class PravilaZvoka:
+    """Pravila ciljnih naprav za zvok - kaj predvajalniki predvajajo sami.
+
+    Sled z dovoljenim kodekom in največ najvec_kanalov kanali se kopira,
+    ostale se pretvorijo v ciljni_kodek z bitno hitrostjo glede na število
+    izhodnih kanalov (bitne_hitrosti, ključ "privzeto" za ostale). Pravila
+    se preberejo iz JSON datoteke, npr.:
+
+        {"dovoljeni_kodeki": ["ac3", "eac3", "aac"], "najvec_kanalov": 6,
+         "ciljni_kodek": "ac3", "bitne_hitrosti": {"2": "192k", "6": "448k"}}
+
+    DTS-HD (MA, HRA) in DTS:X se štejeta kot kodek "dts-hd"; če ta ni dovoljen,
+    "dts" pa je, se brez izgub izlušči jedro DTS. Privzeta pravila ohranijo
+    dosedanje vedenje: vse razen AC3 se pretvori v AC3 s 192 kb/s.
+    """
+
+    PRIVZETA_POT = os.path.expanduser("~/.config/bac/pravila.json")
+
+    def __init__(
+        self,
+        dovoljeni_kodeki=("ac3",),
+        najvec_kanalov=None,
+        ciljni_kodek="ac3",
+        bitne_hitrosti=None,
+    ):
+        if isinstance(dovoljeni_kodeki, str):
+            # "ac3" je en kodek, ne množica znakov
+            dovoljeni_kodeki = (dovoljeni_kodeki,)
+        if not all(isinstance(k, str) for k in dovoljeni_kodeki):
+            raise TypeError("dovoljeni_kodeki morajo biti imena kodekov")
+        if not isinstance(ciljni_kodek, str):
+            raise TypeError("ciljni_kodek mora biti ime kodeka")
+        if najvec_kanalov is not None and (
+            isinstance(najvec_kanalov, bool) or not isinstance(najvec_kanalov, int)
+        ):
+            raise TypeError(f"najvec_kanalov ni celo število: {najvec_kanalov!r}")
+        if najvec_kanalov is not None and najvec_kanalov < 0:
+            raise ValueError(f"najvec_kanalov ne sme biti negativen: {najvec_kanalov}")
+        if bitne_hitrosti is not None and not isinstance(bitne_hitrosti, dict):
+            raise TypeError("bitne_hitrosti morajo biti slovar kanali -> hitrost")
+
+        self.dovoljeni_kodeki = {k.lower() for k in dovoljeni_kodeki}
+        self.najvec_kanalov = najvec_kanalov or None
+        self.ciljni_kodek = ciljni_kodek.lower()
+        self.bitne_hitrosti = {"privzeto": "192k"}
+        for kanali, hitrost in (bitne_hitrosti or {}).items():
+            if isinstance(hitrost, bool) or not isinstance(hitrost, (str, int, float)):
+                raise TypeError(f"neveljavna bitna hitrost za {kanali}: {hitrost!r}")
+            try:
+                veljavna = bitov_na_sekundo(hitrost) > 0
+            except ValueError:
+                veljavna = False
+            if not veljavna:
+                raise ValueError(f"neveljavna bitna hitrost za {kanali}: {hitrost!r}")
+            # ffmpeg dobi hitrost kot argument ukaza
+            self.bitne_hitrosti[str(kanali)] = str(hitrost)
+        if self.ciljni_kodek not in KODIRNIKI_ZVOKA:
+            raise ValueError(
+                f"neznan ciljni kodek '{ciljni_kodek}' "
+                f"(podprti: {', '.join(KODIRNIKI_ZVOKA)})"
             )
-            if rezultat.returncode == 0:
-                aplikacije = rezultat.stdout.strip().split("\n")
-                if ime in ["ffmpeg", "ffprobe"]:
-                    for app in aplikacije:
-                        if "ffmpeg" in app.lower():
-                            return f"flatpak run --command={ime} {app}"
-                if ime == "mkvmerge":
-                    for app in aplikacije:
-                        if "mkvtoolnix" in app.lower():
-                            return f"flatpak run --command=mkvmerge {app}"
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            pass
-        return None
 
-    ffmpeg = poisci_orodje("ffmpeg")
-    ffprobe = poisci_orodje("ffprobe")
-    mkvmerge = poisci_orodje("mkvmerge")
+    @classmethod
+    def preberi(cls, pot=None):
+        """Prebere pravila iz JSON datoteke (brez poti privzeto, če obstaja)."""
+        if pot is None:
+            if not os.path.exists(cls.PRIVZETA_POT):
+                return cls()
+            pot = cls.PRIVZETA_POT
+        with open(pot, "r", encoding="utf-8") as f:
+            podatki = json.load(f)
+        if not isinstance(podatki, dict):
+            raise ValueError("pričakovan je JSON objekt")
+        znani = {"dovoljeni_kodeki", "najvec_kanalov", "ciljni_kodek", "bitne_hitrosti"}
+        neznani = set(podatki) - znani
+        if neznani:
+            raise ValueError(f"neznana pravila: {', '.join(sorted(neznani))}")
+        return cls(**podatki)
+
+    def razlicica(self):
+        """Oznaka pravil za manifest - spremembe pravil razveljavijo vnose."""
+        if self.__dict__ == PravilaZvoka().__dict__:
+            return RAZLICICA_PRAVIL
+        opis = json.dumps(
+            {k: sorted(v) if isinstance(v, set) else v for k, v in vars(self).items()},
+            sort_keys=True,
+        )
+        return f"{RAZLICICA_PRAVIL}-{hashlib.sha1(opis.encode()).hexdigest()[:12]}"
+
+    def nacrtuj_zvok(self, sled):
+        """Za zvočno sled ffprobe vrne None (kopiraj) ali načrt pretvorbe.
+
+        Načrt je slovar s kodekom, profilom, kodirnikom, bitno hitrostjo,
+        številom izhodnih kanalov (None = kot vir) in filtrom bitnega toka.
+        """
+        kodek = (sled.get("codec_name") or "").lower()
+        profil = (sled.get("profile") or "").upper()
+        if kodek == "dts" and (profil.startswith("DTS-HD") or "DTS:X" in profil):
+            kodek = "dts-hd"
+        kanali = sled.get("channels") or 0
+        prevec_kanalov = self.najvec_kanalov and kanali > self.najvec_kanalov
+        if kodek in self.dovoljeni_kodeki and not prevec_kanalov:
+            return None
 
-    if not mkvmerge:
-        print("Napaka: mkvmerge ni nameščen.")
-        sys.exit(1)
+        if (
+            kodek == "dts-hd"
+            and "dts" in self.dovoljeni_kodeki
+            and (not self.najvec_kanalov or self.najvec_kanalov >= 6)
+        ):
+            # Jedro DTS (največ 5.1) je del toka - filter ga izlušči brez
+            # dekodiranja, zato je opravilo omejeno z V/I namesto s CPE
+            return {
+                "kodek": "dts",
+                "profil": "DTS",
+                "kodirnik": "copy",
+                "bitna_hitrost": "1509k",
+                "kanali": None,
+                "filter": "dca_core",
+            }
 
-    # Poišči video datoteke rekurzivno
-    video_koncnice = [
-        ".mp4",
-        ".avi",
-        ".mov",
-        ".wmv",
-        ".flv",
-        ".webm",
-        ".m4v",
-        ".mpeg",
-        ".mpg",
-    ]
-    trenutni_dir = os.getcwd()
+        izhodni_kanali = self.najvec_kanalov if prevec_kanalov else None
+        bitna_hitrost = self.bitne_hitrosti.get(
+            str(izhodni_kanali or kanali), self.bitne_hitrosti["privzeto"]
+        )
+        return {
+            "kodek": self.ciljni_kodek,
+            "profil": None,
+            "kodirnik": KODIRNIKI_ZVOKA[self.ciljni_kodek],
+            "bitna_hitrost": bitna_hitrost,
+            "kanali": izhodni_kanali,
+            "filter": None,
+        }
 
-    video_datoteke = []
-    mkv_datoteke = []
-    for root, dirs, files in os.walk(trenutni_dir):
-        for datoteka in files:
-            pot = os.path.join(root, datoteka)
-            koncnica = Path(datoteka).suffix.lower()
-            if koncnica in video_koncnice:
-                video_datoteke.append(pot)
-            elif koncnica == ".mkv":
-                mkv_datoteke.append(pot)
 
-    if not video_datoteke and not mkv_datoteke:
-        print("Ni video datotek v trenutnem imeniku ali podmapah.")
-        sys.exit(0)
+# Rezerva, ki jo pustimo prosto na vsakem disku (metapodatki, dnevniki ...)
+REZERVA_PROSTORA = 256 * 1024 * 1024
 
-    if video_datoteke:
-        print(f"Najdenih {len(video_datoteke)} video datotek (rekurzivno).")
-    if mkv_datoteke:
-        print(f"Najdenih {len(mkv_datoteke)} MKV datotek za preverjanje (rekurzivno).")
 
-    uspesne = 0
-    neuspesne = 0
+class PremaloProstora(Exception):
+    """Na ciljnem ali začasnem disku ni dovolj prostora za obdelavo."""
 
-    # Jeziki, ki jih štejemo kot "naše" podnapise (prioriteta: slv > hrv > srp > bos)
-    nasi_jeziki = ["slv", "slo", "sl", "hrv", "hr", "srp", "sr", "bos", "bs"]
-    prioriteta_jezikov = {
-        "slv": 0,
-        "slo": 0,
-        "sl": 0,
-        "hrv": 1,
-        "hr": 1,
-        "srp": 2,
-        "sr": 2,
-        "bos": 3,
-        "bs": 3,
-    }
-    angleski_audio_jeziki = {"eng", "en", "english"}
 
-    def je_angleski_audio(sled):
-        jezik = sled.get("tags", {}).get("language", "").lower()
-        return (
-            jezik in angleski_audio_jeziki
-            or jezik.startswith("en-")
-            or jezik.startswith("eng-")
-        )
+def oceni_trajanje(sledi):
+    """Oceni trajanje v sekundah iz ffprobe sledi (duration ali oznaka DURATION)."""
+    trajanje = 0.0
+    for sled in sledi:
+        try:
+            trajanje = max(trajanje, float(sled.get("duration", 0)))
+        except ValueError:
+            pass
+        for kljuc, vrednost in sled.get("tags", {}).items():
+            if kljuc.upper().startswith("DURATION"):
+                try:
+                    ure, minute, sekunde = vrednost.split(":")
+                    trajanje = max(
+                        trajanje, int(ure) * 3600 + int(minute) * 60 + float(sekunde)
+                    )
+                except ValueError:
+                    pass
+    return trajanje
+
+
+def preveri_prostor(potrebe):
+    """Preveri, ali je na diskih dovolj prostora za pare (mapa, bajti).
+
+    Potrebe map na istem disku se seštejejo. Ob pomanjkanju sproži
+    PremaloProstora, da se opravilo odloži, preden začne pisati.
+    """
+    po_diskih = {}
+    for mapa, bajti in potrebe:
+        naprava = os.stat(mapa).st_dev
+        prejsnja = po_diskih.get(naprava, (mapa, 0))
+        po_diskih[naprava] = (prejsnja[0], prejsnja[1] + bajti)
+
+    for mapa, bajti in po_diskih.values():
+        bajti += REZERVA_PROSTORA
+        prosto = shutil.disk_usage(mapa).free
+        if bajti > prosto:
+            raise PremaloProstora(
+                f"premalo prostora v {mapa}: potrebnih ~{bajti // 2**20} MB, "
+                f"prostih {prosto // 2**20} MB"
+            )
 
-    def izberi_audio_sled(sledi):
-        """Vrne (kodek, globalni indeks, audio-relativni indeks), z angleščino prednostno."""
-        audio_sledi = []
-        for sled in sledi:
-            if sled.get("codec_type") == "audio":
-                audio_sledi.append((sled, len(audio_sledi)))
 
-        if not audio_sledi:
-            return None, None, None
+# ioctl za razširjene atribute (struct fsxattr) in zastavica namiga velikosti
+# razširitve, ki ga XFS upošteva pri dodeljevanju prostora
+FS_IOC_FSGETXATTR = 0x801C581F
+FS_IOC_FSSETXATTR = 0x401C5820
+FS_XFLAG_EXTSIZE = 0x00000800
+NAMIG_RAZSIRITVE = 64 * 1024 * 1024
 
-        izbrana_sled, relativni_indeks = next(
-            (
-                (sled, relativni_indeks)
-                for sled, relativni_indeks in audio_sledi
-                if je_angleski_audio(sled)
-            ),
-            audio_sledi[0],
-        )
-        return (
-            izbrana_sled.get("codec_name"),
-            izbrana_sled.get("index"),
-            relativni_indeks,
-        )
 
-    def edinstvena_bac_pot(pot):
-        osnovna_pot = Path(pot)
-        kandidat = osnovna_pot.with_name(f"{osnovna_pot.stem}_bac{osnovna_pot.suffix}")
-        stevec = 2
-        while kandidat.exists():
-            kandidat = osnovna_pot.with_name(
-                f"{osnovna_pot.stem}_bac_{stevec}{osnovna_pot.suffix}"
-            )
-            stevec += 1
-        return str(kandidat)
+def pripravi_izhod(pot, ocena):
+    """Ustvari prazno izhodno datoteko z namigom velikosti razširitve.
 
-    def preveri_mkv_sledi(mkv_pot):
-        """Preveri sledi v MKV datoteki in prednostno izbere angleško audio sled."""
-        if not ffprobe:
-            return None, None, False, None, 0, [], None, None
+    mkvmerge in ffmpeg izhod odpreta z O_TRUNC, kar sprosti vsak vnaprej
+    dodeljen prostor, namig razširitve na inodu pa ostane, zato XFS datoteko
+    dodeljuje v velikih zveznih kosih. Na drugih datotečnih sistemih namig
+    ni podprt in datoteka ostane prazna.
+    """
+    with open(pot, "wb") as f:
         try:
-            if "flatpak run" in ffprobe:
-                deli = ffprobe.split()
-                ukaz = deli + [
-                    "-v",
-                    "quiet",
-                    "-print_format",
-                    "json",
-                    "-show_streams",
-                    mkv_pot,
-                ]
-            else:
-                ukaz = [
-                    ffprobe,
-                    "-v",
-                    "quiet",
-                    "-print_format",
-                    "json",
-                    "-show_streams",
-                    mkv_pot,
-                ]
-            rezultat = subprocess.run(ukaz, capture_output=True, text=True, check=True)
-            podatki = json.loads(rezultat.stdout)
-            sledi = podatki.get("streams", [])
+            atributi = bytearray(28)
+            fcntl.ioctl(f.fileno(), FS_IOC_FSGETXATTR, atributi)
+            zastavice, _ = struct.unpack_from("II", atributi)
+            razsiritev = min(max(ocena, 1024 * 1024), NAMIG_RAZSIRITVE)
+            razsiritev -= razsiritev % (1024 * 1024)
+            struct.pack_into(
+                "II", atributi, 0, zastavice | FS_XFLAG_EXTSIZE, razsiritev
+            )
+            fcntl.ioctl(f.fileno(), FS_IOC_FSSETXATTR, atributi)
+        except OSError:
+            pass
 
-            ima_nase_podnapise = False
-            nasi_privzeti = False
-            najboljsi_podnapis = None  # (prioriteta, subtitle-relativen indeks)
-            sub_track_ids = []  # Globalni track ID-ji subtitle sledi (za mkvmerge)
 
-            sub_indeks = 0  # Šteje samo subtitle sledi
-            for sled in sledi:
-                if sled.get("codec_type") == "subtitle":
-                    jezik = sled.get("tags", {}).get("language", "").lower()
-                    disposition = sled.get("disposition", {})
-                    je_privzet = disposition.get("default", 0) == 1
-                    sub_track_ids.append(sled.get("index", sub_indeks))
+# Velikost bloka za kopiranje in zgoščevanje v Pythonu
+BLOK_PRENOSA = 8 * 1024 * 1024
 
-                    if jezik in nasi_jeziki:
-                        ima_nase_podnapise = True
-                        prio = prioriteta_jezikov.get(jezik, 99)
 
-                        if je_privzet:
-                            nasi_privzeti = True
+def pocakaj_na_proracun(omejevalnik, prebrano, zapisano):
+    """Zabeleži promet, ki ga ustvari baC sam, in počaka, kolikor zahteva proračun.
 
-                        # Poišči najboljši podnapis po prioriteti
-                        if najboljsi_podnapis is None or prio < najboljsi_podnapis[0]:
-                            najboljsi_podnapis = (prio, sub_indeks)
+    Kopiranje in zgoščevanje v Pythonu ne tečeta prek zazeni_orodje, zato
+    ju omejevalnik vidi le, če ga bloki sproti sporočajo.
+    """
+    if omejevalnik is None:
+        return
+    premor = omejevalnik.porabi(prebrano, zapisano)
+    if premor > 0.05:
+        time.sleep(premor)
 
-                    sub_indeks += 1
 
-            indeks_za_privzet = najboljsi_podnapis[1] if najboljsi_podnapis else None
-            audio_kodek, izbrani_audio, izbrani_audio_relativni = izberi_audio_sled(sledi)
-            return (
-                ima_nase_podnapise,
-                audio_kodek,
-                nasi_privzeti,
-                indeks_za_privzet,
-                sub_indeks,
-                sub_track_ids,
-                izbrani_audio,
-                izbrani_audio_relativni,
-            )
-        except Exception:
-            return None, None, False, None, 0, [], None, None
+def kopiraj_s_predalokacijo(vir, cilj, omejevalnik=None):
+    """Kopira datoteko in prostor za cilj dodeli vnaprej (manj razdrobljenosti)."""
+    with open(vir, "rb") as f_vir, open(cilj, "wb") as f_cilj:
+        velikost = os.fstat(f_vir.fileno()).st_size
+        try:
+            os.posix_fallocate(f_cilj.fileno(), 0, velikost)
+        except (AttributeError, OSError):
+            pass
+        for blok in iter(lambda: f_vir.read(BLOK_PRENOSA), b""):
+            f_cilj.write(blok)
+            pocakaj_na_proracun(omejevalnik, len(blok), len(blok))
+        # posix_fallocate ob napaki ali krajšem viru ne sme pustiti repa
+        f_cilj.truncate(velikost)
+
+
+def utrdi(pot, trajnost):
+    """Zagotovi, da je vsebina datoteke (trajnost "file"/"dir") na disku."""
+    if trajnost == "none":
+        return
+    fd = os.open(pot, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def utrdi_mapo(mapa, trajnost):
+    """Pri trajnosti "dir" zapiše na disk tudi vnos v imeniku (preimenovanje)."""
+    if trajnost != "dir":
+        return
+    fd = os.open(mapa, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def premakni_na_cilj(vir, cilj, trajnost="none", omejevalnik=None):
+    """Atomarno zamenja cilj s končano datoteko.
+
+    Na istem disku je to os.replace; sicer se datoteka najprej prepiše v
+    cilj.bac-part poleg cilja, da cilj nikoli ni delno zapisan. Cilj (stari
+    ali novi) ob zrušitvi vedno ostane cel, trajnost pa določa, ali se pred
+    zamenjavo vsebina in po njej še imenik zapišeta na disk. Kopija na drug
+    disk porablja proračun omejevalnika.
+    """
+    mapa = os.path.dirname(os.path.abspath(cilj))
+    try:
+        utrdi(vir, trajnost)
+        os.replace(vir, cilj)
+        utrdi_mapo(mapa, trajnost)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    delna_pot = cilj + ".bac-part"
+    try:
+        kopiraj_s_predalokacijo(vir, delna_pot, omejevalnik)
+        utrdi(delna_pot, trajnost)
+        os.replace(delna_pot, cilj)
+    except BaseException:
+        if os.path.exists(delna_pot):
+            os.remove(delna_pot)
+        raise
+    utrdi_mapo(mapa, trajnost)
+    os.remove(vir)
+
+
+def razdruzi_povezavo(pot, omejevalnik=None):
+    """Pred urejanjem na mestu trdo povezano datoteko nadomesti z lastno kopijo.
+
+    Trde povezave (npr. dvojniki z --dedupe) si delijo inode, zato bi
+    mkvpropedit spremenil vse kopije hkrati. Vrne True, če je bila kopirana.
+    """
+    if os.stat(pot).st_nlink < 2:
+        return False
+    delna_pot = pot + ".bac-part"
+    try:
+        kloniraj_ali_kopiraj(pot, delna_pot, omejevalnik)
+        shutil.copystat(pot, delna_pot)
+        os.replace(delna_pot, pot)
+    except BaseException:
+        if os.path.exists(delna_pot):
+            os.remove(delna_pot)
+        raise
+    return True
+
+
+# ioctl FICLONE: cilj deli podatkovne bloke z virom (reflink na btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def kloniraj_ali_kopiraj(vir, cilj, omejevalnik=None):
+    """Kopira vir v cilj - najprej z reflinkom (FICLONE) brez prenosa podatkov.
+
+    Vrne True, če je bil cilj kloniran, in False, če je bil kopiran.
+    """
+    try:
+        with open(vir, "rb") as f_vir, open(cilj, "wb") as f_cilj:
+            fcntl.ioctl(f_cilj.fileno(), FICLONE, f_vir.fileno())
+        return True
+    except OSError:
+        kopiraj_s_predalokacijo(vir, cilj, omejevalnik)
+        return False
+
+
+def povezi_vsebino(vir, cilj, trajnost="none"):
+    """Cilj zamenja z datoteko z vsebino vira brez kopiranja podatkov.
+
+    Najprej poskusi reflink (FICLONE), nato trdo povezavo. Vrne "reflink",
+    "povezava" ali None, če nobena ni mogoča (npr. drug datotečni sistem).
+    """
+    delna_pot = cilj + ".bac-part"
+    nacin = None
+    try:
+        with open(vir, "rb") as f_vir, open(delna_pot, "wb") as f_cilj:
+            fcntl.ioctl(f_cilj.fileno(), FICLONE, f_vir.fileno())
+        nacin = "reflink"
+    except OSError:
+        try:
+            if os.path.exists(delna_pot):
+                os.remove(delna_pot)
+            os.link(vir, delna_pot)
+            nacin = "povezava"
+        except OSError:
+            return None
+    try:
+        os.replace(delna_pot, cilj)
+    except OSError:
+        os.remove(delna_pot)
+        raise
+    utrdi_mapo(os.path.dirname(os.path.abspath(cilj)), trajnost)
+    return nacin
+
+
+# Velikost vsakega od treh vzorcev (začetek, sredina, konec) za hitri odtis
+VZOREC_ODTISA = 1024 * 1024
+
+
+def vzorcni_odtis(pot):
+    """Hiter odtis vsebine iz velikosti ter začetka, sredine in konca datoteke."""
+    velikost = os.path.getsize(pot)
+    zgoscevalnik = hashlib.sha1(str(velikost).encode())
+    with open(pot, "rb") as f:
+        for odmik in (0, velikost // 2, velikost - VZOREC_ODTISA):
+            f.seek(max(odmik, 0))
+            zgoscevalnik.update(f.read(VZOREC_ODTISA))
+    return zgoscevalnik.hexdigest()
+
+
+def polni_odtis(pot, omejevalnik=None):
+    zgoscevalnik = hashlib.sha1()
+    with open(pot, "rb") as f:
+        for blok in iter(lambda: f.read(BLOK_PRENOSA), b""):
+            zgoscevalnik.update(blok)
+            pocakaj_na_proracun(omejevalnik, len(blok), 0)
+    return zgoscevalnik.hexdigest()
+
+
+def poisci_dvojnike(vnosi, dodatni_kljuc=None, omejevalnik=None):
+    """Poišče vhode z enako vsebino - vrne slovar {pot: predstavnik}.
+
+    vnosi so pari (vrsta, pot) v vrstnem redu obdelave; predstavnik je prvi
+    vhod skupine. Kandidati se združijo po vzorčnem odtisu, enakost pa se
+    potrdi s polnim odtisom in dodatnim ključem (npr. podnapisi).
+    """
+    po_vzorcu = {}
+    for vrsta, pot in vnosi:
+        try:
+            po_vzorcu.setdefault((vrsta, vzorcni_odtis(pot)), []).append(pot)
+        except OSError:
+            continue
 
-    def obdelaj_obstojeci_mkv(mkv_pot, srt_pot, izbrisi_izvorne):
-        """Obdelaj obstoječo MKV datoteko - doda podnapise, pretvori audio če potrebno."""
-        osnovni_ime = Path(mkv_pot).stem
+    dvojniki = {}
+    for kandidati in po_vzorcu.values():
+        if len(kandidati) < 2:
+            continue
+        po_vsebini = {}
+        for pot in kandidati:
+            try:
+                kljuc = (
+                    polni_odtis(pot, omejevalnik),
+                    dodatni_kljuc and dodatni_kljuc(pot),
+                )
+            except OSError:
+                continue
+            po_vsebini.setdefault(kljuc, []).append(pot)
+        for enaki in po_vsebini.values():
+            for pot in enaki[1:]:
+                dvojniki[pot] = enaki[0]
+    return dvojniki
+
+
+# Koliko začetka (glava, prvi gruči) in konca (indeksi) naslednjega vhoda
+# jedro prebere vnaprej, medtem ko teče trenutno opravilo
+PREDBRANJE_ZACETEK = 64 * 1024 * 1024
+PREDBRANJE_KONEC = 8 * 1024 * 1024
+
+
+def namigni_predbranje(pot):
+    """Jedru naroči, naj v predpomnilnik prebere začetek in konec datoteke."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(pot, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        velikost = os.fstat(fd).st_size
+        os.posix_fadvise(
+            fd, 0, min(velikost, PREDBRANJE_ZACETEK), os.POSIX_FADV_WILLNEED
+        )
+        if velikost > PREDBRANJE_ZACETEK:
+            odmik = max(velikost - PREDBRANJE_KONEC, PREDBRANJE_ZACETEK)
+            os.posix_fadvise(fd, odmik, velikost - odmik, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def sprosti_predpomnilnik(poti):
+    """Jedru sporoči, da strani datotek v predpomnilniku niso več potrebne.
+
+    Sprostijo se samo že zapisane strani, zato je namig za sveže izhode
+    smiselno ponoviti, ko jih jedro zapiše na disk.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for pot in poti:
+        try:
+            fd = os.open(pot, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def s_predogledom(vnosi):
+    """Vrača pare (vnos, naslednji vnos ali None), ne da bi prebral vse vnose."""
+    iterator = iter(vnosi)
+    trenutni = next(iterator, None)
+    while trenutni is not None:
+        naslednji = next(iterator, None)
+        yield trenutni, naslednji
+        trenutni = naslednji
+
+
+class OmejevalnikIO:
+    """Skupni proračun branja in pisanja (bajti/s) za vsa orodja enega zagona.
+
+    Deluje kot vedro žetonov: poraba se odšteva od proračuna, ki se sproti
+    polni, izbruh je omejen na eno sekundo prometa. Hitrost 0 pomeni brez
+    omejitve v tisti smeri.
+    """
+
+    def __init__(self, branje, pisanje):
+        self.hitrosti = (branje, pisanje)
+        self.dolg = [0.0, 0.0]
+        self.cas = time.monotonic()
+        self.kljucavnica = threading.Lock()
+
+    def porabi(self, prebrano, zapisano):
+        """Zabeleži porabo in vrne, koliko sekund naj orodja počivajo."""
+        with self.kljucavnica:
+            zdaj = time.monotonic()
+            pretekel = zdaj - self.cas
+            self.cas = zdaj
+            premor = 0.0
+            for i, bajti in enumerate((prebrano, zapisano)):
+                hitrost = self.hitrosti[i]
+                if not hitrost:
+                    continue
+                self.dolg[i] = max(self.dolg[i] - pretekel * hitrost, -hitrost) + bajti
+                premor = max(premor, self.dolg[i] / hitrost)
+            return premor
+
+
+def procesi_drevesa(pid):
+    """Vrne pid procesa in vseh njegovih potomcev (npr. za flatpak run)."""
+    pidi = [pid]
+    for trenutni in pidi:
+        try:
+            for nit in os.listdir(f"/proc/{trenutni}/task"):
+                with open(f"/proc/{trenutni}/task/{nit}/children") as f:
+                    pidi.extend(int(otrok) for otrok in f.read().split())
+        except OSError:
+            pass
+    return pidi
+
+
+def promet_procesa(pid):
+    """Vrne (prebrano, zapisano) v bajtih iz /proc/<pid>/io.
+
+    rchar/wchar štejeta tudi promet omrežnih datotečnih sistemov (SMB, NFS),
+    ki ga read_bytes/write_bytes na ravni blokovnih naprav ne vidita.
+    """
+    vrednosti = {}
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for vrstica in f:
+                kljuc, _, vrednost = vrstica.partition(":")
+                vrednosti[kljuc] = int(vrednost)
+    except (OSError, ValueError):
+        return 0, 0
+    return vrednosti.get("rchar", 0), vrednosti.get("wchar", 0)
+
+
+# Vrstice izhoda orodij, ki opisujejo napako (ffmpeg piše na stderr,
+# mkvmerge na stdout z oznako "Error:")
+VRSTICA_NAPAKE = re.compile(
+    rb"error|invalid|failed|cannot|could not|no such|not found|unsupported"
+    rb"|permission denied|unknown encoder|does not contain",
+    re.IGNORECASE,
+)
+
+
+class IzhodOrodja:
+    """Omejen zapis izhoda orodja: zadnjih `najvec` bajtov in vrstice z napakami.
+
+    Poraba pomnilnika je neodvisna od dolžine izhoda, tudi pri dolgih
+    kodiranjih, ki izpišejo na desetine MB opozoril in napredka. Vrstice se
+    krajšajo šele kot besedilo, zato je povzetek vedno veljaven UTF-8.
+    """
+
+    def __init__(self, najvec=64 * 1024, napak=20):
+        self.najvec = najvec
+        self.rep = bytearray()
+        self.nedokoncana = b""
+        self.napake = deque(maxlen=napak)
+
+    def dodaj(self, podatki):
+        self.rep += podatki
+        if len(self.rep) > self.najvec:
+            del self.rep[: len(self.rep) - self.najvec]
+
+        # ffmpeg napredek osvežuje z \r, zato sta oba konca vrstice enakovredna
+        vrstice = re.split(rb"[\r\n]", self.nedokoncana + podatki)
+        self.nedokoncana = vrstice.pop()[-4096:]
+        for vrstica in vrstice:
+            if VRSTICA_NAPAKE.search(vrstica):
+                self.napake.append(vrstica.strip()[:2048])
+
+    def povzetek(self, vrstic=10):
+        """Vrne vrstice z napakami ali, če jih ni, zadnje vrstice izhoda."""
+        if self.nedokoncana and VRSTICA_NAPAKE.search(self.nedokoncana):
+            self.napake.append(self.nedokoncana.strip()[:2048])
+            self.nedokoncana = b""
+        vrstice = list(self.napake)[-vrstic:]
+        if not vrstice:
+            vrstice = [v.strip() for v in re.split(rb"[\r\n]", bytes(self.rep))]
+            vrstice = [v for v in vrstice if v][-vrstic:]
+        # Rez po bajtih lahko razpolovi znak - nadomesti ga in krajšaj besedilo
+        return "\n".join(v.decode(errors="replace")[:500] for v in vrstice).encode()
+
+
+def zazeni_orodje(ukaz, omejevalnik=None):
+    """Zažene zunanje orodje kot subprocess.run(..., check=True).
+
+    Izhod orodja (stdout in stderr) bere nit v omejen IzhodOrodja; ob napaki
+    CalledProcessError.stderr vsebuje povzetek z vrsticami napak. Z
+    omejevalnikom se promet orodja in njegovih podprocesov meri v /proc in
+    orodje se ob prekoračitvi proračuna začasno ustavi (SIGSTOP/SIGCONT),
+    kar deluje tudi za omrežne diske, kjer cgroup io.max nima učinka.
+    """
+    izhod = IzhodOrodja()
+    proces = subprocess.Popen(ukaz, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def beri():
+        while True:
+            podatki = os.read(proces.stdout.fileno(), 65536)
+            if not podatki:
+                break
+            izhod.dodaj(podatki)
 
-        (
-            ima_nase_podnapise,
-            audio_kodek,
-            nasi_privzeti,
-            indeks_za_privzet,
+    bralec = threading.Thread(target=beri, daemon=True)
+    bralec.start()
+
+    stevci = {}
+    ustavljeni = []
+    try:
+        while True:
+            try:
+                proces.wait(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if omejevalnik is None:
+                continue
+
+            prebrano = zapisano = 0
+            pidi = procesi_drevesa(proces.pid)
+            for pid in pidi:
+                branje, pisanje = promet_procesa(pid)
+                prej_branje, prej_pisanje = stevci.get(pid, (0, 0))
+                stevci[pid] = (branje, pisanje)
+                prebrano += max(branje - prej_branje, 0)
+                zapisano += max(pisanje - prej_pisanje, 0)
+
+            premor = omejevalnik.porabi(prebrano, zapisano)
+            if premor > 0.05:
+                for pid in pidi:
+                    try:
+                        os.kill(pid, signal.SIGSTOP)
+                        ustavljeni.append(pid)
+                    except OSError:
+                        pass
+                time.sleep(min(premor, 1.0))
+                while ustavljeni:
+                    try:
+                        os.kill(ustavljeni.pop(), signal.SIGCONT)
+                    except OSError:
+                        pass
+    finally:
+        for pid in ustavljeni:
+            try:
+                os.kill(pid, signal.SIGCONT)
+            except OSError:
+                pass
+        if proces.poll() is None:
+            proces.kill()
+            proces.wait()
+        # Podprocesi orodja lahko cev držijo odprto še po njegovem koncu
+        bralec.join(timeout=5)
+        if not bralec.is_alive():
+            proces.stdout.close()
+
+    if proces.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proces.returncode, ukaz, output=b"", stderr=izhod.povzetek()
+        )
+    return subprocess.CompletedProcess(ukaz, proces.returncode, b"", b"")
+
+
+def poisci_video_datoteke(koren, video_koncnice, izpusti=()):
+    """Sproti vrača pare (vrsta, pot) za video datoteke v drevesu imenikov.
+
+    Znotraj posameznega imenika najprej vrne MKV datoteke ("mkv"), nato ostale
+    video datoteke ("video"), tako da obdelava prve datoteke steče takoj, ko je
+    najdena, in v pomnilniku ni seznama celotnega drevesa. Imeniki v izpusti
+    (absolutne poti, npr. izhodna mapa) se ne pregledajo.
+    """
+    for root, dirs, files in os.walk(koren):
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if os.path.abspath(os.path.join(root, d)) not in izpusti
+            and not d.endswith(KosovnoKodiranje.PRIPONA)
+        )
+        ostale = []
+        for datoteka in sorted(files):
+            koncnica = Path(datoteka).suffix.lower()
+            if ZACASNA_DATOTEKA.search(datoteka):
+                continue
+            if koncnica == ".mkv":
+                yield "mkv", os.path.join(root, datoteka)
+            elif koncnica in video_koncnice:
+                ostale.append(os.path.join(root, datoteka))
+        for pot in ostale:
+            yield "video", pot
+
+
+def izracunaj_del(relativna_pot, stevilo_delov):
+    """Stabilno dodeli datoteko enemu od delov 1..N glede na njeno relativno pot.
+
+    Ključ je pot brez končnice in brez pripone _bac, zato izvor (Film.mp4) in
+    njegov izhod (Film.mkv, Film_bac.mkv) vedno pripadata istemu delu.
+    """
+    pot = Path(relativna_pot)
+    stem = PRIPONA_IZHODA.sub("", pot.stem)
+    kljuc = pot.with_name(stem).as_posix().encode("utf-8")
+    return int.from_bytes(hashlib.sha1(kljuc).digest()[:8], "big") % stevilo_delov + 1
+
+
+class ZaklepDatoteke:
+    """Atomski zahtevek za obdelavo datoteke z zaklepno datoteko v njenem imeniku.
+
+    Zaklep se ustvari z O_EXCL, zato ga od več procesov (tudi na različnih
+    strežnikih na skupni mapi) dobi samo eden. Dokler je zaklep zaseden, nit
+    osvežuje njegov čas spremembe (srčni utrip); zaklep brez utripa dlje od
+    ZASTARELOST sekund ali zaklep mrtvega procesa na istem strežniku lahko
+    prevzame drug proces.
+    """
+
+    UTRIP = 30
+    ZASTARELOST = 600
+
+    def __init__(self, pot):
+        mapa, ime = os.path.split(os.path.abspath(pot))
+        self.pot_zaklepa = os.path.join(mapa, f".{ime}.bac-lock")
+        self.lastnik = {"gostitelj": socket.gethostname(), "pid": os.getpid()}
+        self._ustavi = threading.Event()
+        self._nit = None
+        self._zaseden = False
+
+    def _preberi(self, pot):
+        try:
+            with open(pot, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _je_zastarel(self, pot):
+        """Preveri, ali zaklep pripada mrtvemu procesu ali nima več srčnega utripa."""
+        try:
+            starost = time.time() - os.stat(pot).st_mtime
+        except FileNotFoundError:
+            return False
+
+        podatki = self._preberi(pot)
+        if podatki.get("gostitelj") == self.lastnik["gostitelj"] and podatki.get("pid"):
+            try:
+                os.kill(int(podatki["pid"]), 0)
+            except ProcessLookupError:
+                return True
+            except (PermissionError, ValueError):
+                pass
+        return starost > self.ZASTARELOST
+
+    def je_zaseden(self):
+        """Preveri, ali datoteko obdeluje drug živ proces (brez prevzema)."""
+        return os.path.exists(self.pot_zaklepa) and not self._je_zastarel(
+            self.pot_zaklepa
+        )
+
+    def _ustvari(self):
+        fd = os.open(self.pot_zaklepa, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, "w") as f:
+            json.dump({**self.lastnik, "cas": time.time()}, f)
+
+    def prevzemi(self):
+        """Poskusi prevzeti zaklep - vrne False, če datoteko obdeluje drug proces."""
+        try:
+            self._ustvari()
+        except FileExistsError:
+            if not self._je_zastarel(self.pot_zaklepa):
+                return False
+
+            # Zastarel zaklep najprej atomsko preimenuj - uspe le enemu procesu
+            umaknjen = (
+                f"{self.pot_zaklepa}.{self.lastnik['gostitelj']}.{self.lastnik['pid']}"
+            )
+            try:
+                os.rename(self.pot_zaklepa, umaknjen)
+            except FileNotFoundError:
+                return False
+            if not self._je_zastarel(umaknjen):
+                # Vmes ga je prevzel drug proces - vrni njegov zaklep nazaj
+                try:
+                    os.link(umaknjen, self.pot_zaklepa)
+                except OSError:
+                    pass
+                os.remove(umaknjen)
+                return False
+            os.remove(umaknjen)
+
+            try:
+                self._ustvari()
+            except FileExistsError:
+                return False
+        except OSError:
+            # Imenik ni zapisljiv - obdelaj brez zaklepa
+            return True
+
+        self._zaseden = True
+        self._ustavi.clear()
+        self._nit = threading.Thread(target=self._utripaj, daemon=True)
+        self._nit.start()
+        return True
+
+    def _utripaj(self):
+        while not self._ustavi.wait(self.UTRIP):
+            try:
+                os.utime(self.pot_zaklepa)
+            except OSError:
+                return
+
+    def sprosti(self):
+        """Ustavi srčni utrip in odstrani zaklep, če je še naš."""
+        if not self._zaseden:
+            return
+        self._ustavi.set()
+        if self._nit:
+            self._nit.join()
+        podatki = self._preberi(self.pot_zaklepa)
+        if podatki.get("pid") == self.lastnik["pid"] and (
+            podatki.get("gostitelj") == self.lastnik["gostitelj"]
+        ):
+            try:
+                os.remove(self.pot_zaklepa)
+            except FileNotFoundError:
+                pass
+        self._zaseden = False
+
+
+class DnevnikOpravil:
+    """Dnevnik vnaprejšnjega pisanja (write-ahead) za paketno obdelavo.
+
+    Vsak proces piše svoj dnevnik JSONL v mapo .bac_dnevnik v korenu drevesa.
+    Pred pisanjem se zabeleži začetek opravila z začasnimi datotekami, pred
+    zamenjavo cilja pa potrditev s seznamom premikov in izvorov za brisanje.
+    Vsak zapis se z fsync zapiše na disk, zato ob ponovnem zagonu obnovi()
+    za prekinjena opravila mrtvih procesov ve, ali začasne datoteke samo
+    pobriše ali zamenjavo dokonča.
+    """
+
+    MAPA = ".bac_dnevnik"
+
+    def __init__(self, koren):
+        self.mapa = os.path.join(koren, self.MAPA)
+        self.gostitelj = socket.gethostname()
+        self.pot = os.path.join(self.mapa, f"{self.gostitelj}-{os.getpid()}.jsonl")
+        self._datoteka = None
+        self._stevec = 0
+        self._odprto = None
+
+    def _zapisi(self, zapis):
+        ponovno = []
+        if self._datoteka and os.fstat(self._datoteka.fileno()).st_nlink == 0:
+            # Dnevnik je kot zaključen odstranil drug proces - začni novega
+            self._datoteka.close()
+            self._datoteka = None
+            if self._odprto and self._odprto is not zapis:
+                ponovno.append(self._odprto)
+        if self._datoteka is None:
+            os.makedirs(self.mapa, exist_ok=True)
+            self._datoteka = open(self.pot, "a", encoding="utf-8")
+            utrdi_mapo(self.mapa, "dir")
+        for vrstica in ponovno + [zapis]:
+            self._datoteka.write(json.dumps(vrstica, ensure_ascii=False) + "\n")
+        self._datoteka.flush()
+        os.fsync(self._datoteka.fileno())
+
+    def zacni(self, vir, zacasne):
+        """Zabeleži opravilo, preden nastane katera od začasnih datotek."""
+        self._stevec += 1
+        self._odprto = {
+            "id": self._stevec,
+            "korak": "zacetek",
+            "vir": os.path.abspath(vir),
+            "zacasne": [os.path.abspath(p) for p in zacasne if p],
+            "cas": time.time(),
+        }
+        self._zapisi(self._odprto)
+
+    def potrdi(self, premiki, izbrisi=()):
+        """Zabeleži, da je izhod končan - od tu naprej se opravilo dokonča.
+
+        premiki so pari (vir, cilj) za premakni_na_cilj v tem vrstnem redu,
+        izbrisi pa izvori, ki se po zamenjavi odstranijo (-qq).
+        """
+        velikost = os.path.getsize(premiki[0][0]) if premiki else None
+        self._odprto = {
+            **self._odprto,
+            "korak": "potrjeno",
+            "premiki": [[os.path.abspath(a), os.path.abspath(b)] for a, b in premiki],
+            "izbrisi": [os.path.abspath(p) for p in izbrisi if p],
+            "velikost": velikost,
+        }
+        self._zapisi(self._odprto)
+
+    def koncaj(self):
+        """Zaključi odprto opravilo (uspešno ali s počiščenimi datotekami)."""
+        if not self._odprto:
+            return
+        self._zapisi({"id": self._odprto["id"], "korak": "koncano"})
+        self._odprto = None
+
+    def zapri(self):
+        """Ob urejenem koncu odstrani dnevnik, če ni prekinjenega opravila."""
+        if not self._datoteka:
+            return
+        self._datoteka.close()
+        self._datoteka = None
+        if not self._odprto:
+            try:
+                os.remove(self.pot)
+                # Mapa ostane le, če vsebuje dnevnike drugih procesov
+                os.rmdir(self.mapa)
+            except OSError:
+                pass
+
+    def _je_mrtev(self, pot):
+        """Ali je lastnik dnevnika mrtev oz. dnevnik dolgo nespremenjen."""
+        gostitelj, _, pid = Path(pot).stem.rpartition("-")
+        if pot == self.pot:
+            # Dnevnik z našim pid-om je ostal od procesa pred ponovnim zagonom
+            return True
+        if gostitelj == self.gostitelj:
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except (PermissionError, ValueError):
+                pass
+        try:
+            starost = time.time() - os.stat(pot).st_mtime
+        except FileNotFoundError:
+            return False
+        return starost > ZaklepDatoteke.ZASTARELOST
+
+    def obnovi(self, trajnost="file", omejevalnik=None):
+        """Počisti ali dokonča prekinjena opravila iz dnevnikov drugih procesov.
+
+        Opravilo je prekinjeno, če nima zapisa o koncu in njegovega izvora
+        ne drži noben živ proces (zaklep). Nepotrjena opravila izgubijo samo
+        začasne datoteke (izvor se obdela znova), potrjena pa se dokončajo.
+        Vrne število obnovljenih opravil.
+        """
+        try:
+            imena = sorted(os.listdir(self.mapa))
+        except FileNotFoundError:
+            return 0
+
+        obnovljena = 0
+        for ime in imena:
+            pot = os.path.join(self.mapa, ime)
+            if not ime.endswith(".jsonl") or (pot == self.pot and self._datoteka):
+                continue
+            opravila = {}
+            try:
+                with open(pot, "r", encoding="utf-8") as f:
+                    for vrstica in f:
+                        try:
+                            zapis = json.loads(vrstica)
+                        except ValueError:
+                            # Zadnja vrstica je ob zrušitvi lahko nedokončana
+                            continue
+                        opravila.setdefault(zapis.get("id"), {}).update(zapis)
+            except OSError:
+                continue
+
+            odprta = [o for o in opravila.values() if o.get("korak") != "koncano"]
+            zaprta = True
+            for opravilo in odprta:
+                if "vir" not in opravilo:
+                    continue
+                zaklep = ZaklepDatoteke(opravilo["vir"])
+                if not zaklep.prevzemi():
+                    # Opravilo še teče v živem procesu
+                    zaprta = False
+                    continue
+                try:
+                    self._obnovi_opravilo(opravilo, trajnost, omejevalnik)
+                    obnovljena += 1
+                    with open(pot, "a", encoding="utf-8") as f:
+                        f.write(
+                            json.dumps({"id": opravilo["id"], "korak": "koncano"})
+                            + "\n"
+                        )
+                except OSError as e:
+                    print(f"  ✗ Obnova {Path(opravilo['vir']).name} ni uspela: {e}")
+                    zaprta = False
+                finally:
+                    zaklep.sprosti()
+
+            if zaprta and self._je_mrtev(pot):
+                try:
+                    os.remove(pot)
+                except FileNotFoundError:
+                    pass
+        return obnovljena
+
+    def _obnovi_opravilo(self, opravilo, trajnost, omejevalnik=None):
+        premiki = opravilo.get("premiki") or []
+        potrjeno = opravilo.get("korak") == "potrjeno" and all(
+            not os.path.exists(a) or os.path.getsize(a) == opravilo.get("velikost")
+            for a, _ in premiki
+        )
+        print(f"Prekinjeno opravilo: {Path(opravilo['vir']).name}")
+        if potrjeno:
+            for vir, cilj in premiki:
+                if os.path.exists(cilj + ".bac-part"):
+                    os.remove(cilj + ".bac-part")
+                # Že izvedeni premiki nimajo več vira
+                if os.path.exists(vir):
+                    premakni_na_cilj(vir, cilj, trajnost, omejevalnik)
+            if premiki:
+                print(f"  ✓ Dokončana zamenjava: {Path(premiki[-1][1]).name}")
+            for pot in opravilo.get("izbrisi", []):
+                if os.path.exists(pot):
+                    os.remove(pot)
+                    print(f"  ✗ Izbrisan: {Path(pot).name}")
+        for pot in opravilo.get("zacasne", []):
+            if os.path.exists(pot):
+                os.remove(pot)
+                print(f"  ✗ Izbrisana začasna datoteka: {Path(pot).name}")
+
+
+# Ob spremembi pravil obdelave (kodek zvoka, izbira podnapisov, privzete
+# sledi) povečaj, da se datoteke iz manifesta ponovno preverijo
+RAZLICICA_PRAVIL = 1
+
+
+class ManifestObdelave:
+    """Manifest urejenih datotek v korenu drevesa (.bac_manifest.json).
+
+    Za vsako urejeno datoteko hrani odtis (velikost, čas spremembe), odtis
+    podnapisov, ki so bili vanjo dodani, in različico pravil (z oznako pravil
+    zvoka, če niso privzeta). Ponovni zagon
+    datoteko z nespremenjenim odtisom preskoči brez zagona ffprobe/mkvmerge.
+    Izvor, ki ostane ob izhodu (-q), se zabeleži s potjo do izhoda.
+    Ob pisanju se manifest ponovno prebere in združi s spremembami drugih
+    procesov, nato atomsko zamenja. Razdelek podnapisi hrani zgoščene
+    vrednosti podnapisov, vgrajenih v MKV, da se izpišejo samo enkrat.
+    """
+
+    IME = ".bac_manifest.json"
+    RAZDELKI = ("datoteke", "podnapisi")
+    ZAPISI_NA = 30
+
+    def __init__(self, koren, pravila=RAZLICICA_PRAVIL):
+        self.koren = koren
+        self.pot = os.path.join(koren, self.IME)
+        self.pravila = pravila
+        self._podatki = self._preberi()
+        self.vnosi = self._podatki["datoteke"]
+        self._spremembe = {razdelek: {} for razdelek in self.RAZDELKI}
+        self._zapisano = time.monotonic()
+
+    def _preberi(self):
+        try:
+            with open(self.pot, "r", encoding="utf-8") as f:
+                podatki = json.load(f)
+            return {r: dict(podatki.get(r, {})) for r in self.RAZDELKI}
+        except (OSError, ValueError, AttributeError, TypeError):
+            return {r: {} for r in self.RAZDELKI}
+
+    def _kljuc(self, pot):
+        return os.path.relpath(os.path.abspath(pot), self.koren)
+
+    @staticmethod
+    def odtis(pot):
+        st = os.stat(pot)
+        return [st.st_size, st.st_mtime_ns]
+
+    def je_urejen(self, pot, srt_pot=None):
+        """Ali je datoteka urejena po trenutnih pravilih in z danimi podnapisi."""
+        vnos = self.vnosi.get(self._kljuc(pot))
+        if not vnos or vnos.get("pravila") != self.pravila:
+            return False
+        try:
+            if vnos.get("odtis") != self.odtis(pot):
+                return False
+            if srt_pot and vnos.get("srt") != self.odtis(srt_pot):
+                # Zunanji podnapisi so novi ali spremenjeni
+                return False
+        except OSError:
+            return False
+        izhod = vnos.get("izhod")
+        return not izhod or os.path.exists(os.path.join(self.koren, izhod))
+
+    def zabelezi(self, pot, srt_pot=None, izhod=None):
+        try:
+            vnos = {
+                "odtis": self.odtis(pot),
+                "srt": self.odtis(srt_pot) if srt_pot else None,
+                "pravila": self.pravila,
+            }
+        except OSError:
+            return
+        if izhod:
+            vnos["izhod"] = self._kljuc(izhod)
+        self.vnosi[self._kljuc(pot)] = vnos
+        self._spremembe["datoteke"][self._kljuc(pot)] = vnos
+
+    def vgrajeni_podnapisi(self, pot):
+        """Shranjene zgoščene vrednosti vgrajenih podnapisov ali None."""
+        vnos = self._podatki["podnapisi"].get(self._kljuc(pot))
+        try:
+            if vnos and vnos.get("odtis") == self.odtis(pot):
+                return vnos.get("zgoscene", [])
+        except OSError:
+            pass
+        return None
+
+    def zabelezi_podnapise(self, pot, zgoscene):
+        try:
+            vnos = {"odtis": self.odtis(pot), "zgoscene": list(zgoscene)}
+        except OSError:
+            return
+        self._podatki["podnapisi"][self._kljuc(pot)] = vnos
+        self._spremembe["podnapisi"][self._kljuc(pot)] = vnos
+
+    def _zdruzeni(self):
+        """Manifest z diska, združen s še nezapisanimi spremembami."""
+        podatki = self._preberi()
+        for razdelek, spremembe in self._spremembe.items():
+            podatki[razdelek].update(spremembe)
+        return podatki
+
+    def osvezi(self):
+        """Ponovno prebere vnose, ki so jih medtem zapisali drugi procesi."""
+        self._podatki = self._zdruzeni()
+        self.vnosi = self._podatki["datoteke"]
+
+    def zapisi(self, takoj=False):
+        """Zapiše spremembe - brez takoj največ vsakih ZAPISI_NA sekund."""
+        if not any(self._spremembe.values()):
+            return
+        if not takoj and time.monotonic() - self._zapisano < self.ZAPISI_NA:
+            return
+        podatki = self._zdruzeni()
+        zacasna = f"{self.pot}.{socket.gethostname()}-{os.getpid()}.tmp"
+        try:
+            with open(zacasna, "w", encoding="utf-8") as f:
+                json.dump(podatki, f, ensure_ascii=False)
+            os.replace(zacasna, self.pot)
+        except OSError:
+            if os.path.exists(zacasna):
+                os.remove(zacasna)
+            return
+        self._podatki = podatki
+        self.vnosi = podatki["datoteke"]
+        for spremembe in self._spremembe.values():
+            spremembe.clear()
+        self._zapisano = time.monotonic()
+
+
+class DrugacneNastavitve(Exception):
+    """Delovna mapa kodiranja po kosih je iz drugega vira ali nastavitev."""
+
+    def __init__(self, mapa, koncanih):
+        super().__init__(
+            f"{mapa} je iz drugega vira ali drugih nastavitev "
+            f"(kodiranih kosov: {koncanih})"
+        )
+        self.koncanih = koncanih
+
+
+class IzgubljeneSlicice(Exception):
+    """Zlepljeni kosi nimajo toliko sličic kot izvorna video sled."""
+
+    def __init__(self, izvor, kodirano):
+        super().__init__(
+            f"zlepljeni kosi imajo {kodirano} sličic, izvor pa {izvor} - ob rezih "
+            "so se izgubile sličice (odprt GOP), video kodirajte brez kosov"
+        )
+
+
+class KosovnoKodiranje:
+    """Vzporedno kodiranje videa po kosih, razrezanih na ključnih sličicah.
+
+    Muxer segment video brez pretvorbe razreže na kose (rez je vedno na
+    ključni sličici), kosi se kodirajo hkrati v ločenih procesih ffmpeg,
+    demuxer concat pa kodirane kose brez izgub zlepi nazaj. Delovna mapa
+    {cilj}.bac-deli je ob cilju; opis naloge (naloga.json) v njej omogoča,
+    da kose prevzemajo tudi delavci na drugih strežnikih (--chunk-worker).
+    Vsak kos kodira samo proces, ki ga zaklene z ZaklepDatoteke. Po prvi
+    napaki ostali delavci ne prevzamejo novih kosov. Z ffprobe se pred
+    združevanjem preveri, da imajo zlepljeni kosi toliko sličic kot izvor
+    (izvor z odprtim GOP na rezih izgubi sličice).
+
+    Ob napaki ali prekinitvi mapa ostane. Končani kosi so zabeleženi v
+    manifestu (koncani-{gostitelj}-{pid}.jsonl, en na proces) z velikostjo
+    in zgostitvijo nastavitev (argumenti kodirnika, sled, dolžina kosa in
+    odtis vira), zato ponoven zagon nadaljuje pri prvem nekodiranem kosu.
+    Če se zgostitev ne ujema, pripravi() sproži DrugacneNastavitve.
+    """
+
+    PRIPONA = ".bac-deli"
+    NALOGA = "naloga.json"
+    DOLZINA_KOSA = 60
+    _zapisovanje = threading.Lock()
+
+    def __init__(
+        self,
+        ffmpeg,
+        vhod,
+        cilj,
+        argumenti,
+        preslikava="0:v:0",
+        omejevalnik=None,
+        ffprobe=None,
+    ):
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.vhod = vhod
+        self.cilj = cilj
+        self.argumenti = list(argumenti)
+        self.preslikava = preslikava
+        self.omejevalnik = omejevalnik
+        self.mapa = cilj + self.PRIPONA
+        self.pripravljeno = False
+
+    @staticmethod
+    def ukaz_ffmpeg(ffmpeg, argumenti):
+        if "flatpak run" in ffmpeg:
+            return ffmpeg.split() + argumenti
+        return [ffmpeg] + argumenti
+
+    @staticmethod
+    def izhod_kosa(mapa, kos):
+        return os.path.join(mapa, "kodiran_" + kos[len("izvorni_") :])
+
+    @staticmethod
+    def z_ustavitvijo(ustavi, funkcija, *argumenti):
+        """Pokliče funkcijo v bazenu - ob napaki ustavi ostale delavce."""
+        try:
+            return funkcija(*argumenti)
+        except BaseException:
+            ustavi.set()
+            raise
+
+    @classmethod
+    def stevilo_slicic(cls, ffprobe, pot, sled):
+        """Število paketov (sličic) video sledi; ffprobe prebere celoten tok."""
+        rezultat = subprocess.run(
+            cls.ukaz_ffmpeg(
+                ffprobe,
+                ["-v", "error", "-select_streams", sled, "-count_packets"]
+                + ["-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", pot],
+            ),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return int(rezultat.stdout.split()[0])
+
+    def zgostitev(self):
+        opis = {
+            "argumenti": self.argumenti,
+            "preslikava": self.preslikava,
+            "dolzina_kosa": self.DOLZINA_KOSA,
+            "vir": ManifestObdelave.odtis(self.vhod),
+        }
+        return hashlib.sha1(json.dumps(opis, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def preberi_nalogo(cls, mapa):
+        try:
+            with open(os.path.join(mapa, cls.NALOGA), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def koncani_kosi(cls, mapa, zgostitev):
+        """{kos: velikost} iz manifesta končanih kosov z danimi nastavitvami."""
+        koncani = {}
+        for ime in os.listdir(mapa):
+            if not (ime.startswith("koncani-") and ime.endswith(".jsonl")):
+                continue
+            with open(os.path.join(mapa, ime), "r", encoding="utf-8") as f:
+                for vrstica in f:
+                    try:
+                        zapis = json.loads(vrstica)
+                    except ValueError:
+                        # Nedokončana vrstica ob zrušitvi
+                        continue
+                    if zapis.get("zgostitev") == zgostitev:
+                        koncani[zapis.get("kos")] = zapis.get("velikost")
+        return koncani
+
+    @classmethod
+    def zabelezi_kos(cls, mapa, kos, zgostitev, velikost):
+        """Doda kos v manifest tega procesa (pred objavo kodiranega kosa)."""
+        pot = os.path.join(
+            mapa, f"koncani-{socket.gethostname()}-{os.getpid()}.jsonl"
+        )
+        zapis = {"kos": kos, "zgostitev": zgostitev, "velikost": velikost}
+        with cls._zapisovanje, open(pot, "a", encoding="utf-8") as f:
+            f.write(json.dumps(zapis) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pripravi(self):
+        """Pripravi delovno mapo - vrne (število že kodiranih kosov, vseh kosov).
+
+        Obstoječa mapa z enakimi nastavitvami se nadaljuje: kodirani kosi,
+        ki jih manifest ne potrjuje (npr. druga velikost), se odstranijo.
+        Naloga brez zgostitve (starejša različica) se razreže na novo.
+        """
+        zgostitev = self.zgostitev()
+        naloga = self.preberi_nalogo(self.mapa)
+        if naloga is None or "zgostitev" not in naloga:
+            # Razrez ni bil dokončan ali kosom ni mogoče zaupati - začni na novo
+            self.pocisti()
+            self.razrezi(zgostitev)
+            self.pripravljeno = True
+            return 0, len(self.preberi_nalogo(self.mapa)["kosi"])
+
+        koncani = self.koncani_kosi(self.mapa, naloga["zgostitev"])
+        if naloga["zgostitev"] != zgostitev:
+            raise DrugacneNastavitve(self.mapa, len(koncani))
+        kodirani = 0
+        for kos in naloga["kosi"]:
+            izhod = self.izhod_kosa(self.mapa, kos)
+            if not os.path.exists(izhod):
+                continue
+            if koncani.get(kos) == os.path.getsize(izhod):
+                kodirani += 1
+            else:
+                os.remove(izhod)
+        self.pripravljeno = True
+        return kodirani, len(naloga["kosi"])
+
+    def razrezi(self, zgostitev):
+        """Razreže video v delovno mapo in zapiše opis naloge."""
+        os.makedirs(self.mapa, exist_ok=True)
+        zazeni_orodje(
+            self.ukaz_ffmpeg(
+                self.ffmpeg,
+                ["-i", self.vhod, "-y", "-map", self.preslikava, "-c", "copy"]
+                + ["-an", "-sn", "-dn", "-f", "segment"]
+                + ["-segment_time", str(self.DOLZINA_KOSA), "-reset_timestamps", "1"]
+                + [os.path.join(self.mapa, "izvorni_%05d.mkv")],
+            ),
+            self.omejevalnik,
+        )
+        kosi = sorted(
+            ime
+            for ime in os.listdir(self.mapa)
+            if ime.startswith("izvorni_") and ime.endswith(".mkv")
+        )
+        naloga = os.path.join(self.mapa, self.NALOGA)
+        with open(naloga + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"argumenti": self.argumenti, "kosi": kosi, "zgostitev": zgostitev}, f
+            )
+        os.replace(naloga + ".tmp", naloga)
+
+    @classmethod
+    def prevzemi_kose(
+        cls, ffmpeg, mapa, niti=1, omejevalnik=None, sporoci=None, ustavi=None
+    ):
+        """Kodira vse nekodirane kose naloge, ki jih ne kodira drug proces.
+
+        Vrne število kosov, ki jih je kodiral ta klic. sporoci(kos) se
+        pokliče po vsakem kodiranem kosu. Ko je dogodek ustavi nastavljen,
+        se novi kosi ne prevzemajo več. Naloge brez zgostitve ne kodira, ker
+        jo bo pripravi() razrezala na novo.
+        """
+        naloga = cls.preberi_nalogo(mapa)
+        if naloga is None:
+            raise FileNotFoundError(os.path.join(mapa, cls.NALOGA))
+        zgostitev = naloga.get("zgostitev")
+        kodirani = 0
+        if zgostitev is None:
+            return kodirani
+        for kos in naloga["kosi"]:
+            if ustavi is not None and ustavi.is_set():
+                break
+            izhod = cls.izhod_kosa(mapa, kos)
+            if os.path.exists(izhod):
+                continue
+            zaklep = ZaklepDatoteke(os.path.join(mapa, kos))
+            if not zaklep.prevzemi():
+                continue
+            zacasna = izhod + ".bac-part"
+            try:
+                if os.path.exists(izhod):
+                    continue
+                zazeni_orodje(
+                    cls.ukaz_ffmpeg(
+                        ffmpeg,
+                        ["-i", os.path.join(mapa, kos), "-y", "-map", "0:v:0"]
+                        + naloga["argumenti"]
+                        + ["-threads", str(niti), "-an", "-sn", "-dn"]
+                        + ["-f", "matroska", zacasna],
+                    ),
+                    omejevalnik,
+                )
+                # Kos je kodiran šele, ko je v manifestu in pod končnim imenom
+                utrdi(zacasna, "file")
+                cls.zabelezi_kos(mapa, kos, zgostitev, os.path.getsize(zacasna))
+                os.replace(zacasna, izhod)
+                kodirani += 1
+                if sporoci:
+                    sporoci(kos)
+            finally:
+                if os.path.exists(zacasna):
+                    os.remove(zacasna)
+                zaklep.sprosti()
+        return kodirani
+
+    def kodiraj(self, delavci=None, dodatna_opravila=()):
+        """Vzporedno kodira nekodirane kose in jih zlepi - vrne pot videa.
+
+        Delovno mapo najprej preveri s pripravi(), če je klicatelj še ni
+        pripravil. dodatna_opravila so ukazi
+        (npr. pretvorba zvoka), ki tečejo v istem bazenu procesov kot kosi.
+        Kose, ki jih kodirajo drugi delavci, počaka. Napaka dodatnega
+        opravila ustavi kodiranje kosov in se sproži tukaj; če manjkajočega
+        kosa po krogu ne kodira nihče, se sproži FileNotFoundError.
+        """
+        if not self.pripravljeno:
+            self.pripravi()
+        kosi = self.preberi_nalogo(self.mapa)["kosi"]
+        jedra = os.cpu_count() or 1
+        delavci = max(1, min(delavci or jedra, len(kosi)))
+        niti = max(1, jedra // delavci)
+        # Prva napaka ustavi ostale delavce po njihovem trenutnem kosu
+        ustavi = threading.Event()
+        manjkalo = None
+        with ThreadPoolExecutor(max_workers=delavci) as izvajalec:
+            dodatna = [
+                izvajalec.submit(
+                    self.z_ustavitvijo, ustavi, zazeni_orodje, ukaz, self.omejevalnik
+                )
+                for ukaz in dodatna_opravila
+            ]
+            while True:
+                opravila = [
+                    izvajalec.submit(
+                        self.z_ustavitvijo,
+                        ustavi,
+                        self.prevzemi_kose,
+                        self.ffmpeg,
+                        self.mapa,
+                        niti,
+                        self.omejevalnik,
+                        None,
+                        ustavi,
+                    )
+                    for _ in range(delavci)
+                ]
+                for opravilo in opravila:
+                    opravilo.result()
+                if ustavi.is_set():
+                    # Napaka dodatnega opravila - sproži njeno izjemo
+                    for opravilo in dodatna:
+                        opravilo.result()
+                manjkajoci = [
+                    k
+                    for k in kosi
+                    if not os.path.exists(self.izhod_kosa(self.mapa, k))
+                ]
+                if not manjkajoci:
+                    break
+                if len(manjkajoci) == manjkalo and not any(
+                    ZaklepDatoteke(os.path.join(self.mapa, k)).je_zaseden()
+                    for k in manjkajoci
+                ):
+                    # Krog brez napredka in brez drugih delavcev
+                    raise FileNotFoundError(
+                        errno.ENOENT,
+                        "Kosa ne kodira noben delavec",
+                        self.izhod_kosa(self.mapa, manjkajoci[0]),
+                    )
+                manjkalo = len(manjkajoci)
+                # Preostale kose kodirajo drugi delavci - zastarel zaklep
+                # (mrtev delavec) naslednji krog prevzame
+                time.sleep(2)
+            for opravilo in dodatna:
+                opravilo.result()
+
+        seznam = os.path.join(self.mapa, "seznam.txt")
+        with open(seznam, "w", encoding="utf-8") as f:
+            for kos in kosi:
+                ime = os.path.basename(self.izhod_kosa(self.mapa, kos))
+                f.write(f"file '{ime}'\n")
+        video = os.path.join(self.mapa, "video.mkv")
+        zazeni_orodje(
+            self.ukaz_ffmpeg(
+                self.ffmpeg,
+                ["-f", "concat", "-safe", "0", "-i", seznam, "-y", "-map", "0"]
+                + ["-c", "copy", video],
+            ),
+            self.omejevalnik,
+        )
+        if self.ffprobe:
+            izvor = self.stevilo_slicic(
+                self.ffprobe, self.vhod, self.preslikava.split(":", 1)[1]
+            )
+            kodirano = self.stevilo_slicic(self.ffprobe, video, "v:0")
+            if kodirano != izvor:
+                # Kosi z enakimi nastavitvami bi izgubili iste sličice
+                self.pocisti()
+                raise IzgubljeneSlicice(izvor, kodirano)
+        return video
+
+    def pocisti(self):
+        shutil.rmtree(self.mapa, ignore_errors=True)
+
+
+def poisci_orodje(ime):
+    """Poišče orodje za CLI v PATH ali kot flatpak (ukaz "flatpak run ...")."""
+    pot = shutil.which(ime)
+    if pot:
+        return pot
+    try:
+        rezultat = subprocess.run(
+            ["flatpak", "list", "--app", "--columns=application"],
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        if rezultat.returncode == 0:
+            aplikacije = rezultat.stdout.strip().split("\n")
+            if ime in ["ffmpeg", "ffprobe"]:
+                for app in aplikacije:
+                    if "ffmpeg" in app.lower():
+                        return f"flatpak run --command={ime} {app}"
+            if ime.startswith("mkv"):
+                for app in aplikacije:
+                    if "mkvtoolnix" in app.lower():
+                        return f"flatpak run --command={ime} {app}"
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        pass
+    return None
+
+
+def delavec_kosov(mapa):
+    """Na tem strežniku kodira kose naloge v delovni mapi (--chunk-worker).
+
+    Dokler opisa naloge ni (razrez še teče), čaka nanj; konča, ko ni več
+    kosov, ki jih ne bi že kodiral ali zaklenil kak drug proces.
+    """
+    ffmpeg = poisci_orodje("ffmpeg")
+    if not ffmpeg:
+        print("Napaka: ffmpeg ni nameščen.")
+        sys.exit(1)
+
+    naloga = os.path.join(mapa, KosovnoKodiranje.NALOGA)
+    while not os.path.exists(naloga):
+        if not os.path.isdir(mapa):
+            print(f"Napaka: delovna mapa '{mapa}' ne obstaja.")
+            sys.exit(1)
+        time.sleep(2)
+
+    delavci = os.cpu_count() or 1
+    print(f"Kodiram kose v {mapa} ({delavci} hkrati)...")
+
+    def sporoci(kos):
+        print(f"  ✓ {kos}")
+
+    ustavi = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=delavci) as izvajalec:
+            opravila = [
+                izvajalec.submit(
+                    KosovnoKodiranje.z_ustavitvijo,
+                    ustavi,
+                    KosovnoKodiranje.prevzemi_kose,
+                    ffmpeg,
+                    mapa,
+                    1,
+                    None,
+                    sporoci,
+                    ustavi,
+                )
+                for _ in range(delavci)
+            ]
+            kodirani = sum(opravilo.result() for opravilo in opravila)
+    except subprocess.CalledProcessError as e:
+        napaka = e.stderr.decode(errors="replace") if e.stderr else str(e)
+        print("  ✗ Napaka: " + napaka.replace("\n", "\n    "))
+        sys.exit(1)
+    except OSError as e:
+        # Koordinator je nalogo medtem končal in mapo pobrisal
+        print(f"  ! Naloga ni več na voljo: {e}")
+        kodirani = 0
+    print(f"\nKončano: {kodirani} kodiranih kosov.")
+
+
+class OpazovalecMape:
+    """Opazuje drevo imenikov z inotify in vrača datoteke, ko se nehajo spreminjati.
+
+    Datoteka je pripravljena, ko se njena velikost in čas spremembe (ter vseh
+    drugih novih datotek v istem imeniku) vsaj `mirovanje` sekund ne
+    spremenita, zato se delno preneseni video in njegov SRT obdelata skupaj.
+    Celoten pregled drevesa se ponovi le ob prelivu čakalne vrste inotify;
+    takrat se v vrsto dodajo samo datoteke, ki so nove ali so se spremenile,
+    odkar so bile nazadnje videne.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self, koren, koncnice, mirovanje=5, prezri=None, izpusti=()):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify ni podprt")
+        fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if fd < 0:
+            napaka = ctypes.get_errno()
+            raise OSError(napaka, os.strerror(napaka))
+
+        self.fd = fd
+        self.koren = koren
+        self.koncnice = {k.lower() for k in koncnice}
+        self.mirovanje = mirovanje
+        self.prezri = prezri if prezri is not None else set()
+        self.izpusti = set(izpusti)
+        self.mape = {}  # deskriptor opazovanja -> pot imenika
+        self.cakajoce = {}  # pot -> (velikost, mtime_ns, čas zadnje spremembe)
+        self.videne = {}  # pot -> (velikost, mtime_ns) ob zadnjem pregledu
+        self._dodaj_drevo(koren, zabelezi=False)
+
+    def _dodaj_mapo(self, mapa):
+        maska = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(mapa), maska)
+        if wd < 0:
+            napaka = ctypes.get_errno()
+            print(f"Opozorilo: ne morem opazovati {mapa}: {os.strerror(napaka)}")
+            return
+        self.mape[wd] = mapa
+
+    def _dodaj_drevo(self, koren, zabelezi):
+        if os.path.abspath(koren) in self.izpusti or koren.endswith(
+            KosovnoKodiranje.PRIPONA
+        ):
+            return
+        for root, dirs, files in os.walk(koren):
+            dirs[:] = [
+                d
+                for d in dirs
+                if os.path.abspath(os.path.join(root, d)) not in self.izpusti
+                and not d.endswith(KosovnoKodiranje.PRIPONA)
+            ]
+            self._dodaj_mapo(root)
+            for datoteka in files:
+                if zabelezi:
+                    # Datoteke, ki so nastale pred začetkom opazovanja nove mape,
+                    # ali so se spremenile med prelivom
+                    self._zabelezi(os.path.join(root, datoteka), samo_spremenjene=True)
+                else:
+                    self._zapomni(os.path.join(root, datoteka))
+
+    def _zapomni(self, pot):
+        if Path(pot).suffix.lower() not in self.koncnice:
+            return
+        try:
+            st = os.stat(pot)
+        except OSError:
+            return
+        self.videne[pot] = (st.st_size, st.st_mtime_ns)
+
+    def _zabelezi(self, pot, samo_spremenjene=False):
+        if Path(pot).suffix.lower() not in self.koncnice or ZACASNA_DATOTEKA.search(pot):
+            return
+        if pot in self.cakajoce:
+            return
+        if samo_spremenjene and pot in self.videne:
+            try:
+                st = os.stat(pot)
+            except OSError:
+                return
+            if (st.st_size, st.st_mtime_ns) == self.videne[pot]:
+                return
+        self.cakajoce[pot] = (None, None, time.monotonic())
+
+    def _preberi_dogodke(self):
+        try:
+            podatki = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        odmik = 0
+        while odmik < len(podatki):
+            wd, maska, _, dolzina = struct.unpack_from("iIII", podatki, odmik)
+            ime = podatki[odmik + 16 : odmik + 16 + dolzina].rstrip(b"\0")
+            odmik += 16 + dolzina
+
+            if maska & self.IN_Q_OVERFLOW:
+                print("Opozorilo: preliv dogodkov inotify, ponovno pregledujem drevo.")
+                self._dodaj_drevo(self.koren, zabelezi=True)
+                continue
+            if maska & self.IN_IGNORED:
+                self.mape.pop(wd, None)
+                continue
+
+            mapa = self.mape.get(wd)
+            if mapa is None or not ime:
+                continue
+            pot = os.path.join(mapa, os.fsdecode(ime))
+
+            if maska & self.IN_ISDIR:
+                if maska & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self._dodaj_drevo(pot, zabelezi=True)
+                continue
+            self._zabelezi(pot)
+
+    def _pripravljene(self):
+        """Vrne datoteke, ki so (skupaj s svojim imenikom) dovolj dolgo mirovale."""
+        zdaj = time.monotonic()
+        for pot, (velikost, mtime, cas) in list(self.cakajoce.items()):
+            try:
+                st = os.stat(pot)
+            except FileNotFoundError:
+                del self.cakajoce[pot]
+                self.videne.pop(pot, None)
+                continue
+            if (st.st_size, st.st_mtime_ns) != (velikost, mtime):
+                self.cakajoce[pot] = (st.st_size, st.st_mtime_ns, zdaj)
+
+        nemirne_mape = {
+            os.path.dirname(pot)
+            for pot, (_, _, cas) in self.cakajoce.items()
+            if zdaj - cas < self.mirovanje
+        }
+        pripravljene = sorted(
+            pot for pot in self.cakajoce if os.path.dirname(pot) not in nemirne_mape
+        )
+        for pot in pripravljene:
+            velikost, mtime, _ = self.cakajoce.pop(pot)
+            self.videne[pot] = (velikost, mtime)
+        return pripravljene
+
+    def _videi_za_podnapis(self, srt_pot):
+        """Vrne videe, katerim je srt_pot najboljše ujemanje podnapisov."""
+        deli = Path(srt_pot).parent.parts
+        mapa = str(Path(srt_pot).parent)
+        for i, del_poti in enumerate(deli):
+            if del_poti.lower() in PODNAPISNE_MAPE:
+                mapa = str(Path(*deli[:i]))
+                break
+
+        indeks = IndeksPodnapisov(mapa)
+        videi = []
+        for datoteka in sorted(os.listdir(mapa)):
+            pot = os.path.join(mapa, datoteka)
+            koncnica = Path(datoteka).suffix.lower()
+            if (
+                koncnica == ".srt"
+                or koncnica not in self.koncnice
+                or pot in self.cakajoce
+                or ZACASNA_DATOTEKA.search(datoteka)
+            ):
+                continue
+            if indeks.poisci(pot)[0] == srt_pot:
+                videi.append(("mkv" if koncnica == ".mkv" else "video", pot))
+        # MKV najprej, tako kot pri pregledu drevesa
+        return sorted(videi, key=lambda v: v[0] != "mkv")
+
+    def spremembe(self):
+        """Neskončno vrača (vrsta, pot) za nove videe in videe, ki jim je prispel SRT."""
+        while True:
+            pripravljen, _, _ = select.select([self.fd], [], [], 1.0)
+            if pripravljen:
+                self._preberi_dogodke()
+
+            # Vse vnose določi pred obdelavo, da izhodi te obdelave niso med njimi
+            vnosi = []
+            for pot in self._pripravljene():
+                if os.path.abspath(pot) in self.prezri:
+                    self.prezri.discard(os.path.abspath(pot))
+                    continue
+                if pot.lower().endswith(".srt"):
+                    vnosi.extend(self._videi_za_podnapis(pot))
+                else:
+                    vnosi.append(("mkv" if pot.lower().endswith(".mkv") else "video", pot))
+
+            vrnjene = set()
+            for vnos in vnosi:
+                if vnos[1] not in vrnjene:
+                    vrnjene.add(vnos[1])
+                    yield vnos
+
+    def zapri(self):
+        os.close(self.fd)
+
+
+def hitro_pretvorba_cli(
+    izbrisi_izvorne=False,
+    del_knjiznice=None,
+    opazuj=None,
+    zacasna_mapa=None,
+    izhodna_mapa=None,
+    vrni_nazaj=False,
+    trajnost="file",
+    omejitev_io=None,
+    zdruzi_dvojnike=False,
+    pravila_zvoka=None,
+    vse_zvocne=False,
+):
+    """CLI način za hitro pretvorbo vseh video datotek v trenutnem imeniku.
+
+    del_knjiznice je par (i, N): obdelajo se samo datoteke, ki po stabilni
+    zgoščevalni vrednosti relativne poti pripadajo delu i od N.
+    opazuj je čas mirovanja v sekundah: po začetnem pregledu proces ostane
+    aktiven in sproti obdeluje nove datoteke, ko se nehajo spreminjati.
+    zacasna_mapa je mapa za vmesne datoteke (npr. na lokalnem SSD namesto
+    na omrežnem disku); opravila, za katera zmanjka prostora, se odložijo.
+    izhodna_mapa zrcali relativno drevo imenikov za izhode, da branje in
+    pisanje tečeta na različnih diskih; z vrni_nazaj (-qq) rezultat na koncu
+    zamenja izvirnik na izvornem mestu.
+    trajnost ("none", "file", "dir") določa, ali se izhod pred zamenjavo
+    cilja (in imenik po njej) zapiše na disk z fsync.
+    omejitev_io je par (branje, pisanje) v MB/s, skupen za vsa orodja zagona.
+    zdruzi_dvojnike: vhodi z enako vsebino (in enakimi podnapisi) se obdelajo
+    enkrat, rezultat pa se na cilje ostalih poveže (reflink ali trda povezava).
+    pravila_zvoka (PravilaZvoka) določajo, katere zvočne sledi se pretvorijo;
+    privzeto se vse razen AC3 pretvori v AC3 s 192 kb/s.
+    vse_zvocne: namesto ene (angleške) se ohranijo vse zvočne sledi; ffmpeg
+    v enem prehodu pretvori tiste, ki jih pravila ne dovolijo.
+    """
+    pravila_zvoka = pravila_zvoka or PravilaZvoka()
+
+    # Poišči orodja
+    ffmpeg = poisci_orodje("ffmpeg")
+    ffprobe = poisci_orodje("ffprobe")
+    mkvmerge = poisci_orodje("mkvmerge")
+    mkvpropedit = poisci_orodje("mkvpropedit")
+
+    omejevalnik = None
+    if omejitev_io:
+        omejevalnik = OmejevalnikIO(*(mb * 1024 * 1024 for mb in omejitev_io))
+
+    if not mkvmerge:
+        print("Napaka: mkvmerge ni nameščen.")
+        sys.exit(1)
+
+    # Poišči video datoteke rekurzivno
+    video_koncnice = [
+        ".mp4",
+        ".avi",
+        ".mov",
+        ".wmv",
+        ".flv",
+        ".webm",
+        ".m4v",
+        ".mpeg",
+        ".mpg",
+        ".m2ts",
+        ".ts",
+    ]
+    trenutni_dir = os.getcwd()
+
+    # Dokončaj ali počisti opravila, ki jih je prekinila zrušitev ali izklop
+    dnevnik = DnevnikOpravil(trenutni_dir)
+    if dnevnik.obnovi(trajnost, omejevalnik):
+        print()
+    razlicica = pravila_zvoka.razlicica()
+    if vse_zvocne:
+        # Izhod z vsemi zvočnimi sledmi ni urejen za način z eno sledjo
+        razlicica = f"{razlicica}-vse"
+    manifest = ManifestObdelave(trenutni_dir, razlicica)
+
+    uspesne = 0
+    neuspesne = 0
+
+    # Jeziki, ki jih štejemo kot "naše" podnapise (prioriteta: slv > hrv > srp > bos)
+    nasi_jeziki = ["slv", "slo", "sl", "hrv", "hr", "srp", "sr", "bos", "bs"]
+    prioriteta_jezikov = {
+        "slv": 0,
+        "slo": 0,
+        "sl": 0,
+        "hrv": 1,
+        "hr": 1,
+        "srp": 2,
+        "sr": 2,
+        "bos": 3,
+        "bs": 3,
+    }
+    angleski_audio_jeziki = {"eng", "en", "english"}
+
+    def je_angleski_audio(sled):
+        jezik = sled.get("tags", {}).get("language", "").lower()
+        return (
+            jezik in angleski_audio_jeziki
+            or jezik.startswith("en-")
+            or jezik.startswith("eng-")
+        )
+
+    def izberi_audio_sled(sledi):
+        """Vrne (kodek, globalni indeks, audio-relativni indeks), z angleščino prednostno."""
+        audio_sledi = []
+        for sled in sledi:
+            if sled.get("codec_type") == "audio":
+                audio_sledi.append((sled, len(audio_sledi)))
+
+        if not audio_sledi:
+            return None, None, None
+
+        izbrana_sled, relativni_indeks = next(
+            (
+                (sled, relativni_indeks)
+                for sled, relativni_indeks in audio_sledi
+                if je_angleski_audio(sled)
+            ),
+            audio_sledi[0],
+        )
+        return (
+            izbrana_sled.get("codec_name"),
+            izbrana_sled.get("index"),
+            relativni_indeks,
+        )
+
+    def nacrt_zvoka(sledi, indeks):
+        """Načrt pretvorbe izbrane zvočne sledi po pravilih (None = kopiraj)."""
+        sled = next((s for s in sledi if s.get("index") == indeks), None)
+        return pravila_zvoka.nacrtuj_zvok(sled) if sled else None
+
+    def stopnja_kanalov(sled):
+        """Stopnja postavitve kanalov (mono, stereo, 5.1, 7.1) ali None."""
+        kanali = sled.get("channels")
+        if not kanali:
+            return None
+        return sum(1 for meja in (1, 2, 6, 8) if kanali >= meja)
+
+    def predvajljiva_sled(sledi, indeks):
+        """Jedro izbrane zvočne sledi kot ločena sled, ki je pravila ne pretvarjajo.
+
+        V MKV iz Blu-ray je to običajno AC3 jedro TrueHD sledi, ki ga je
+        mkvmerge ob predelavi shranil kot ločeno sled. Jedro ima jezik
+        izbrane sledi, ni komentar, nima drugačnega naslova in ima enako ali
+        za eno stopnjo manj kanalov (7.1 → 5.1). Vrne (sled, relativni
+        indeks) ali (None, None).
+        """
+        izbrana = next((s for s in sledi if s.get("index") == indeks), None)
+        if not izbrana:
+            return None, None
+        oznake = izbrana.get("tags", {})
+        jezik = oznake.get("language", "").lower()
+        naslov = oznake.get("title", "")
+        stopnja = stopnja_kanalov(izbrana)
+        zvocne = [s for s in sledi if s.get("codec_type") == "audio"]
+        for relativni, sled in enumerate(zvocne):
+            oznake_sledi = sled.get("tags", {})
+            stopnja_sledi = stopnja_kanalov(sled)
+            if (
+                sled is izbrana
+                or oznake_sledi.get("language", "").lower() != jezik
+                or sled.get("disposition", {}).get("comment")
+                or (oznake_sledi.get("title") or naslov) != naslov
+                or stopnja is None
+                or stopnja_sledi is None
+                or not 0 <= stopnja - stopnja_sledi <= 1
+            ):
+                continue
+            if pravila_zvoka.nacrtuj_zvok(sled) is None:
+                return sled, relativni
+        return None, None
+
+    def sledi_blu_ray(video_pot):
+        """Sledi mkvmerge -J za .m2ts/.ts ([] ob napaki), za druge vsebnike None.
+
+        V Blu-ray toku se id-ji mkvmerge razlikujejo od indeksov ffprobe, zato
+        se tok pregleda enkrat, sledi pa podajo vsem, ki potrebujejo id-je.
+        """
+        if Path(video_pot).suffix.lower() not in (".m2ts", ".ts"):
+            return None
+        try:
+            return sledi_mkvmerge(mkvmerge, video_pot)
+        except (subprocess.CalledProcessError, OSError, ValueError):
+            return []
+
+    def jedro_blu_ray(sledi_mkv, relativni, zvok):
+        """Za .m2ts/.ts vrne (mkvmerge id izbrane zvočne sledi, načrt zvoka).
+
+        sledi_mkv so sledi iz sledi_blu_ray. Če je izbrana sled TrueHD z AC3
+        jedrom, ki ga pravila dovolijo, se jedro kopira z mkvmerge in načrt
+        pretvorbe odpade.
+        """
+        jedra = jedra_truehd(sledi_mkv)
+        id_jeder = {jedro.get("id") for jedro in jedra.values()}
+        # ffprobe jedra ne pokaže kot ločene sledi, zato ga pri štetju izpustimo
+        zvocne = [
+            s
+            for s in sledi_mkv
+            if s.get("type") == "audio" and s.get("id") not in id_jeder
+        ]
+        if relativni is None or relativni >= len(zvocne):
+            return None, zvok
+        sled = zvocne[relativni]
+        jedro = jedra.get(sled.get("id"))
+        if zvok and jedro:
+            lastnosti = jedro.get("properties", {})
+            kodek = "eac3" if jedro.get("codec", "").upper() == "E-AC-3" else "ac3"
+            if (
+                pravila_zvoka.nacrtuj_zvok(
+                    {"codec_name": kodek, "channels": lastnosti.get("audio_channels")}
+                )
+                is None
+            ):
+                print("  + AC3 jedro TrueHD sledi (brez pretvorbe)")
+                return jedro.get("id"), None
+        return sled.get("id"), zvok
+
+    def nacrti_vseh_zvokov(sledi, sledi_mkv=None):
+        """Načrt za vsako zvočno sled (--all-audio), v vrstnem redu vira.
+
+        Vrne seznam slovarjev z izvorno sledjo ffprobe, relativnim indeksom,
+        id-jem za mkvmerge in načrtom pretvorbe (None = kopiraj). sledi_mkv
+        so sledi Blu-ray toka iz sledi_blu_ray.
+        """
+        nacrti = []
+        for relativni, sled in enumerate(
+            s for s in sledi if s.get("codec_type") == "audio"
+        ):
+            nacrti.append(
+                {
+                    "sled": sled,
+                    "relativni": relativni,
+                    "id": sled.get("index"),
+                    "zvok": pravila_zvoka.nacrtuj_zvok(sled),
+                }
+            )
+            if sledi_mkv is not None:
+                nacrti[-1]["id"], nacrti[-1]["zvok"] = jedro_blu_ray(
+                    sledi_mkv, relativni, nacrti[-1]["zvok"]
+                )
+        return nacrti
+
+    def bitna_hitrost_nacrtov(nacrti):
+        """Skupna bitna hitrost pretvorjenih sledi (za oceno prostora)."""
+        return str(
+            sum(bitov_na_sekundo(n["zvok"]["bitna_hitrost"]) for n in nacrti)
+        )
+
+    def izbira_zvokov(sledi, nacrti, sledi_mkv=None):
+        """Argumenti mkvmerge za vir (0) in .mka s pretvorjenimi sledmi (1).
+
+        Iz vira se vzamejo le kopirane zvočne sledi, vrstni red pa je video,
+        nato zvok v izvornem vrstnem redu. Vsi id-ji so id-ji mkvmerge - za
+        Blu-ray tok iz sledi_mkv, v MKV so enaki indeksom ffprobe.
+        """
+        if sledi_mkv is not None:
+            video_ids = [s.get("id") for s in sledi_mkv if s.get("type") == "video"]
+        else:
+            video_ids = [
+                s.get("index", 0) for s in sledi if s.get("codec_type") == "video"
+            ]
+        video_ids = video_ids or [0]
+        vrstni_red = [f"0:{track_id}" for track_id in video_ids]
+        pretvorjena = 0
+        for nacrt in nacrti:
+            if nacrt["zvok"]:
+                vrstni_red.append(f"1:{pretvorjena}")
+                pretvorjena += 1
+            elif nacrt["id"] is not None:
+                vrstni_red.append(f"0:{nacrt['id']}")
+        kopirane = [
+            str(n["id"]) for n in nacrti if not n["zvok"] and n["id"] is not None
+        ]
+        izbira = ["--track-order", ",".join(vrstni_red)]
+        if kopirane:
+            return izbira + ["--audio-tracks", ",".join(kopirane)]
+        return izbira + ["--no-audio"]
+
+    def edinstvena_bac_pot(pot):
+        osnovna_pot = Path(pot)
+        kandidat = osnovna_pot.with_name(f"{osnovna_pot.stem}_bac{osnovna_pot.suffix}")
+        stevec = 2
+        while kandidat.exists():
+            kandidat = osnovna_pot.with_name(
+                f"{osnovna_pot.stem}_bac_{stevec}{osnovna_pot.suffix}"
+            )
+            stevec += 1
+        return str(kandidat)
+
+    def preveri_mkv_sledi(mkv_pot):
+        """Preveri sledi v MKV datoteki in prednostno izbere angleško audio sled."""
+        if not ffprobe:
+            return None, None, False, None, 0, [], None, None, []
+        try:
+            if "flatpak run" in ffprobe:
+                deli = ffprobe.split()
+                ukaz = deli + [
+                    "-v",
+                    "quiet",
+                    "-print_format",
+                    "json",
+                    "-show_streams",
+                    mkv_pot,
+                ]
+            else:
+                ukaz = [
+                    ffprobe,
+                    "-v",
+                    "quiet",
+                    "-print_format",
+                    "json",
+                    "-show_streams",
+                    mkv_pot,
+                ]
+            rezultat = subprocess.run(ukaz, capture_output=True, text=True, check=True)
+            podatki = json.loads(rezultat.stdout)
+            sledi = podatki.get("streams", [])
+
+            ima_nase_podnapise = False
+            nasi_privzeti = False
+            najboljsi_podnapis = None  # (prioriteta, subtitle-relativen indeks)
+            sub_track_ids = []  # Globalni track ID-ji subtitle sledi (za mkvmerge)
+
+            sub_indeks = 0  # Šteje samo subtitle sledi
+            for sled in sledi:
+                if sled.get("codec_type") == "subtitle":
+                    jezik = sled.get("tags", {}).get("language", "").lower()
+                    disposition = sled.get("disposition", {})
+                    je_privzet = disposition.get("default", 0) == 1
+                    sub_track_ids.append(sled.get("index", sub_indeks))
+
+                    if jezik in nasi_jeziki:
+                        ima_nase_podnapise = True
+                        prio = prioriteta_jezikov.get(jezik, 99)
+
+                        if je_privzet:
+                            nasi_privzeti = True
+
+                        # Poišči najboljši podnapis po prioriteti
+                        if najboljsi_podnapis is None or prio < najboljsi_podnapis[0]:
+                            najboljsi_podnapis = (prio, sub_indeks)
+
+                    sub_indeks += 1
+
+            indeks_za_privzet = najboljsi_podnapis[1] if najboljsi_podnapis else None
+            audio_kodek, izbrani_audio, izbrani_audio_relativni = izberi_audio_sled(sledi)
+            return (
+                ima_nase_podnapise,
+                audio_kodek,
+                nasi_privzeti,
+                indeks_za_privzet,
+                sub_indeks,
+                sub_track_ids,
+                izbrani_audio,
+                izbrani_audio_relativni,
+                sledi,
+            )
+        except Exception:
+            return None, None, False, None, 0, [], None, None, []
+
+    def obdelaj_obstojeci_mkv(mkv_pot, srt_pot, izbrisi_izvorne):
+        """Obdelaj obstoječo MKV datoteko - doda podnapise, pretvori audio če potrebno."""
+        osnovni_ime = Path(mkv_pot).stem
+
+        (
+            ima_nase_podnapise,
+            audio_kodek,
+            nasi_privzeti,
+            indeks_za_privzet,
             sub_indeks,
             sub_track_ids,
             izbrani_audio_indeks,
             izbrani_audio_relativni,
+            sledi,
         ) = preveri_mkv_sledi(mkv_pot)
         sub_indeks = sub_indeks or 0
         sub_track_ids = sub_track_ids or []
 
+        # Izhodi prejšnjih zagonov -q za ta izvor (-qq ga nadomesti)
+        izhodi = [] if izbrisi_izvorne else obstojeci_izhodi(mkv_pot)
+
         # Določi potrebne akcije
         dodaj_podnapise = bool(srt_pot)
+        vsebujoca = None
+        if dodaj_podnapise and ffmpeg:
+            vsebujoca = podnapisi_ze_vgrajeni(mkv_pot, srt_pot, sledi, izhodi)
+        if vsebujoca == mkv_pot:
+            dodaj_podnapise = False
+        elif vsebujoca:
+            # Isti podnapisi so bili v prejšnjem zagonu (-q) dodani v izhod
+            ime = Path(vsebujoca).name
+            print(f"Preskakujem (podnapisi so že v {ime}): {Path(mkv_pot).name}")
+            zabelezi_urejeno(mkv_pot, srt_pot, vsebujoca)
+            return None
         nastavi_privzete = (
             ima_nase_podnapise and not nasi_privzeti and indeks_za_privzet is not None
         )
-        pretvori_audio = audio_kodek and audio_kodek.lower() not in ["ac3"]
+        zvocni_nacrti = []
+        if vse_zvocne:
+            # Ohranijo se vse zvočne sledi, pretvorijo pa le nedovoljene
+            zvocni_nacrti = nacrti_vseh_zvokov(sledi)
+            zvok = None
+        else:
+            zvok = nacrt_zvoka(sledi, izbrani_audio_indeks)
+        if zvok:
+            nadomestna, relativni = predvajljiva_sled(sledi, izbrani_audio_indeks)
+            if nadomestna:
+                # Združljiva sled istega jezika že obstaja - brez pretvorbe
+                izbrani_audio_indeks = nadomestna.get("index")
+                izbrani_audio_relativni = relativni
+                audio_kodek = nadomestna.get("codec_name")
+                zvok = None
+        if zvok:
+            zvocni_nacrti = [
+                {
+                    "sled": {
+                        "index": izbrani_audio_indeks,
+                        "codec_name": audio_kodek,
+                    },
+                    "relativni": izbrani_audio_relativni or 0,
+                    "id": izbrani_audio_indeks,
+                    "zvok": zvok,
+                }
+            ]
+        pretvorbe = {n["sled"].get("index"): n for n in zvocni_nacrti if n["zvok"]}
+        pretvori_audio = bool(pretvorbe)
 
         if not dodaj_podnapise and not nastavi_privzete and not pretvori_audio:
             # MKV je že v redu
-            if srt_pot and izbrisi_izvorne:
+            if izbrisljiv_srt(srt_pot) and izbrisi_izvorne:
                 # Podnapisi so že v MKV, lahko izbrišemo zunanje
                 os.remove(srt_pot)
                 print(f"  ✗ Izbrisan (že v MKV): {Path(srt_pot).name}")
+            zabelezi_urejeno(mkv_pot, srt_pot, mkv_pot)
             return True
 
+        # Razporeditev sledi, ki bi jo imel izhod - če jo že ima izhod
+        # prejšnjega zagona (-q), bi bil ponoven zapis brez učinka. Novih
+        # podnapisov razporeditev ne loči od starih, zato le brez njih.
+        nacrtovana = []
+        if izhodi and not dodaj_podnapise:
+            for opis in razporeditev_sledi(sledi):
+                if opis["vrsta"] == "audio":
+                    if (
+                        not vse_zvocne
+                        and pretvori_audio
+                        and izbrani_audio_indeks is not None
+                        and opis["izvor"][1] != izbrani_audio_indeks
+                    ):
+                        continue
+                    if opis["izvor"][1] in pretvorbe:
+                        nacrt = pretvorbe[opis["izvor"][1]]["zvok"]
+                        opis = {
+                            **opis,
+                            "kodek": nacrt["kodek"],
+                            "profil": nacrt["profil"],
+                            "kanali": nacrt["kanali"] or opis["kanali"],
+                        }
+                elif opis["vrsta"] == "subtitle" and nastavi_privzete:
+                    privzeta = sub_track_ids[indeks_za_privzet]
+                    opis = {**opis, "privzeta": opis["izvor"][1] == privzeta}
+                # Indeksi sledi se v izhodu razlikujejo od izvornih
+                nacrtovana.append({**opis, "izvor": None})
+        for izhod in izhodi if nacrtovana else []:
+            razporeditev = [
+                {**opis, "izvor": None}
+                for opis in razporeditev_sledi(preveri_mkv_sledi(izhod)[-1])
+            ]
+            if razporeditev == nacrtovana:
+                izvor, ime = Path(mkv_pot).name, Path(izhod).name
+                print(f"Preskakujem (enak izhod že obstaja: {ime}): {izvor}")
+                zabelezi_urejeno(mkv_pot, srt_pot, izhod)
+                return None
+
+        ciljna_pot, vrni_na = cilj_opravila("mkv", mkv_pot)
+        if not ciljna_pot:
+            return None
+
         print(f"Obdelujem: {Path(mkv_pot).name}")
         if dodaj_podnapise:
             print(f"  + dodajam podnapise: {Path(srt_pot).name}")
@@ -3327,174 +6427,420 @@ def hitro_pretvorba_cli(izbrisi_izvorne=False):
             print(
                 f"  + nastavljam naše podnapise kot privzete (sled {indeks_za_privzet})"
             )
-        if pretvori_audio:
-            print(f"  + pretvarjam zvok ({audio_kodek} → AC3)")
+        for nacrt in pretvorbe.values():
+            cilj_zvoka = nacrt["zvok"]["kodek"].upper()
+            if nacrt["zvok"]["filter"]:
+                print(f"  + izluščam jedro {cilj_zvoka} (brez pretvorbe)")
+            else:
+                kodek = nacrt["sled"].get("codec_name")
+                print(f"  + pretvarjam zvok ({kodek} → {cilj_zvoka})")
 
+        zacasna_pot = zvok_pot = None
         try:
-            ciljna_pot = mkv_pot if izbrisi_izvorne else edinstvena_bac_pot(mkv_pot)
-            zacasna_pot = ciljna_pot.replace(".mkv", "_temp_bac.mkv")
-
-            if pretvori_audio and ffmpeg:
-                # Uporabi ffmpeg za pretvorbo zvoka
-                # POMEMBNO: vsi -i argumenti morajo biti pred opcijami za izhod
-                if "flatpak run" in ffmpeg:
-                    ukaz_ff = ffmpeg.split() + ["-i", mkv_pot]
+            zacasna_pot = zacasna_pot_za(ciljna_pot, "_temp_bac.mkv")
+            zvok_pot = None
+            velikost = os.path.getsize(mkv_pot)
+
+            samo_glava = nastavi_privzete and not (dodaj_podnapise or pretvori_audio)
+            if samo_glava and mkvpropedit:
+                # Spremenijo se samo zastavice v glavi - mkvpropedit jih uredi
+                # na mestu, brez ponovnega zapisa celotne datoteke
+                if izbrisi_izvorne and (not izhodna_mapa or vrni_na):
+                    urejena_pot = ciljna_pot = mkv_pot
+                    dnevnik.zacni(mkv_pot, [mkv_pot + ".bac-part"])
+                    if razdruzi_povezavo(mkv_pot, omejevalnik):
+                        print("  + trda povezava razdružena (lastna kopija)")
                 else:
-                    ukaz_ff = [ffmpeg, "-i", mkv_pot]
-
-                if dodaj_podnapise and srt_pot:
-                    # Drugi vhod mora biti pred opcijami za izhod
-                    ukaz_ff.extend(["-i", srt_pot])
+                    # Kopija ostane poleg cilja, da se ne prenaša dvakrat;
+                    # na istem btrfs/XFS je reflink brez kopiranja podatkov
+                    zacasna_pot = ciljna_pot[:-4] + "_temp_bac.mkv"
+                    ustvari_mapo_za(ciljna_pot)
+                    preveri_prostor([(os.path.dirname(ciljna_pot), velikost)])
+                    dnevnik.zacni(mkv_pot, [zacasna_pot])
+                    if kloniraj_ali_kopiraj(mkv_pot, zacasna_pot, omejevalnik):
+                        print("  + reflink kopija (brez kopiranja podatkov)")
+                    urejena_pot = zacasna_pot
+
+                if "flatpak run" in mkvpropedit:
+                    ukaz = mkvpropedit.split() + [urejena_pot]
+                else:
+                    ukaz = [mkvpropedit, urejena_pot]
+                for i in range(sub_indeks):
+                    track_id = sub_track_ids[i] if i < len(sub_track_ids) else i
+                    privzet = 1 if i == indeks_za_privzet else 0
+                    ukaz.extend(["--edit", f"track:{track_id + 1}"])
+                    ukaz.extend(["--set", f"flag-default={privzet}"])
+                zazeni_orodje(ukaz, omejevalnik)
+
+                # SRT je že vgrajen - z -qq se izbriše kot pri ponovnem zapisu
+                srt_izbris = izbrisljiv_srt(srt_pot) if izbrisi_izvorne else None
+                zabelezi_izhod(ciljna_pot)
+                if ciljna_pot == mkv_pot:
+                    utrdi(mkv_pot, trajnost)
+                    dnevnik.potrdi([], [srt_izbris])
+                    print(f"  ✓ Posodobljen: {Path(mkv_pot).name}")
+                else:
+                    izbrisi = [mkv_pot, srt_izbris] if izbrisi_izvorne else []
+                    dnevnik.potrdi([(zacasna_pot, ciljna_pot)], izbrisi)
+                    premakni_na_cilj(zacasna_pot, ciljna_pot, trajnost, omejevalnik)
+                    print(f"  ✓ Ustvarjen: {ime_izhoda(ciljna_pot)}")
+                    if izbrisi_izvorne:
+                        os.remove(mkv_pot)
+                        print(f"  ✗ Izbrisan: {Path(mkv_pot).name}")
+                if srt_izbris:
+                    os.remove(srt_izbris)
+                    print(f"  ✗ Izbrisan (že v MKV): {Path(srt_izbris).name}")
+                zabelezi_urejeno(mkv_pot, srt_pot, ciljna_pot)
+                return True
+
+            if not (pretvori_audio and ffmpeg) and not (
+                dodaj_podnapise or nastavi_privzete
+            ):
+                return False
 
-                ukaz_ff.append("-y")
-                ukaz_ff.extend(
-                    ["-c:v", "copy", "-c:a", "ac3", "-b:a", "192k", "-c:s", "copy"]
-                )
+            if dodaj_podnapise:
+                velikost += os.path.getsize(srt_pot)
+            if pretvori_audio and ffmpeg:
+                zvok_pot = zacasna_pot_za(ciljna_pot, "_temp_audio.mka")
+            dnevnik.zacni(mkv_pot, [zacasna_pot, zvok_pot])
+            pripravi_opravilo(
+                ciljna_pot,
+                zacasna_pot,
+                velikost,
+                zvok_pot,
+                sledi,
+                vrni_na,
+                bitna_hitrost_nacrtov(pretvorbe.values()),
+            )
 
-                audio_map = (
-                    f"0:a:{izbrani_audio_relativni}"
-                    if izbrani_audio_relativni is not None
-                    else "0:a:0"
+            if zvok_pot:
+                # ffmpeg v enem prehodu pretvori samo zvočne sledi, ki jih je
+                # treba, video in podnapise mkvmerge vzame iz izvorne datoteke
+                zazeni_orodje(
+                    ukaz_vec_zvokov(
+                        ffmpeg,
+                        mkv_pot,
+                        zvok_pot,
+                        [
+                            (f"0:a:{n['relativni']}", n["zvok"])
+                            for n in pretvorbe.values()
+                        ],
+                    ),
+                    omejevalnik,
                 )
-                if dodaj_podnapise and srt_pot:
-                    # Samo prvi audio, brez obstoječih podnapisov, dodamo SRT kot privzet
-                    ukaz_ff.extend(["-map", "0:v", "-map", audio_map, "-map", "1:0"])
-                    ukaz_ff.extend(["-metadata:s:s:0", "language=slv"])
-                    ukaz_ff.extend(["-disposition:s:0", "default"])
-                else:
-                    ukaz_ff.extend(["-map", "0:v", "-map", audio_map, "-map", "0:s?"])
-                    if nastavi_privzete and indeks_za_privzet is not None:
-                        ukaz_ff.extend(
-                            [f"-disposition:s:{indeks_za_privzet}", "default"]
-                        )
-
-                ukaz_ff.append(zacasna_pot)
-                subprocess.run(ukaz_ff, check=True, capture_output=True)
 
-            elif (dodaj_podnapise or nastavi_privzete) and mkvmerge:
-                if "flatpak run" in mkvmerge:
-                    ukaz = mkvmerge.split() + ["-o", zacasna_pot]
-                else:
-                    ukaz = [mkvmerge, "-o", zacasna_pot]
-
-                if dodaj_podnapise:
-                    # Dodamo SRT - izpustimo vse ostale podnapise, ohranimo samo prvi audio
-                    if izbrani_audio_indeks is not None:
-                        ukaz.extend(["--audio-tracks", str(izbrani_audio_indeks)])
-                    ukaz.extend(["--no-subtitles"])
-                    ukaz.append(mkv_pot)
-                    ukaz.extend(
-                        ["--language", "0:slv", "--default-track-flag", "0:yes"]
-                    )
-                    ukaz.append(srt_pot)
-                else:
-                    # Samo nastavimo privzete sledi na obstoječih podnapisih
-                    for i in range(sub_indeks):
-                        track_id = sub_track_ids[i] if i < len(sub_track_ids) else i
-                        if i == indeks_za_privzet:
-                            ukaz.extend(["--default-track-flag", f"{track_id}:yes"])
-                        else:
-                            ukaz.extend(["--default-track-flag", f"{track_id}:no"])
-                    ukaz.append(mkv_pot)
-
-                subprocess.run(ukaz, check=True, capture_output=True)
+            if "flatpak run" in mkvmerge:
+                ukaz = mkvmerge.split() + ["-o", zacasna_pot]
             else:
-                return False
+                ukaz = [mkvmerge, "-o", zacasna_pot]
+
+            if zvok_pot:
+                # Pretvorjeni zvok sledi videu, kot v izvorni datoteki
+                ukaz.extend(izbira_zvokov(sledi, zvocni_nacrti))
+            elif (
+                dodaj_podnapise
+                and izbrani_audio_indeks is not None
+                and not vse_zvocne
+            ):
+                # Ohranimo samo izbrani audio
+                ukaz.extend(["--audio-tracks", str(izbrani_audio_indeks)])
+
+            if dodaj_podnapise:
+                # Dodamo SRT - izpustimo vse ostale podnapise
+                ukaz.append("--no-subtitles")
+            elif nastavi_privzete:
+                # Samo nastavimo privzete sledi na obstoječih podnapisih
+                for i in range(sub_indeks):
+                    track_id = sub_track_ids[i] if i < len(sub_track_ids) else i
+                    if i == indeks_za_privzet:
+                        ukaz.extend(["--default-track-flag", f"{track_id}:yes"])
+                    else:
+                        ukaz.extend(["--default-track-flag", f"{track_id}:no"])
+            ukaz.append(mkv_pot)
 
-            if izbrisi_izvorne:
-                # Zamenjaj staro z novo
-                os.remove(mkv_pot)
-                os.rename(zacasna_pot, mkv_pot)
+            if zvok_pot:
+                ukaz.append(zvok_pot)
+            if dodaj_podnapise:
+                jezik = jezik_podnapisov(srt_pot)
+                ukaz.extend(["--language", f"0:{jezik}"])
+                if jezik in PRIORITETA_JEZIKOV_PODNAPISOV:
+                    ukaz.extend(["--default-track-flag", "0:yes"])
+                ukaz.append(srt_pot)
+
+            zazeni_orodje(ukaz, omejevalnik)
+            if zvok_pot:
+                os.remove(zvok_pot)
+
+            # Od potrditve naprej obnova po zrušitvi zamenjavo dokonča
+            premiki = [(zacasna_pot, ciljna_pot)]
+            if vrni_na:
+                premiki.append((ciljna_pot, vrni_na))
+            izbrisi = [izbrisljiv_srt(srt_pot)] if izbrisi_izvorne else []
+            if izbrisi_izvorne and not vrni_na and ciljna_pot != mkv_pot:
+                izbrisi.append(mkv_pot)
+            dnevnik.potrdi(premiki, izbrisi)
+
+            zabelezi_izhod(ciljna_pot)
+            premakni_na_cilj(zacasna_pot, ciljna_pot, trajnost, omejevalnik)
+            if vrni_na:
+                # Rezultat iz izhodne mape zamenja izvirnik
+                zabelezi_izhod(vrni_na)
+                premakni_na_cilj(ciljna_pot, vrni_na, trajnost, omejevalnik)
+                print(f"  ✓ Posodobljen: {Path(mkv_pot).name}")
+            elif ciljna_pot == mkv_pot:
                 print(f"  ✓ Posodobljen: {Path(mkv_pot).name}")
             else:
-                os.rename(zacasna_pot, ciljna_pot)
-                print(f"  ✓ Ustvarjen: {Path(ciljna_pot).name}")
+                print(f"  ✓ Ustvarjen: {ime_izhoda(ciljna_pot)}")
+                if izbrisi_izvorne:
+                    os.remove(mkv_pot)
+                    print(f"  ✗ Izbrisan: {Path(mkv_pot).name}")
 
             # Izbriši SRT če je zahtevano
-            if srt_pot and izbrisi_izvorne:
+            if izbrisljiv_srt(srt_pot) and izbrisi_izvorne:
                 os.remove(srt_pot)
                 print(f"  ✗ Izbrisan: {Path(srt_pot).name}")
 
+            zabelezi_urejeno(mkv_pot, srt_pot, vrni_na or ciljna_pot)
             return True
 
         except subprocess.CalledProcessError as e:
-            napaka = (
-                e.stderr.decode()
-                if e.stderr
-                else (e.stdout.decode() if e.stdout else str(e))
-            )
-            print(f"  ✗ Napaka: {napaka[:300]}")
+            napaka = e.stderr.decode(errors="replace") if e.stderr else str(e)
+            # Povzetek orodja je že omejen na vrstice z napakami
+            print("  ✗ Napaka: " + napaka.replace("\n", "\n    "))
             # Počisti morebitne začasne datoteke
-            if os.path.exists(zacasna_pot):
-                os.remove(zacasna_pot)
+            for pot in (zacasna_pot, zvok_pot):
+                if pot and os.path.exists(pot):
+                    os.remove(pot)
+            return False
+        except OSError as e:
+            print(f"  ✗ Napaka: {e}")
+            for pot in (zacasna_pot, zvok_pot):
+                if pot and os.path.exists(pot):
+                    os.remove(pot)
             return False
 
-    # Najprej obdelaj obstoječe MKV datoteke
-    for mkv_pot in mkv_datoteke:
-        osnovni_ime = Path(mkv_pot).stem
-        video_dir = os.path.dirname(mkv_pot)
-
-        # Poišči pripadajoči SRT v isti mapi
-        srt_pot = None
-        for koncnica in [".srt", ".sl.srt", ".slv.srt", "_sl.srt", "_slv.srt"]:
-            mozna_pot = os.path.join(video_dir, f"{osnovni_ime}{koncnica}")
-            if os.path.exists(mozna_pot):
-                srt_pot = mozna_pot
-                break
+    indeks_podnapisov = {}
+    deljeni_podnapisi = set()
 
-        if not srt_pot:
-            for datoteka in os.listdir(video_dir):
-                if datoteka.lower().endswith(".srt"):
-                    dat_stem = Path(datoteka).stem
-                    if (
-                        dat_stem == osnovni_ime
-                        or dat_stem.startswith(osnovni_ime + ".")
-                        or dat_stem.startswith(osnovni_ime + "_")
-                    ):
-                        srt_pot = os.path.join(video_dir, datoteka)
-                        break
+    # Izhodi tega procesa - opazovalec mape jih ne obravnava kot nove datoteke
+    lastni_izhodi = set()
 
-        if obdelaj_obstojeci_mkv(mkv_pot, srt_pot, izbrisi_izvorne):
-            uspesne += 1
-        else:
-            neuspesne += 1
+    # Podnapisi in izhodi trenutnega opravila ter izhodi prejšnjega, ki jih
+    # po obdelavi odstranimo iz predpomnilnika strani
+    datoteke_opravila = []
+    izhodi_opravila = []
+    prejsnji_izhodi = []
 
-    for video_pot in video_datoteke:
-        osnovni_ime = Path(video_pot).stem
-        video_dir = os.path.dirname(video_pot)
-        ciljna_pot = os.path.join(video_dir, f"{osnovni_ime}.mkv")
+    # Končni izhod vsakega izvora trenutnega opravila (za dvojnike)
+    koncni_izhodi = {}
 
-        # Če MKV že obstaja, preskoči (že obdelano zgoraj)
-        if os.path.exists(ciljna_pot):
-            continue
+    def zabelezi_izhod(pot):
+        lastni_izhodi.add(os.path.abspath(pot))
+        izhodi_opravila.append(pot)
 
-        # Poišči pripadajoči SRT v isti mapi
-        srt_pot = None
-        for koncnica in [".srt", ".sl.srt", ".slv.srt", "_sl.srt", "_slv.srt"]:
-            mozna_pot = os.path.join(video_dir, f"{osnovni_ime}{koncnica}")
-            if os.path.exists(mozna_pot):
-                srt_pot = mozna_pot
-                break
+    def obstojeci_izhodi(mkv_pot):
+        """Vrne poti izhodov prejšnjih zagonov za MKV izvor.
 
-        # Poskusi najti SRT z enakim začetkom imena
-        if not srt_pot:
-            for datoteka in os.listdir(video_dir):
-                if datoteka.lower().endswith(".srt"):
-                    dat_stem = Path(datoteka).stem
-                    if (
-                        dat_stem == osnovni_ime
-                        or dat_stem.startswith(osnovni_ime + ".")
-                        or dat_stem.startswith(osnovni_ime + "_")
-                    ):
-                        srt_pot = os.path.join(video_dir, datoteka)
-                        break
+        To so Film_bac.mkv, Film_bac_N.mkv ob izvoru in cilj v izhodni mapi.
+        """
+        izvor = Path(mkv_pot)
+        vzorec = re.compile(re.escape(izvor.stem) + r"_bac(_\d+)?\.mkv")
+        try:
+            poti = [
+                str(izvor.with_name(ime))
+                for ime in sorted(os.listdir(izvor.parent))
+                if vzorec.fullmatch(ime)
+            ]
+        except OSError:
+            poti = []
+        if izhodna_mapa:
+            cilj = os.path.join(
+                izhodna_mapa, os.path.relpath(mkv_pot, trenutni_dir)
+            )
+            if os.path.exists(cilj):
+                poti.append(cilj)
+        return poti
+
+    def podnapisi_ze_vgrajeni(mkv_pot, srt_pot, sledi, izhodi=()):
+        """Vrne MKV (izvor ali enega od izhodov), ki že vsebuje besedilo SRT.
+
+        Pri -q so bili podnapisi v prejšnjem zagonu dodani v izhod (izhodi iz
+        obstojeci_izhodi), ne v izvor. Vrne None, če podnapisov ni v nobeni
+        od datotek.
+        """
+        try:
+            zgostitev = zgostitev_podnapisov(preberi_podnapise(srt_pot))
+        except OSError:
+            return None
+        for pot in [mkv_pot] + list(izhodi):
+            zgoscene = manifest.vgrajeni_podnapisi(pot)
+            if zgoscene is None:
+                sledi_poti = sledi if pot == mkv_pot else preveri_mkv_sledi(pot)[-1]
+                try:
+                    zgoscene = zgostitve_vgrajenih_podnapisov(
+                        ffmpeg, pot, sledi_poti, zacasna_mapa, omejevalnik
+                    )
+                except (subprocess.CalledProcessError, OSError):
+                    continue
+                manifest.zabelezi_podnapise(pot, zgoscene)
+            if zgostitev in zgoscene:
+                return pot
+        return None
+
+    def zabelezi_urejeno(izvor, srt_pot, izhod):
+        """V manifest zabeleži urejen izhod in MKV izvor, ki je ostal ob njem."""
+        koncni_izhodi[izvor] = izhod
+        if srt_pot and not os.path.exists(srt_pot):
+            # Izbrisani podnapisi (-qq) ne vplivajo na naslednje zagone
+            srt_pot = None
+        manifest.zabelezi(izhod, srt_pot)
+        if izvor != izhod and izvor.lower().endswith(".mkv") and os.path.exists(izvor):
+            manifest.zabelezi(izvor, srt_pot, izhod=izhod)
+
+    def mapa_izhoda(pot):
+        """Imenik izhoda za pot - z --output-dir zrcaljen pod izhodno mapo.
+
+        Imenik se ne ustvari; to stori ustvari_mapo_za tik pred pisanjem, da
+        za preskočene datoteke ne ostanejo prazni imeniki.
+        """
+        mapa = os.path.dirname(pot)
+        if not izhodna_mapa:
+            return mapa
+        return os.path.normpath(
+            os.path.join(izhodna_mapa, os.path.relpath(mapa, trenutni_dir))
+        )
+
+    def ustvari_mapo_za(pot):
+        os.makedirs(os.path.dirname(pot), exist_ok=True)
+
+    def ime_izhoda(pot):
+        if not izhodna_mapa:
+            return Path(pot).name
+        relativna = os.path.relpath(pot, trenutni_dir)
+        return pot if relativna.startswith("..") else relativna
+
+    def cilj_opravila(vrsta, pot):
+        """Vrne (ciljna_pot, vrni_na) za vhod ali (None, None), če je že obdelan.
+
+        vrni_na je izvorno mesto, kamor se rezultat pri -qq z --move-back vrne
+        iz izhodne mape.
+        """
+        if vrsta == "mkv":
+            if izhodna_mapa:
+                ciljna_pot = os.path.join(mapa_izhoda(pot), Path(pot).name)
+                if not izbrisi_izvorne and os.path.exists(ciljna_pot):
+                    # Že obdelano v izhodni mapi
+                    return None, None
+            elif izbrisi_izvorne:
+                ciljna_pot = pot
+            else:
+                ciljna_pot = edinstvena_bac_pot(pot)
+            mkv_ob_izvoru = pot
+        else:
+            mkv_ob_izvoru = os.path.join(os.path.dirname(pot), f"{Path(pot).stem}.mkv")
+            # Če MKV že obstaja, preskoči (že obdelano kot MKV)
+            if os.path.exists(mkv_ob_izvoru):
+                return None, None
+            ciljna_pot = os.path.join(mapa_izhoda(pot), f"{Path(pot).stem}.mkv")
+            if os.path.exists(ciljna_pot):
+                return None, None
+
+        # Pri -qq z izhodno mapo rezultat ostane tam ali se vrne na izvorno mesto
+        vrni_na = None
+        if izhodna_mapa and izbrisi_izvorne and vrni_nazaj:
+            vrni_na = mkv_ob_izvoru
+        return ciljna_pot, vrni_na
+
+    def zacasna_pot_za(ciljna_pot, pripona):
+        """Pot vmesne datoteke - v začasni mapi (--scratch-dir) ali poleg cilja."""
+        if not zacasna_mapa:
+            return ciljna_pot[:-4] + pripona
+        # Enaka imena iz različnih map se v skupni začasni mapi ne smejo srečati
+        oznaka = hashlib.sha1(os.path.abspath(ciljna_pot).encode()).hexdigest()[:8]
+        return os.path.join(zacasna_mapa, f"{oznaka}_{Path(ciljna_pot).stem}{pripona}")
+
+    def pripravi_opravilo(
+        ciljna_pot,
+        zacasna_pot,
+        velikost,
+        zvok_pot,
+        sledi,
+        vrni_na=None,
+        bitna_hitrost=None,
+    ):
+        """Pred pisanjem preveri prostor na diskih in pripravi začasne izhode.
+
+        Končni MKV je približno tako velik kot vhodne datoteke (velikost).
+        vrni_na je končno mesto rezultata, če se ta iz izhodne mape vrne nazaj,
+        bitna_hitrost pa bitna hitrost pretvorjenega zvoka.
+        """
+        ustvari_mapo_za(ciljna_pot)
+        potrebe = [(os.path.dirname(zacasna_pot), velikost)]
+        if zvok_pot:
+            # Brez znanega trajanja desetina izvorne datoteke
+            bitov = bitov_na_sekundo(bitna_hitrost or "192k")
+            ocena_zvoka = int(oceni_trajanje(sledi) * bitov / 8) or velikost // 10
+            potrebe.append((os.path.dirname(zvok_pot), ocena_zvoka))
+        ciljna_mapa = os.path.dirname(ciljna_pot)
+        if os.stat(os.path.dirname(zacasna_pot)).st_dev != os.stat(ciljna_mapa).st_dev:
+            # Končna datoteka se iz začasne mape prepiše še na ciljni disk
+            potrebe.append((ciljna_mapa, velikost))
+        if vrni_na:
+            povratna_mapa = os.path.dirname(vrni_na)
+            if os.stat(povratna_mapa).st_dev != os.stat(ciljna_mapa).st_dev:
+                potrebe.append((povratna_mapa, velikost))
+        preveri_prostor(potrebe)
+
+        pripravi_izhod(zacasna_pot, velikost)
+        if zvok_pot:
+            pripravi_izhod(zvok_pot, ocena_zvoka)
+
+    def poisci_srt(video_pot):
+        """Poišče pripadajoči SRT prek indeksa podnapisov imenika (tudi v Subs/)."""
+        video_dir = os.path.dirname(video_pot)
+        # Čas spremembe imenika razveljavi indeks, ko se pojavijo novi podnapisi
+        kljuc = (video_dir, os.stat(video_dir).st_mtime_ns)
+        indeks = indeks_podnapisov.get(kljuc)
+        if indeks is None:
+            # Odkrivanje gre po imenikih, zato je dovolj indeks trenutnega imenika
+            indeks_podnapisov.clear()
+            indeks = indeks_podnapisov[kljuc] = IndeksPodnapisov(video_dir)
+
+        srt_pot, dvoumni = indeks.poisci(video_pot)
+        if srt_pot:
+            datoteke_opravila.append(srt_pot)
+        if dvoumni:
+            print(f"  ! Dvoumni podnapisi za {Path(video_pot).name}:")
+            for pot in dvoumni:
+                print(f"      {os.path.relpath(pot, video_dir)}")
+            print(f"    izbran: {os.path.relpath(srt_pot, video_dir)}")
+        drugi = indeks.drugi_videi(srt_pot, video_pot) if srt_pot else []
+        if drugi:
+            # Podnapis, ki ga lahko zahteva več videov, se nikoli ne izbriše
+            deljeni_podnapisi.add(srt_pot)
+            print(f"  ! Dvoumen podnapis {os.path.relpath(srt_pot, video_dir)}")
+            print("    ustreza tudi: " + ", ".join(Path(p).name for p in drugi))
+        return srt_pot
+
+    def izbrisljiv_srt(srt_pot):
+        """Vrne srt_pot, če ga -qq sme izbrisati (ne pripada več videom)."""
+        return srt_pot if srt_pot not in deljeni_podnapisi else None
+
+    def obdelaj_video(video_pot):
+        """Pretvori video (ne-MKV) datoteko v MKV - vrne None, če je preskočena."""
+        ciljna_pot, vrni_na = cilj_opravila("video", video_pot)
+        if not ciljna_pot:
+            return None
 
         print(f"Pretvarjam: {Path(video_pot).name}")
+        srt_pot = poisci_srt(video_pot)
         if srt_pot:
             print(f"  + podnapisi: {Path(srt_pot).name}")
 
+        zacasna_pot = izhodna_pot = None
         try:
             # Preveri audio kodek in poišči indeks prvega audio streama
+            sledi = []
             audio_kodek = None
             izbrani_audio_id = None
             izbrani_audio_relativni = None
@@ -3523,84 +6869,427 @@ def hitro_pretvorba_cli(izbrisi_izvorne=False):
                     rezultat = subprocess.run(
                         ukaz, capture_output=True, text=True, check=True
                     )
-                    podatki = json.loads(rezultat.stdout)
+                    sledi = json.loads(rezultat.stdout).get("streams", [])
                     audio_kodek, izbrani_audio_id, izbrani_audio_relativni = (
-                        izberi_audio_sled(podatki.get("streams", []))
+                        izberi_audio_sled(sledi)
                     )
                 except Exception:
                     pass
 
-            potrebna_pretvorba_audio = audio_kodek and audio_kodek.lower() not in [
-                "ac3"
-            ]
-            vhodna_datoteka = video_pot
-            zacasna_pot = None
-
-            # Če je potrebna pretvorba zvoka
-            if potrebna_pretvorba_audio and ffmpeg:
-                print(f"  Pretvarjam zvok ({audio_kodek} → AC3)...")
-                zacasna_pot = ciljna_pot.replace(".mkv", "_temp_audio.mkv")
+            sledi_mkv = sledi_blu_ray(video_pot)
+            zvocni_nacrti = []
+            if vse_zvocne:
+                zvocni_nacrti = nacrti_vseh_zvokov(sledi, sledi_mkv)
+                zvok = None
+            else:
+                zvok = nacrt_zvoka(sledi, izbrani_audio_id)
+            if zvok:
+                nadomestna, relativni = predvajljiva_sled(sledi, izbrani_audio_id)
+                if nadomestna:
+                    izbrani_audio_id = nadomestna.get("index")
+                    izbrani_audio_relativni = relativni
+                    zvok = None
+            if not vse_zvocne and sledi_mkv is not None:
+                # Id-ji sledi mkvmerge se v Blu-ray toku razlikujejo od ffprobe
+                izbrani_audio_id, zvok = jedro_blu_ray(
+                    sledi_mkv, izbrani_audio_relativni, zvok
+                )
+            if zvok:
+                zvocni_nacrti = [
+                    {
+                        "sled": {"codec_name": audio_kodek},
+                        "relativni": izbrani_audio_relativni or 0,
+                        "id": izbrani_audio_id,
+                        "zvok": zvok,
+                    }
+                ]
+            pretvorbe = [n for n in zvocni_nacrti if n["zvok"]]
 
-                if "flatpak run" in ffmpeg:
-                    ukaz_ff = ffmpeg.split() + ["-i", video_pot, "-y"]
-                else:
-                    ukaz_ff = [ffmpeg, "-i", video_pot, "-y"]
+            # mkvmerge piše v začasno datoteko, cilj nastane šele ob uspehu
+            izhodna_pot = zacasna_pot_za(ciljna_pot, "_temp_bac.mkv")
+            if pretvorbe and ffmpeg:
+                zacasna_pot = zacasna_pot_za(ciljna_pot, "_temp_audio.mka")
+            velikost = os.path.getsize(video_pot)
+            if srt_pot:
+                velikost += os.path.getsize(srt_pot)
+            dnevnik.zacni(video_pot, [izhodna_pot, zacasna_pot])
+            pripravi_opravilo(
+                ciljna_pot,
+                izhodna_pot,
+                velikost,
+                zacasna_pot,
+                sledi,
+                vrni_na,
+                bitna_hitrost_nacrtov(pretvorbe),
+            )
 
-                # -sn onemogoči kopiranje podnapisov iz izvorne datoteke
-                audio_map = (
-                    f"0:a:{izbrani_audio_relativni}"
-                    if izbrani_audio_relativni is not None
-                    else "0:a:0"
+            # Če je potrebna pretvorba zvoka, ffmpeg v enem prehodu zapiše
+            # samo pretvorjene zvočne sledi
+            if zacasna_pot:
+                for nacrt in pretvorbe:
+                    cilj_zvoka = nacrt["zvok"]["kodek"].upper()
+                    if nacrt["zvok"]["filter"]:
+                        print(f"  Izluščam jedro {cilj_zvoka} (brez pretvorbe)...")
+                    else:
+                        kodek = nacrt["sled"].get("codec_name")
+                        print(f"  Pretvarjam zvok ({kodek} → {cilj_zvoka})...")
+                zazeni_orodje(
+                    ukaz_vec_zvokov(
+                        ffmpeg,
+                        video_pot,
+                        zacasna_pot,
+                        [(f"0:a:{n['relativni']}", n["zvok"]) for n in pretvorbe],
+                    ),
+                    omejevalnik,
                 )
-                ukaz_ff.extend(["-map", "0:v", "-map", audio_map])
-                ukaz_ff.extend(["-c:v", "copy", "-c:a", "ac3", "-b:a", "192k", "-sn"])
-                ukaz_ff.append(zacasna_pot)
 
-                subprocess.run(ukaz_ff, check=True, capture_output=True)
-                vhodna_datoteka = zacasna_pot
-
-            # Združi z mkvmerge
+            # Združi z mkvmerge - video vedno neposredno iz izvorne datoteke
             if "flatpak run" in mkvmerge:
-                ukaz = mkvmerge.split() + ["-o", ciljna_pot]
+                ukaz = mkvmerge.split() + ["-o", izhodna_pot]
             else:
-                ukaz = [mkvmerge, "-o", ciljna_pot]
-
-            # Ohrani samo prvi audio track iz izvorne (če ni bil že pretvorjen)
-            if not potrebna_pretvorba_audio and izbrani_audio_id is not None:
-                ukaz.extend(["--audio-tracks", str(izbrani_audio_id)])
-            ukaz.append(vhodna_datoteka)
+                ukaz = [mkvmerge, "-o", izhodna_pot]
+
+            if zacasna_pot and vse_zvocne:
+                # Dovoljene sledi iz vira, pretvorjene iz .mka, v izvornem redu
+                ukaz.extend(izbira_zvokov(sledi, zvocni_nacrti, sledi_mkv))
+                ukaz.extend(["--no-subtitles", video_pot, zacasna_pot])
+            elif zacasna_pot:
+                # Izvorni zvok in podnapisi se ne prenesejo
+                ukaz.extend(["--no-audio", "--no-subtitles", video_pot, zacasna_pot])
+            elif vse_zvocne:
+                # Vse zvočne sledi so dovoljene - mkvmerge jih kopira
+                kopirane = [str(n["id"]) for n in zvocni_nacrti if n["id"] is not None]
+                if kopirane:
+                    ukaz.extend(["--audio-tracks", ",".join(kopirane)])
+                ukaz.append(video_pot)
+            else:
+                # Ohrani samo prvi audio track iz izvorne
+                if izbrani_audio_id is not None:
+                    ukaz.extend(["--audio-tracks", str(izbrani_audio_id)])
+                ukaz.append(video_pot)
 
             # Dodaj podnapise
             if srt_pot:
-                ukaz.extend(["--language", "0:slv", "--default-track", "0:yes"])
+                jezik = jezik_podnapisov(srt_pot)
+                ukaz.extend(["--language", f"0:{jezik}"])
+                if jezik in PRIORITETA_JEZIKOV_PODNAPISOV:
+                    ukaz.extend(["--default-track", "0:yes"])
                 ukaz.append(srt_pot)
 
-            subprocess.run(ukaz, check=True, capture_output=True)
+            zazeni_orodje(ukaz, omejevalnik)
+            premiki = [(izhodna_pot, ciljna_pot)]
+            if vrni_na:
+                premiki.append((ciljna_pot, vrni_na))
+            izbrisi = [video_pot, izbrisljiv_srt(srt_pot)] if izbrisi_izvorne else []
+            dnevnik.potrdi(premiki, izbrisi)
+
+            zabelezi_izhod(ciljna_pot)
+            premakni_na_cilj(izhodna_pot, ciljna_pot, trajnost, omejevalnik)
 
             # Počisti začasne datoteke
             if zacasna_pot and os.path.exists(zacasna_pot):
                 os.remove(zacasna_pot)
 
-            print(f"  ✓ Ustvarjen: {Path(ciljna_pot).name}")
-            uspesne += 1
+            if vrni_na:
+                zabelezi_izhod(vrni_na)
+                premakni_na_cilj(ciljna_pot, vrni_na, trajnost, omejevalnik)
+                ciljna_pot = vrni_na
+            print(f"  ✓ Ustvarjen: {ime_izhoda(ciljna_pot)}")
 
             # Izbriši izvorne datoteke če je zahtevano
             if izbrisi_izvorne:
                 os.remove(video_pot)
                 print(f"  ✗ Izbrisan: {Path(video_pot).name}")
-                if srt_pot:
+                if izbrisljiv_srt(srt_pot):
                     os.remove(srt_pot)
                     print(f"  ✗ Izbrisan: {Path(srt_pot).name}")
 
+            zabelezi_urejeno(video_pot, srt_pot, ciljna_pot)
+            return True
+
         except subprocess.CalledProcessError as e:
-            napaka = e.stderr.decode() if e.stderr else str(e)
-            print(f"  ✗ Napaka: {napaka[:100]}")
-            neuspesne += 1
+            napaka = e.stderr.decode(errors="replace") if e.stderr else str(e)
+            print("  ✗ Napaka: " + napaka.replace("\n", "\n    "))
             # Počisti morebitne začasne datoteke
-            if zacasna_pot and os.path.exists(zacasna_pot):
-                os.remove(zacasna_pot)
+            for pot in (zacasna_pot, izhodna_pot):
+                if pot and os.path.exists(pot):
+                    os.remove(pot)
+            return False
+        except OSError as e:
+            print(f"  ✗ Napaka: {e}")
+            for pot in (zacasna_pot, izhodna_pot):
+                if pot and os.path.exists(pot):
+                    os.remove(pot)
+            return False
+
+    # Dvojniki {pot: predstavnik} in končni izhodi že obdelanih predstavnikov
+    dvojniki = {}
+    izhodi_vsebine = {}
 
-    print(f"\nKončano: {uspesne} uspešnih, {neuspesne} neuspešnih")
+    # Indeksi podnapisov imenikov kandidatov za dvojnike, vsak se zgradi enkrat
+    indeksi_dvojnikov = {}
+
+    def kljuc_podnapisov(pot):
+        mapa = os.path.dirname(pot)
+        indeks = indeksi_dvojnikov.get(mapa)
+        if indeks is None:
+            indeks = indeksi_dvojnikov[mapa] = IndeksPodnapisov(mapa)
+        srt_pot, _ = indeks.poisci(pot)
+        return zgostitev_podnapisov(preberi_podnapise(srt_pot)) if srt_pot else None
+
+    def povezi_dvojnik(vrsta, pot, srt_pot):
+        """Na cilj dvojnika poveže izhod predstavnika z enako vsebino.
+
+        Vrne None, če je cilj že obdelan, in False, če povezava ni mogoča in
+        je treba dvojnik obdelati posebej.
+        """
+        ciljna_pot, vrni_na = cilj_opravila(vrsta, pot)
+        if not ciljna_pot:
+            return None
+        koncna_pot = vrni_na or ciljna_pot
+        srt_pot = srt_pot or poisci_srt(pot)
+        predstavnik = dvojniki[pot]
+        print(f"Dvojnik: {Path(pot).name}")
+        print(f"  = {os.path.relpath(predstavnik, os.path.dirname(pot))}")
+
+        ustvari_mapo_za(koncna_pot)
+        dnevnik.zacni(pot, [koncna_pot + ".bac-part"])
+        nacin = povezi_vsebino(izhodi_vsebine[predstavnik], koncna_pot, trajnost)
+        if not nacin:
+            dnevnik.koncaj()
+            print("  ! Povezava ni mogoča (drug datotečni sistem), obdelujem posebej")
+            return False
+
+        izbrisi = []
+        if izbrisi_izvorne:
+            izbrisi = [
+                p
+                for p in (pot, izbrisljiv_srt(srt_pot))
+                if p and os.path.abspath(p) != os.path.abspath(koncna_pot)
+            ]
+        dnevnik.potrdi([], izbrisi)
+        zabelezi_izhod(koncna_pot)
+        print(f"  ✓ Povezan ({nacin}): {ime_izhoda(koncna_pot)}")
+        for p in izbrisi:
+            os.remove(p)
+            print(f"  ✗ Izbrisan: {Path(p).name}")
+        zabelezi_urejeno(pot, srt_pot, koncna_pot)
+        return True
+
+    najdene = 0
+    drugi_deli = 0
+    zasedene = 0
+    urejene = 0
+
+    # Opravila, ki so čakala na prostor na disku
+    odlozene = []
+
+    def je_moj_del(pot):
+        return not del_knjiznice or (
+            izracunaj_del(os.path.relpath(pot, trenutni_dir), del_knjiznice[1])
+            == del_knjiznice[0]
+        )
+
+    def obdelaj(vrsta, pot, zadnji_poskus=False):
+        """Obdela eno najdeno datoteko (del knjižnice, zaklep, pretvorba)."""
+        nonlocal uspesne, neuspesne, drugi_deli, zasedene, urejene
+
+        if not je_moj_del(pot):
+            drugi_deli += 1
+            return
+
+        datoteke_opravila.clear()
+        izhodi_opravila.clear()
+        koncni_izhodi.clear()
+        srt_pot = poisci_srt(pot) if vrsta == "mkv" else None
+        if vrsta == "mkv" and manifest.je_urejen(pot, srt_pot):
+            # Nespremenjena urejena datoteka - brez zaklepa in brez orodij
+            urejene += 1
+            return
+
+        # Datoteko obdela samo proces, ki jo prvi zaklene
+        zaklep = ZaklepDatoteke(pot)
+        if not zaklep.prevzemi():
+            print(f"Preskakujem (obdeluje drug proces): {Path(pot).name}")
+            zasedene += 1
+            return
+
+        try:
+            if not os.path.exists(pot):
+                # Drug proces jo je medtem že obdelal (-qq)
+                return
+            if vrsta == "mkv":
+                # Drug proces jo je morda obdelal, preden je sprostil zaklep (-q)
+                manifest.osvezi()
+                if manifest.je_urejen(pot, srt_pot):
+                    urejene += 1
+                    return
+            rezultat = False
+            if dvojniki.get(pot) in izhodi_vsebine:
+                # Enako vsebino je v tem zagonu že obdelal predstavnik
+                rezultat = povezi_dvojnik(vrsta, pot, srt_pot)
+            if rezultat is not False:
+                pass
+            elif vrsta == "mkv":
+                rezultat = obdelaj_obstojeci_mkv(pot, srt_pot, izbrisi_izvorne)
+            else:
+                rezultat = obdelaj_video(pot)
+            # Začasne datoteke so odstranjene tudi ob napaki orodja
+            dnevnik.koncaj()
+        except PremaloProstora as e:
+            dnevnik.koncaj()
+            if not zadnji_poskus:
+                # Drugi poskus na koncu paketa, ko je prostor morda že sproščen
+                print(f"  ! Odloženo, {e}")
+                odlozene.append((vrsta, pot))
+                return
+            print(f"  ✗ Napaka: {e}")
+            rezultat = False
+        finally:
+            # Izhod mora biti v manifestu, preden zaklep prevzame drug proces
+            manifest.zapisi(takoj=bool(izhodi_opravila))
+            zaklep.sprosti()
+            # Paketna obdelava ne sme izriniti predpomnilnika drugih storitev;
+            # izhodi prejšnjega opravila so medtem že zapisani na disk
+            sprosti_predpomnilnik(
+                [pot] + datoteke_opravila + izhodi_opravila + prejsnji_izhodi
+            )
+            prejsnji_izhodi[:] = izhodi_opravila
+
+        izhod = koncni_izhodi.get(pot)
+        if rezultat and izhod in izhodi_opravila and pot in dvojniki.values():
+            # Dvojniki se povežejo na izhod, ki ga je predstavnik zapisal
+            izhodi_vsebine[pot] = izhod
+
+        if rezultat is None:
+            return
+        if rezultat:
+            uspesne += 1
+        else:
+            neuspesne += 1
+
+    def obdelaj_odlozene(zadnji_poskus):
+        cakajoce = odlozene[:]
+        odlozene.clear()
+        if cakajoce:
+            print(f"\nPonovno poskušam {len(cakajoce)} odloženih datotek...")
+        for vrsta, pot in cakajoce:
+            obdelaj(vrsta, pot, zadnji_poskus)
+
+    def izpisi_povzetek():
+        print(f"\nKončano: {uspesne} uspešnih, {neuspesne} neuspešnih")
+        if urejene:
+            print(f"Preskočenih {urejene} že urejenih datotek (manifest).")
+        if odlozene:
+            print(f"Odloženih {len(odlozene)} datotek zaradi pomanjkanja prostora.")
+        if zasedene:
+            print(f"Preskočenih {zasedene} datotek, ki jih obdelujejo drugi procesi.")
+        if del_knjiznice:
+            print(
+                f"Del {del_knjiznice[0]}/{del_knjiznice[1]}: "
+                f"{najdene - drugi_deli} od {najdene} najdenih datotek "
+                f"({drugi_deli} pripada drugim delom)"
+            )
+
+    # Izhodna in začasna mapa ter dnevnik znotraj drevesa niso del knjižnice
+    izpuscene_mape = {m for m in (izhodna_mapa, zacasna_mapa, dnevnik.mapa) if m}
+
+    opazovalec = None
+    if opazuj is not None:
+        # Opazovanje se začne pred začetnim pregledom, da se nič ne izgubi
+        try:
+            opazovalec = OpazovalecMape(
+                trenutni_dir,
+                video_koncnice + [".mkv", ".srt"],
+                mirovanje=opazuj,
+                prezri=lastni_izhodi,
+                izpusti=izpuscene_mape,
+            )
+        except OSError as e:
+            print(f"Napaka: opazovanje mape ni na voljo ({e}).")
+            sys.exit(1)
+
+    # Odkrivanje in obdelava tečeta sproti - prva datoteka se obdela takoj
+    vnosi = poisci_video_datoteke(trenutni_dir, video_koncnice, izpusti=izpuscene_mape)
+    if zdruzi_dvojnike:
+        # Iskanje dvojnikov potrebuje celoten seznam pred obdelavo
+        vnosi = list(vnosi)
+        moji = [(vrsta, pot) for vrsta, pot in vnosi if je_moj_del(pot)]
+        print(f"Iščem dvojnike med {len(moji)} datotekami...")
+        dvojniki.update(
+            poisci_dvojnike(
+                moji, dodatni_kljuc=kljuc_podnapisov, omejevalnik=omejevalnik
+            )
+        )
+        indeksi_dvojnikov.clear()
+        print(f"Najdenih {len(dvojniki)} dvojnikov.\n")
+    for (vrsta, pot), naslednji in s_predogledom(vnosi):
+        najdene += 1
+        if naslednji and je_moj_del(naslednji[1]):
+            # Naslednji vhod se bere v ozadju, medtem ko teče trenutno opravilo
+            threading.Thread(
+                target=namigni_predbranje, args=(naslednji[1],), daemon=True
+            ).start()
+        obdelaj(vrsta, pot)
+    obdelaj_odlozene(zadnji_poskus=opazovalec is None)
+
+    if opazovalec is None:
+        dnevnik.zapri()
+        manifest.zapisi(takoj=True)
+        if not najdene:
+            print("Ni video datotek v trenutnem imeniku ali podmapah.")
+            sys.exit(0)
+        izpisi_povzetek()
+        return
+
+    print(
+        f"\nOpazujem {trenutni_dir} (datoteka je pripravljena po {opazuj:g} s "
+        "brez sprememb, Ctrl+C za konec)..."
+    )
+    try:
+        for vrsta, pot in opazovalec.spremembe():
+            najdene += 1
+            obdelaj(vrsta, pot)
+            # Obdelava (-qq) je morda sprostila prostor za odložene
+            obdelaj_odlozene(zadnji_poskus=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        opazovalec.zapri()
+        dnevnik.zapri()
+        manifest.zapisi(takoj=True)
+    izpisi_povzetek()
+
+
+def razcleni_del(vrednost):
+    """Razčleni argument --shard v obliki i/N (i od 1 do N)."""
+    try:
+        i, n = (int(x) for x in vrednost.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"neveljaven del '{vrednost}', pričakovano i/N")
+    if n < 1 or not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"neveljaven del '{vrednost}', velja 1 <= i <= N")
+    return i, n
+
+
+def razcleni_omejitev(vrednost):
+    """Razčleni argument --io-limit: MB/s za oboje ali BRANJE:PISANJE.
+
+    Vrne None, če je omejitev 0 v obeh smereh (brez omejitve).
+    """
+    try:
+        deli = [float(x) for x in vrednost.split(":")]
+    except ValueError:
+        deli = []
+    if len(deli) == 1:
+        deli *= 2
+    if len(deli) != 2 or min(deli) < 0:
+        raise argparse.ArgumentTypeError(
+            f"neveljavna omejitev '{vrednost}', pričakovano MB/s ali BRANJE:PISANJE"
+        )
+    if max(deli) == 0:
+        return None
+    return tuple(deli)
 
 
 def main():
@@ -3625,6 +7314,24 @@ Primeri:
   bac film.mkv  Zaženi grafični vmesnik in odpri datoteko
   bac -q        Hitro združi vse video+srt v MKV
   bac -qq       Kot -q, ampak izbriše izvorne datoteke
+  bac -q --shard 2/4
+                Obdelaj samo 2. od 4 delov knjižnice (npr. na drugem strežniku)
+  bac -q --watch
+                Po pregledu sproti obdeluj nove prenose v trenutnem imeniku
+  bac -q --scratch-dir /mnt/nvme/bac
+                Vmesne datoteke piši na lokalni disk namesto na NAS
+  bac -q --output-dir /mnt/disk2/filmi
+                Izhode piši v zrcaljeno drevo na drugem disku
+  bac -q --io-limit 40
+                Podnevi omeji promet na deljeni mapi na 40 MB/s
+  bac -q --dedupe
+                Enake kopije epizod obdelaj enkrat, ostale poveži
+  bac -q --policy ~/tv.json
+                Pretvori samo zvok, ki ga naprave iz pravil ne predvajajo
+  bac -q --all-audio
+                Ohrani vse zvočne sledi (jezike), pretvori le nepredvajljive
+  bac --chunk-worker /mnt/nas/film.mkv.bac-deli
+                Pomagaj kodirati kose videa, ki ga GUI kodira po kosih
         """,
         add_help=False,
     )
@@ -3645,6 +7352,79 @@ Primeri:
         default=0,
         help="Hitro združi video+srt v MKV (-q ohrani, -qq izbriše izvorne)",
     )
+    parser.add_argument(
+        "--watch",
+        nargs="?",
+        const=5.0,
+        type=float,
+        metavar="SEKUNDE",
+        help="Z -q po pregledu ostani aktiven in z inotify sproti obdeluj nove "
+        "datoteke, ko se SEKUNDE ne spreminjajo (privzeto 5)",
+    )
+    parser.add_argument(
+        "--shard",
+        type=razcleni_del,
+        metavar="i/N",
+        help="Z -q obdelaj samo del i od N (stabilna razdelitev po relativni poti)",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=normaliziraj_pot_argumenta,
+        metavar="MAPA",
+        help="Z -q piši vmesne datoteke v MAPA (npr. lokalni SSD) namesto poleg cilja",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=normaliziraj_pot_argumenta,
+        metavar="MAPA",
+        help="Z -q piši izhode v MAPA z enako strukturo podmap kot izvorno drevo",
+    )
+    parser.add_argument(
+        "--durability",
+        choices=["none", "file", "dir"],
+        default="file",
+        help="Z -q pred zamenjavo cilja: none = brez fsync, file = fsync izhoda "
+        "(privzeto), dir = fsync izhoda in imenika",
+    )
+    parser.add_argument(
+        "--io-limit",
+        type=razcleni_omejitev,
+        metavar="MB/s",
+        help="Z -q omeji branje in pisanje orodij (npr. 40 ali 60:20 za "
+        "branje:pisanje, 0 = brez omejitve)",
+    )
+    parser.add_argument(
+        "--move-back",
+        action="store_true",
+        help="Z -qq in --output-dir rezultat na koncu vrni na mesto izvirnika",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Z -q vhode z enako vsebino obdelaj enkrat, rezultat pa poveži "
+        "(reflink ali trda povezava) na cilje ostalih kopij",
+    )
+    parser.add_argument(
+        "--policy",
+        type=normaliziraj_pot_argumenta,
+        metavar="DATOTEKA",
+        help="Z -q preberi pravila za zvok (dovoljeni kodeki, največ kanalov, "
+        "ciljni kodek, bitne hitrosti) iz JSON DATOTEKE (privzeto "
+        "~/.config/bac/pravila.json, če obstaja)",
+    )
+    parser.add_argument(
+        "--all-audio",
+        action="store_true",
+        help="Z -q ohrani vse zvočne sledi namesto ene (angleške); sledi, ki jih "
+        "pravila ne dovolijo, ffmpeg pretvori v enem prehodu",
+    )
+    parser.add_argument(
+        "--chunk-worker",
+        type=normaliziraj_pot_argumenta,
+        metavar="MAPA",
+        help="Kodiraj kose iz delovne mape .bac-deli videa, ki se kodira po "
+        "kosih (npr. na skupni mapi), nato izstopi",
+    )
     tema_skupina = parser.add_mutually_exclusive_group()
     tema_skupina.add_argument(
         "--light", action="store_true", help="Uporabi svetlo temo"
@@ -3658,10 +7438,58 @@ Primeri:
 
     args = parser.parse_args()
 
-    if args.quick > 0:
+    if args.shard and not args.quick:
+        parser.error("--shard deluje samo skupaj z -q ali -qq")
+    if args.watch is not None and not args.quick:
+        parser.error("--watch deluje samo skupaj z -q ali -qq")
+    if args.scratch_dir:
+        if not args.quick:
+            parser.error("--scratch-dir deluje samo skupaj z -q ali -qq")
+        if not os.path.isdir(args.scratch_dir):
+            parser.error(f"mapa '{args.scratch_dir}' ne obstaja")
+    if args.output_dir:
+        if not args.quick:
+            parser.error("--output-dir deluje samo skupaj z -q ali -qq")
+        if os.path.abspath(args.output_dir) == os.getcwd():
+            parser.error("--output-dir mora biti druga mapa kot trenutni imenik")
+    if args.io_limit and not args.quick:
+        parser.error("--io-limit deluje samo skupaj z -q ali -qq")
+    if args.dedupe and not args.quick:
+        parser.error("--dedupe deluje samo skupaj z -q ali -qq")
+    if args.move_back and not (args.quick >= 2 and args.output_dir):
+        parser.error("--move-back deluje samo skupaj z -qq in --output-dir")
+    if args.policy and not args.quick:
+        parser.error("--policy deluje samo skupaj z -q ali -qq")
+    if args.all_audio and not args.quick:
+        parser.error("--all-audio deluje samo skupaj z -q ali -qq")
+    pravila_zvoka = None
+    if args.quick:
+        try:
+            pravila_zvoka = PravilaZvoka.preberi(args.policy)
+        except (OSError, ValueError, TypeError) as e:
+            pot = args.policy or PravilaZvoka.PRIVZETA_POT
+            parser.error(f"napaka v pravilih '{pot}': {e}")
+
+    if args.chunk_worker:
+        if args.quick:
+            parser.error("--chunk-worker ne deluje skupaj z -q ali -qq")
+        delavec_kosov(os.path.abspath(args.chunk_worker))
+    elif args.quick > 0:
         # CLI način
         izbrisi = args.quick >= 2
-        hitro_pretvorba_cli(izbrisi_izvorne=izbrisi)
+        hitro_pretvorba_cli(
+            izbrisi_izvorne=izbrisi,
+            del_knjiznice=args.shard,
+            opazuj=args.watch,
+            zacasna_mapa=args.scratch_dir and os.path.abspath(args.scratch_dir),
+            izhodna_mapa=args.output_dir and os.path.abspath(args.output_dir),
+            vrni_nazaj=args.move_back,
+            trajnost=args.durability,
+            omejitev_io=args.io_limit,
+            zdruzi_dvojnike=args.dedupe,
+            pravila_zvoka=pravila_zvoka,
+            vse_zvocne=args.all_audio,
+        )
     else:
         # GUI način
         # Določi temo